@@ -0,0 +1,85 @@
+"""
+Measures how the Admin Forms server's throughput and latency scale with
+concurrency, and compares servers.
+
+Usage:
+    python -m benchmarks.admin_load <url>... [<requests>] [<concurrency>...]
+
+Sends `requests` GET requests (default 200) to each `url` at each concurrency
+level (default 1 2 4 8 16) and reports throughput and latency percentiles.
+Start the servers first, for example the Flask app under gunicorn and the
+ASGI build under uvicorn workers:
+
+    $ gunicorn --workers 4 --threads 4 --bind :8000 \\
+          'm3c.server:create_app("config.yaml")'
+    $ gunicorn --workers 4 --worker-class uvicorn.workers.UvicornWorker \\
+          --bind :8001 'm3c.asgi:create_app("config.yaml")'
+    $ python -m benchmarks.admin_load \\
+          'http://localhost:8000/api/people?q=an' \\
+          'http://localhost:8001/api/people?q=an'
+"""
+
+from typing import List
+
+import concurrent.futures
+import statistics
+import sys
+import threading
+import time
+
+import requests
+
+
+DEFAULT_REQUESTS = 200
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16]
+
+
+def percentile(latencies: List[float], fraction: float) -> float:
+    """Returns the `fraction` percentile of sorted `latencies`."""
+    return latencies[max(0, int(len(latencies) * fraction + 0.5) - 1)]
+
+
+def run(url: str, total: int, concurrency: int) -> List[float]:
+    """Returns the latency of each request in seconds."""
+    local = threading.local()
+
+    def get(_: int) -> float:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.get(url)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        return list(executor.map(get, range(total)))
+
+
+def main():
+    urls = [arg for arg in sys.argv[1:] if "://" in arg]
+    numbers = [int(arg) for arg in sys.argv[1:] if "://" not in arg]
+    if not urls:
+        print(__doc__)
+        sys.exit(2)
+
+    total = numbers[0] if numbers else DEFAULT_REQUESTS
+    levels = numbers[1:] or DEFAULT_CONCURRENCY
+
+    for url in urls:
+        run(url, min(total, 10), 1)  # Warm up connections and caches.
+
+    print(f"{'server':<40}{'concurrency':>12}{'req/s':>10}"
+          f"{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for concurrency in levels:
+        for url in urls:
+            start = time.perf_counter()
+            latencies = sorted(run(url, total, concurrency))
+            elapsed = time.perf_counter() - start
+            p50 = statistics.median(latencies) * 1e3
+            p99 = percentile(latencies, 0.99) * 1e3
+            print(f"{url[:39]:<40}{concurrency:>12}{total / elapsed:>10.1f}"
+                  f"{p50:>10.1f}{p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
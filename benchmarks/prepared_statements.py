@@ -0,0 +1,79 @@
+"""
+Compares per-call latency of prepared and plain statements in `m3c.db`.
+
+Usage:
+    python -m benchmarks.prepared_statements <config> [<calls>]
+
+Runs against the Supplemental database named in the config file. Everything
+runs in one transaction that is rolled back, so nothing is written.
+"""
+
+from typing import Callable
+
+import statistics
+import sys
+import time
+
+from m3c import config
+from m3c import connections
+from m3c import db
+
+
+def measure(calls: int, call: Callable[[int], None]) -> float:
+    """Returns the median latency of `call` in microseconds."""
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter()
+        call(i)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(2)
+
+    cfg = config.load(sys.argv[1])
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    pool = connections.create_pool(cfg, connections.SUPPLEMENTAL, "benchmark")
+
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM people ORDER BY id LIMIT 1000")
+            people = [row[0] for row in cursor]
+            assert people, "The people table is empty"
+
+            # Helpers register their statements the first time they run.
+            db.get_contact_details(cursor, people[0])
+            db.get_organization(cursor, "laboratory", "Benchmark", 1)
+            db.upsert_publication(cursor, "benchmark-0", "<xml/>")
+
+            cases = {
+                "get_contact_details": (
+                    db.STATEMENTS["get_contact_details"].sql,
+                    lambda i: (people[i % len(people)],)),
+                "get_organization": (
+                    db.STATEMENTS["get_organization"].sql,
+                    lambda i: (f"Benchmark {i}", "laboratory", 1)),
+                "upsert_publication": (
+                    db.STATEMENTS["upsert_publication"].sql,
+                    lambda i: (f"benchmark-{i % 100}", "<xml/>")),
+            }
+
+            print(f"{'statement':<24}{'plain (us)':>12}{'prepared (us)':>15}")
+            for name, (sql, params) in cases.items():
+                plain = measure(calls, lambda i: cursor.execute(
+                    sql, params(i)))
+                prepared = measure(calls, lambda i: db.execute_prepared(
+                    cursor, name, sql, params(i)))
+                print(f"{name:<24}{plain:>12.1f}{prepared:>15.1f}")
+    finally:
+        conn.rollback()
+        pool.putconn(conn)
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
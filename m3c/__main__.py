@@ -36,16 +36,24 @@ def main():
 
     if args.cmd == "prefill":
         from m3c import prefill
-        prefill.prefill(args.config)
+        prefill.prefill(args.config, args.bulk)
+    elif args.cmd == "serve" and args.asgi:
+        from m3c import asgi
+        asgi.serve(args.config)
     elif args.cmd == "serve":
         from m3c import server
         server.serve(args.config)
     elif args.cmd == "generate":
         from m3c import triples
         triples.generate(args.config, args.diff)
+    elif args.cmd == "migrate":
+        from m3c import migrate
+        if not migrate.migrate(args.config, args.check):
+            sys.exit(1)
     elif args.cmd == "pubfetch":
         from m3c import pubfetch
-        pubfetch.pubfetch(args.config, args.authorships, args.delay, args.max)
+        pubfetch.pubfetch(args.config, args.authorships, args.delay, args.max,
+                          args.refresh, args.resume)
 
     logger.debug(f"{PROGRAM} ended")
 
@@ -60,15 +68,27 @@ def parse_args(args):
     subparsers = parser.add_subparsers(
         title="Sub-commands", description="Valid subcommands", dest="cmd"
     )
-    subparsers.add_parser(
+    prefillcmd = subparsers.add_parser(
         "prefill",
         help="downloads and processes data from the Metabolomics Workbench",
     )
+    prefillcmd.add_argument(
+        "--bulk", action="store_true", default=False,
+        help="resolve all records in memory and write them with set-based "
+             "statements"
+    )
     generate = subparsers.add_parser(
         "generate",
         help="generates N-Triples for import into the People Portal"
     )
     generate.add_argument("-x", "--diff", help="path for differential update")
+    migratecmd = subparsers.add_parser(
+        "migrate", help="updates the Supplemental database's schema"
+    )
+    migratecmd.add_argument(
+        "--check", action="store_true", default=False,
+        help="verify that the hot queries can use indexes"
+    )
     pubfetchcmd = subparsers.add_parser(
         "pubfetch", help="downloads PubMed publication data"
     )
@@ -82,12 +102,24 @@ def parse_args(args):
     )
     pubfetchcmd.add_argument(
         "--max", type=nat, default=-1,
-        help="maximum number of authorship searches to perform"
+        help="maximum number of PubMed and Catalyst requests to make"
+    )
+    pubfetchcmd.add_argument(
+        "--refresh", action="store_true", default=False,
+        help="ignore cached PubMed and Catalyst results"
+    )
+    pubfetchcmd.add_argument(
+        "--resume", action="store_true", default=False,
+        help="continue the last interrupted run"
     )
-    subparsers.add_parser(
+    servecmd = subparsers.add_parser(
         "serve",
         help="starts an HTTP server for the Admin Forms"
     )
+    servecmd.add_argument(
+        "--asgi", action="store_true", default=False,
+        help="serve the ASGI build (requires the asgi extra)"
+    )
     parser.add_argument("config", help="path to the YAML configuration file")
     parsed = parser.parse_args(args)
     return parsed
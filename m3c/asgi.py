@@ -0,0 +1,176 @@
+"""
+M3C Admin Forms Server (ASGI)
+
+An ASGI build of the Admin Forms for serving many concurrent users and health
+probes from one process. The read-only JSON APIs, photos and `/healthz` are
+served by async endpoints that never block the event loop: `Database` runs the
+`m3c.db` functions on pooled connections in a thread pool sized to the pool.
+Every other route, including all the forms and their templates, is served by
+the Flask app of `m3c.server` mounted under the same prefix.
+
+It requires the `asgi` extra:
+
+    $ pip install m3c[asgi]
+    $ gunicorn --workers 4 --worker-class uvicorn.workers.UvicornWorker \\
+          'm3c.asgi:create_app("config.yaml")'
+
+or, for a single process, `m3c serve --asgi config.yaml`.
+"""
+
+from typing import Any, Callable, TypeVar
+
+from http import HTTPStatus
+import asyncio
+import concurrent.futures
+import os
+
+import werkzeug.http
+
+from m3c import connections
+from m3c import db
+from m3c import mwb
+from m3c import server
+
+try:
+    from starlette.applications import Starlette
+    from starlette.middleware.wsgi import WSGIMiddleware
+    from starlette.requests import Request
+    from starlette.responses import FileResponse, JSONResponse, Response
+    from starlette.routing import Mount, Route
+except ImportError:
+    Starlette = None
+
+
+T = TypeVar("T")
+
+
+class Database:
+    """
+    Async adapter for `m3c.db`.
+
+    Examples
+    --------
+    ```
+        database = Database(pool)
+        overview = await database.run(db.get_overview, person_id)
+    ```
+
+    Each call borrows a connection from the pool for one transaction, like
+    `Pool.connection`, on a thread of its own so the event loop keeps serving
+    other requests while the query runs.
+    """
+
+    def __init__(self, pool: connections.Pool):
+        self.pool = pool
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=pool.size, thread_name_prefix="db")
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        """Returns `function(cursor, *args)`."""
+        def call() -> T:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    return function(cursor, *args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, call)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def create_app(config_path: str):
+    """Creates the ASGI app. The Flask app serves all other routes."""
+    assert Starlette is not None, (
+        "The ASGI server requires the asgi extra: pip install m3c[asgi]"
+    )
+
+    flask_app = server.create_app(config_path)
+    return build_app(flask_app, Database(server.pool),
+                     os.getenv("APPLICATION_ROOT", ""))
+
+
+def build_app(flask_app, database: Database, prefix: str = ""):
+    """
+    Serves the async routes under `prefix`, where `flask_app` serves the
+    Admin Forms, and passes every other request on to `flask_app`.
+    """
+    async def healthz(request: Request) -> Response:
+        """Reports that the server is up, and the database too with ?db=1."""
+        if request.query_params.get("db"):
+            await database.run(lambda cursor: cursor.execute("SELECT 1"))
+        return JSONResponse({"status": "ok"})
+
+    async def api_people(request: Request) -> Response:
+        try:
+            text, limit, after = server.search_params(request.query_params)
+        except ValueError:
+            return JSONResponse({"error": "bad limit or cursor"},
+                                HTTPStatus.BAD_REQUEST)
+        rows = await database.run(db.search_people, text, limit + 1, after)
+        return JSONResponse(server.page(rows, limit, server.PERSON_FIELDS))
+
+    async def api_organizations(request: Request) -> Response:
+        type = request.query_params.get("type") or None
+        if type not in [None, mwb.INSTITUTE, mwb.DEPARTMENT, mwb.LABORATORY]:
+            return JSONResponse({"error": "bad type"}, HTTPStatus.BAD_REQUEST)
+        try:
+            text, limit, after = server.search_params(request.query_params)
+        except ValueError:
+            return JSONResponse({"error": "bad limit or cursor"},
+                                HTTPStatus.BAD_REQUEST)
+        rows = await database.run(db.search_organizations, text, limit + 1,
+                                  after, type)
+        return JSONResponse(server.page(rows, limit,
+                                        server.ORGANIZATION_FIELDS))
+
+    async def photo(request: Request) -> Response:
+        try:
+            pid = int(request.query_params.get("id", "0"))
+        except ValueError:
+            pid = 0
+        if pid <= 0:
+            return Response("id required", HTTPStatus.BAD_REQUEST)
+
+        found = server.find_photo(pid,
+                                  request.query_params.get("size") == "thumb")
+        if not found:
+            return Response("", HTTPStatus.NOT_FOUND)
+
+        filename, mimetype, stat, max_age = found
+        etag, modified = server.photo_validators(stat)
+        headers = {
+            "ETag": f'"{etag}"',
+            "Last-Modified": werkzeug.http.http_date(modified),
+            "Cache-Control": (f"public, max-age={max_age}" if max_age
+                              else "public, no-cache"),
+        }
+        conditions = {
+            "REQUEST_METHOD": request.method,
+            "HTTP_IF_NONE_MATCH": request.headers.get("if-none-match", ""),
+            "HTTP_IF_MODIFIED_SINCE":
+                request.headers.get("if-modified-since", ""),
+        }
+        if not werkzeug.http.is_resource_modified(conditions, etag=etag,
+                                                  last_modified=modified):
+            return Response(status_code=HTTPStatus.NOT_MODIFIED,
+                            headers=headers)
+        return FileResponse(filename, media_type=mimetype, headers=headers,
+                            stat_result=stat)
+
+    app = Starlette(
+        routes=[
+            Route(f"{prefix}/healthz", healthz),
+            Route(f"{prefix}/api/people", api_people),
+            Route(f"{prefix}/api/organizations", api_organizations),
+            Route(f"{prefix}/photo", photo),
+            Mount("", app=WSGIMiddleware(flask_app)),
+        ],
+        on_shutdown=[database.close],
+    )
+    return app
+
+
+def serve(config_path: str, host: str = "127.0.0.1", port: int = 5000):
+    import uvicorn
+    uvicorn.run(create_app(config_path), host=host, port=port)
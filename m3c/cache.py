@@ -0,0 +1,259 @@
+"""
+Caches of responses from remote services and of database reads
+
+`ResponseCache` stores responses in a SQLite database keyed by a fingerprint
+(SHA-256) of the request, e.g. the XML payload sent to Catalyst or a PubMed
+search term. `MemoryCache` keeps values read from the database in memory,
+tagged by the tables they were read from so writes can invalidate them.
+
+Entries of both expire after a time-to-live and, once a cache holds more than
+`max_entries`, the least recently used entries are evicted. `ResponseCache`
+evicts in batches, every `evict_every` stores and when closed.
+
+The caches are safe to share between threads.
+"""
+
+from typing import (
+    Any, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, Union
+)
+
+import collections
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_TTL = datetime.timedelta(days=7)
+DEFAULT_MAX_ENTRIES = 100000
+# Responses stored between two evictions from the on-disk cache.
+DEFAULT_EVICT_EVERY = 1000
+
+DEFAULT_MEMORY_TTL = datetime.timedelta(minutes=5)
+DEFAULT_MEMORY_MAX_ENTRIES = 256
+
+T = TypeVar("T")
+
+
+class ResponseCache:
+    """
+    On-disk cache of lists of identifiers returned by remote services.
+
+    Examples
+    --------
+    ```
+        cache = ResponseCache("pubfetch.sqlite")
+        key = ResponseCache.fingerprint("esearch", term)
+        pmids = cache.get(key)
+        if pmids is None:
+            pmids = pubmed_esearch(term)
+            cache.put(key, pmids)
+    ```
+
+    If `refresh` is set, every lookup misses but responses are still stored.
+    """
+
+    def __init__(self, path: str,
+                 ttl: datetime.timedelta = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 refresh: bool = False,
+                 evict_every: int = DEFAULT_EVICT_EVERY):
+        assert max_entries > 0 and evict_every > 0
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint TEXT PRIMARY KEY,
+                response    TEXT NOT NULL,
+                created     REAL NOT NULL,
+                accessed    REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed
+                ON responses (accessed);
+        """)
+
+    def close(self):
+        with self._lock:
+            if self._puts:
+                self._evict(time.time())
+            self._conn.close()
+
+    @staticmethod
+    def fingerprint(namespace: str, request: Union[str, bytes]) -> str:
+        """Returns a key identifying `request` made to the `namespace`."""
+        if isinstance(request, str):
+            request = request.encode("utf-8")
+        digest = hashlib.sha256()
+        digest.update(namespace.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(request)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Returns the cached response or `None` if missing or expired."""
+        if self.refresh:
+            self.misses += 1
+            return None
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE fingerprint=?",
+                (key,)).fetchone()
+            if not row or row[1] + self.ttl.total_seconds() < now:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed=? WHERE fingerprint=?",
+                (now, key))
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, key: str, response: List[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO responses
+                       (fingerprint, response, created, accessed)
+                VALUES (?, ?, ?, ?)
+            """, (key, json.dumps(response), now, now))
+            self._puts += 1
+            if self._puts >= self.evict_every:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._puts = 0
+        expiry = now - self.ttl.total_seconds()
+        self._conn.execute("DELETE FROM responses WHERE created < ?",
+                           (expiry,))
+        self._conn.execute("""
+            DELETE FROM responses
+             WHERE fingerprint IN (
+                SELECT fingerprint FROM responses
+                 ORDER BY accessed DESC
+                 LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+
+class MemoryCache:
+    """
+    In-process cache of values read from database tables.
+
+    Examples
+    --------
+    ```
+        cache = MemoryCache()
+        orgs = cache.get_or_load("organizations", ["organizations"],
+                                 lambda: list(db.get_organizations(cursor)))
+        ...
+        cache.invalidate("organizations")  # after writing to the table
+    ```
+
+    Cached values are shared between callers, so they must not be modified.
+    A value loaded while one of its tables is invalidated isn't cached, as it
+    may have been read before the write.
+    """
+
+    def __init__(self, ttl: datetime.timedelta = DEFAULT_MEMORY_TTL,
+                 max_entries: int = DEFAULT_MEMORY_MAX_ENTRIES):
+        assert max_entries > 0
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._lock = threading.Lock()
+        # key => (expiry, tables, value), least recently used first.
+        self._entries: Dict[str, Tuple[float, frozenset, Any]] = \
+            collections.OrderedDict()
+        # Bumped by `clear` and, per table, by `invalidate`.
+        self._epoch = 0
+        self._generations: Dict[str, int] = collections.defaultdict(int)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._epoch += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value or `None` if missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry[0] < now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def get_or_load(self, key: str, tables: Iterable[str],
+                    load: Callable[[], T]) -> T:
+        """
+        Returns the cached value, calling `load` to read it from `tables`
+        if it is missing or expired.
+        """
+        value = self.get(key)
+        if value is None:
+            tables = frozenset(tables)
+            with self._lock:
+                version = self._version(tables)
+            value = load()
+            with self._lock:
+                if self._version(tables) == version:
+                    self._store(key, value, tables)
+        return value
+
+    def invalidate(self, *tables: str) -> int:
+        """Drops the values read from any of `tables`, returning how many."""
+        with self._lock:
+            stale = [key for key, (_, read_from, _) in self._entries.items()
+                     if not read_from.isdisjoint(tables)]
+            for key in stale:
+                del self._entries[key]
+            for table in tables:
+                self._generations[table] += 1
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def put(self, key: str, value: Any, tables: Iterable[str]) -> None:
+        with self._lock:
+            self._store(key, value, frozenset(tables))
+
+    def _store(self, key: str, value: Any, tables: frozenset) -> None:
+        expiry = time.monotonic() + self.ttl.total_seconds()
+        self._entries[key] = (expiry, tables, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _version(self, tables: frozenset) -> Tuple[int, ...]:
+        return (self._epoch,) + tuple(self._generations[table]
+                                      for table in sorted(tables))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
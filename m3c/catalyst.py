@@ -4,18 +4,153 @@ Interface to the Harvard PubMed Disambiguation Tool's Profiles Catalyst service
 See http://profiles.catalyst.harvard.edu/docs/ProfilesRNS_DisambiguationEngine.pdf
 """
 
+import concurrent.futures
 import sys
+import time
 import traceback
-from typing import List
+from typing import List, Optional
 import xml.etree.ElementTree as ET
 
 import requests
+import requests.adapters
 
+from m3c.cache import ResponseCache
 from m3c.classes import Person
+from m3c.schedule import Budget
 
 
 ENDPOINT = "http://profiles.catalyst.harvard.edu/services/GetPMIDs/default.asp"
 
+# Statuses worth retrying: rate limiting and transient server errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CatalystError(Exception):
+    pass
+
+
+class Client:
+    """
+    Catalyst client that reuses pooled connections.
+
+    Requests may be made synchronously with `fetch_ids` or concurrently with
+    `submit`, which runs up to `workers` requests at a time. Failed requests
+    are retried `retries` times with exponential backoff, starting at
+    `backoff` seconds.
+
+    If a `cache` is given, successful responses are stored in it and
+    identical requests are answered from it.
+
+    Requests that still fail after the retries, or whose response can't be
+    parsed, raise `CatalystError` and aren't cached. If a `budget` is given,
+    each request that isn't answered from the cache spends from it, raising
+    `BudgetExhausted` once it runs out.
+    """
+
+    def __init__(self, endpoint: str = ENDPOINT, workers: int = 4,
+                 timeout: float = 60, retries: int = 3, backoff: float = 1,
+                 cache: Optional[ResponseCache] = None,
+                 budget: Optional[Budget] = None):
+        assert workers > 0
+        self.endpoint = endpoint
+        self.cache = cache
+        self.budget = budget
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "text/xml"})
+
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, a, b, c):
+        self.close()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+    def fetch_ids(self, person: Person, affiliations: List[str],
+                  include_pmids: List[str], exclude_pmids: List[str]) \
+            -> List[str]:
+        """
+        Gets the disambiguated PubMed publications.
+
+        Must pass affiliations and include_pmids.
+        """
+        assert len(affiliations) > 0 and len(include_pmids) > 0
+
+        payload_xml = build_catalyst_xml(
+            person, affiliations, include_pmids, exclude_pmids)
+
+        key = ""
+        if self.cache:
+            key = ResponseCache.fingerprint(self.endpoint, payload_xml)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        if self.budget:
+            self.budget.charge()
+        resp = self._post(payload_xml)
+        if resp.status_code != 200:
+            raise CatalystError(
+                f"Unexpected response from Catalyst: {resp.status_code}")
+
+        pmids = parse_catalyst_pmids(resp.text)
+        if pmids is None:
+            raise CatalystError("Unable to parse the response from Catalyst")
+        if self.cache:
+            self.cache.put(key, pmids)
+        return pmids
+
+    def submit(self, person: Person, affiliations: List[str],
+               include_pmids: List[str], exclude_pmids: List[str]) \
+            -> "concurrent.futures.Future[List[str]]":
+        """
+        Schedules `fetch_ids` to run in the background.
+
+        Use `concurrent.futures.as_completed` to collect results as they
+        arrive.
+        """
+        if not self._executor:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="catalyst")
+        return self._executor.submit(self.fetch_ids, person, affiliations,
+                                     include_pmids, exclude_pmids)
+
+    def _post(self, payload_xml: str) -> requests.Response:
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.post(self.endpoint, data=payload_xml,
+                                         timeout=self.timeout)
+                if resp.status_code not in RETRY_STATUSES \
+                        or attempt >= self.retries:
+                    return resp
+                reason = f"status {resp.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                reason = type(e).__name__
+
+            delay = self.backoff * 2 ** attempt
+            attempt += 1
+            print(f"Catalyst request failed ({reason}). Retrying after "
+                  f"{delay} second(s).", file=sys.stderr)
+            time.sleep(delay)
+
 
 def build_catalyst_xml(person: Person, affiliations: List[str],
                        include_pmids: List[str], exclude_pmids: List[str]) \
@@ -69,9 +204,10 @@ def build_catalyst_xml(person: Person, affiliations: List[str],
     return ET.tostring(root)
 
 
-def parse_catalyst_pmids(catalyst_xml: str) -> List[str]:
+def parse_catalyst_pmids(catalyst_xml: str) -> Optional[List[str]]:
     """
-    Parse out the PMIDs from the Catalyst results XML.
+    Parse out the PMIDs from the Catalyst results XML, or None if it can't be
+    parsed.
 
     This XML looks like:
     ```
@@ -98,7 +234,7 @@ def parse_catalyst_pmids(catalyst_xml: str) -> List[str]:
         return [pmid.text for pmid in root]
     except Exception:
         traceback.print_exc()
-        return []
+        return None
 
 
 def fetch_ids(person: Person, affiliations: List[str],
@@ -109,17 +245,6 @@ def fetch_ids(person: Person, affiliations: List[str],
 
     Must pass affiliations and include_pmids.
     """
-    assert len(affiliations) > 0 and len(include_pmids) > 0
-
-    payload_xml = build_catalyst_xml(
-        person, affiliations, include_pmids, exclude_pmids)
-    headers = {
-        "Content-Type": "text/xml"
-    }
-    resp = requests.post(ENDPOINT, data=payload_xml, headers=headers)
-    if resp.status_code != 200:
-        print("Unexpected response from Catalyst", resp.status_code,
-              file=sys.stderr)
-        return []
-
-    return parse_catalyst_pmids(resp.text)
+    with Client() as client:
+        return client.fetch_ids(person, affiliations, include_pmids,
+                                exclude_pmids)
@@ -255,6 +255,9 @@ class Photo(object):
     def filename(self) -> str:
         return f"photo.{self.extension}"
 
+    def thumbnail_filename(self) -> str:
+        return f"thumbnail.{self.extension}"
+
     def get_triples(self, namespace: Text) -> List[Text]:
         person_uri = Person.uri(namespace, self.person_id)
         person = f"<{person_uri}>"
@@ -0,0 +1,196 @@
+"""
+Connection pools for the Supplemental and Metabolomics Workbench databases
+
+Every command borrows its database connections from a `Pool` created here
+rather than calling `psycopg2.connect` itself. Connection parameters come from
+the config file, using the `sup_` or `mwb_` prefixed keys:
+
+    sup_host, sup_port, sup_database, sup_username, sup_password
+
+All connections use TCP keepalives so long-running commands notice dropped
+connections. `db_statement_timeout` (milliseconds, 0 disables it) limits how
+long any statement may run, and `db_pool_sizes` maps each command (prefill,
+pubfetch, generate, serve) to the most connections it may hold per database.
+
+Pools are thread-safe. Borrowing from an exhausted pool waits for another
+thread to return a connection instead of failing.
+
+A `Listener` keeps its own connection open to receive `NOTIFY` messages, such
+as those sent on `CHANGES_CHANNEL` when the people or organizations tables
+change (see `m3c.migrate`).
+"""
+
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import contextlib
+import logging
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from m3c import config
+
+
+Connection = psycopg2.extensions.connection
+
+SUPPLEMENTAL = "sup"
+WORKBENCH = "mwb"
+
+# Receives the name of each Supplemental table written to by a transaction.
+CHANGES_CHANNEL = "m3c_changes"
+
+DEFAULT_POOL_SIZES = {
+    "generate": 1,
+    "prefill": 2,
+    "pubfetch": 1,
+    "serve": 8,
+}
+
+KEEPALIVES = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 5,
+}
+
+
+class Pool:
+    """
+    Thread-safe pool of connections to one database.
+
+    Examples
+    --------
+    ```
+        pool = create_pool(cfg, SUPPLEMENTAL, "prefill")
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                ...
+        pool.close()
+    ```
+    """
+
+    def __init__(self, size: int, **params: Any):
+        assert size > 0
+        self.size = size
+        self._available = threading.BoundedSemaphore(size)
+        # psycopg2 closes returned connections beyond `minconn` rather than
+        # keeping them for reuse, so both bounds are the pool's size.
+        self._pool = psycopg2.pool.ThreadedConnectionPool(size, size,
+                                                          **params)
+
+    def getconn(self) -> Connection:
+        """Borrows a connection, waiting for one if all are in use."""
+        self._available.acquire()
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn: Connection) -> None:
+        """Returns a borrowed connection, rolling back any open transaction."""
+        try:
+            self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._available.release()
+
+    @contextlib.contextmanager
+    def connection(self) -> Iterator[Connection]:
+        """
+        Borrows a connection for one transaction.
+
+        The transaction is committed if the block succeeds and rolled back if
+        it raises.
+        """
+        conn = self.getconn()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self) -> None:
+        self._pool.closeall()
+
+
+class Listener(threading.Thread):
+    """
+    Background thread calling `callback` with the payload of every
+    notification sent on `channel`.
+
+    The callback is also called with `None` whenever the listener
+    (re)connects, since notifications sent while it was disconnected are
+    lost.
+    """
+
+    def __init__(self, channel: str,
+                 callback: Callable[[Optional[str]], None],
+                 retry_interval: float = 5.0, **params: Any):
+        super().__init__(name=f"listen {channel}", daemon=True)
+        self.channel = channel
+        self.callback = callback
+        self.retry_interval = retry_interval
+        self.params = params
+        self._stopping = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.params)
+                conn.set_isolation_level(
+                    psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                self.callback(None)
+                self._receive(conn)
+            except Exception:
+                logging.exception("Listening on %s", self.channel)
+            finally:
+                if conn is not None:
+                    conn.close()
+            self._stopping.wait(self.retry_interval)
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _receive(self, conn: Connection) -> None:
+        while not self._stopping.is_set():
+            # Wake up regularly to notice that the listener was stopped.
+            if not select.select([conn], [], [], 1.0)[0]:
+                continue
+            conn.poll()
+            while conn.notifies:
+                self.callback(conn.notifies.pop(0).payload)
+
+
+def connection_params(cfg: config.Config, database: str,
+                      application: str) -> Dict[str, Any]:
+    """Returns the `psycopg2.connect` arguments for `database`."""
+    assert database in [SUPPLEMENTAL, WORKBENCH]
+    params: Dict[str, Any] = {
+        "host": cfg.get(f"{database}_host"),
+        "port": cfg.get(f"{database}_port"),
+        "dbname": cfg.get(f"{database}_database"),
+        "user": cfg.get(f"{database}_username"),
+        "password": cfg.get(f"{database}_password"),
+        "application_name": f"m3c {application}",
+    }
+    params.update(KEEPALIVES)
+
+    timeout = int(cfg.get("db_statement_timeout", 0))
+    if timeout > 0:
+        params["options"] = f"-c statement_timeout={timeout}"
+
+    return params
+
+
+def create_pool(cfg: config.Config, database: str, command: str) -> Pool:
+    """Creates a pool sized for `command` from the config file."""
+    sizes = dict(DEFAULT_POOL_SIZES)
+    sizes.update(cfg.get("db_pool_sizes") or {})
+    size = int(sizes.get(command, 1))
+    return Pool(size, **connection_params(cfg, database, command))
@@ -1,10 +1,16 @@
-from typing import Dict, Iterable, List, Mapping, Optional, Type, Tuple
+from typing import (
+    Dict, Iterable, List, Mapping, Optional, Sequence, Set, Type, Tuple
+)
 
 import datetime
 import io
+import threading
+import weakref
+import xml.etree.ElementTree as ET
 
 import psycopg2
 import psycopg2.extensions
+import psycopg2.extras
 
 from m3c import mwb
 
@@ -12,6 +18,55 @@ Cursor = Type[psycopg2.extensions.cursor]
 Connection = Type[psycopg2.extensions.connection]
 
 
+class PreparedStatement:
+    """
+    Statement that is parsed and planned once per connection.
+
+    The first time the statement runs on a connection it is sent with
+    `PREPARE`; later calls only send `EXECUTE` with the parameters. `sql` uses
+    the same `%s` placeholders as `cursor.execute`. Cursors that don't belong
+    to a Postgres connection (e.g. SQLite in tests) run `sql` directly.
+    """
+
+    # Names of the statements prepared on each open connection.
+    _prepared: "weakref.WeakKeyDictionary[object, Set[str]]" = \
+        weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+        parts = sql.split("%s")
+        self.arity = len(parts) - 1
+        numbered = "".join(f"{part}${i}" for i, part in
+                           enumerate(parts[:-1], start=1)) + parts[-1]
+        self.prepare = f"PREPARE {name} AS {numbered}"
+        params = ", ".join(["%s"] * self.arity)
+        self.execute_sql = f"EXECUTE {name} ({params})" if params \
+            else f"EXECUTE {name}"
+
+    def execute(self, cursor: Cursor, params: Sequence = ()) -> None:
+        assert len(params) == self.arity
+        if not isinstance(cursor, psycopg2.extensions.cursor):
+            cursor.execute(self.sql, params)
+            return
+
+        conn = cursor.connection
+        with self._lock:
+            prepared = self._prepared.setdefault(conn, set())
+            ready = self.name in prepared
+        if not ready:
+            cursor.execute(self.prepare)
+            with self._lock:
+                prepared.add(self.name)
+        cursor.execute(self.execute_sql, params)
+
+
+# Statements run through `execute_prepared`, by name.
+STATEMENTS: Dict[str, PreparedStatement] = {}
+
+
 def add_organization(cursor: Cursor, type: str, name: str,
                      parent_id: Optional[int] = None) -> int:
     assert type in [mwb.INSTITUTE, mwb.DEPARTMENT, mwb.LABORATORY]
@@ -24,13 +79,31 @@ def add_organization(cursor: Cursor, type: str, name: str,
           RETURNING id
     '''
 
-    cursor.execute(insert_org, (name, type, parent_id))
+    execute_prepared(cursor, "add_organization", insert_org,
+                     (name, type, parent_id))
     assert cursor.rowcount == 1
     row = cursor.fetchone()
 
     return row[0]
 
 
+def add_names(cursor: Cursor, names: Iterable[Tuple[int, str, str]]) \
+        -> List[Tuple[int, str, str]]:
+    """
+    Adds (person_id, first_name, last_name) aliases, returning those added.
+    Names already in use are skipped.
+    """
+    insert = """
+        INSERT INTO names (person_id, first_name, last_name)
+             VALUES %s
+        ON CONFLICT DO NOTHING
+          RETURNING person_id, first_name, last_name
+    """
+    rows = psycopg2.extras.execute_values(cursor, insert, list(names),
+                                          fetch=True)
+    return [tuple(row) for row in rows]
+
+
 def add_person(cursor: Cursor,
                first_name: str, last_name: str, email: str, phone: str) -> int:
 
@@ -44,7 +117,8 @@ def add_person(cursor: Cursor,
     last_name = last_name.strip()
 
     display_name = f'{first_name} {last_name}'
-    cursor.execute(statement, (display_name, email, phone))
+    execute_prepared(cursor, "add_person", statement,
+                     (display_name, email, phone))
 
     person_id = cursor.fetchone()[0]
 
@@ -53,21 +127,208 @@ def add_person(cursor: Cursor,
              VALUES       (%s       , %s        , %s       )
     '''
 
-    cursor.execute(statement, (person_id, first_name, last_name))
+    execute_prepared(cursor, "add_name", statement,
+                     (person_id, first_name, last_name))
 
     return person_id
 
 
+def allocate_ids(cursor: Cursor, table: str, count: int) -> List[int]:
+    """Reserve `count` IDs from the sequence of `table`'s `id` column."""
+    if count <= 0:
+        return []
+    select = """
+        SELECT nextval(pg_get_serial_sequence(%s, 'id'))
+          FROM generate_series(1, %s)
+    """
+    cursor.execute(select, (table, count))
+    return [row[0] for row in cursor]
+
+
 def associate(cursor: Cursor, person_id: int, organization_id: int) -> bool:
     insert_association = '''
         INSERT INTO associations (person_id, organization_id)
              VALUES              (%s       , %s             )
         ON CONFLICT DO NOTHING
     '''
-    cursor.execute(insert_association, (person_id, organization_id))
+    execute_prepared(cursor, "associate", insert_association,
+                     (person_id, organization_id))
     return cursor.rowcount == 1
 
 
+def associate_many(cursor: Cursor, pairs: Iterable[Tuple[int, int]]) \
+        -> List[Tuple[int, int]]:
+    """
+    Associate people with organizations using a single statement.
+
+    `pairs` are (person ID, organization ID). Returns the pairs that were not
+    already associated.
+    """
+    create_staging_table(cursor, "staging_associations",
+                         "person_id INTEGER, organization_id INTEGER")
+    copy_rows(cursor, "staging_associations",
+              ("person_id", "organization_id"), pairs)
+    merge = """
+        INSERT INTO associations (person_id, organization_id)
+             SELECT DISTINCT person_id, organization_id
+               FROM staging_associations
+        ON CONFLICT DO NOTHING
+          RETURNING person_id, organization_id
+    """
+    cursor.execute(merge)
+    return [(row[0], row[1]) for row in cursor]
+
+
+def associate_organizations(cursor: Cursor, person_id: int,
+                            institute: Optional[str],
+                            department: Optional[str] = None,
+                            laboratory: Optional[str] = None) \
+        -> Tuple[Optional[int], Optional[int], Optional[int]]:
+    """
+    Associate a person with an institute and, optionally, a department of
+    the institute and a laboratory of the department.
+
+    The organizations are looked up in one statement, and only those that
+    don't exist yet are added, so associating a person again writes nothing.
+    Returns the (institute, department, laboratory) IDs, None for those not
+    given. Concurrent calls for the same organizations resolve to the same
+    rows: an insert that conflicts waits for the other transaction and then
+    reads its row.
+    """
+    assert institute or not department, "department requires an institute"
+    assert department or not laboratory, "laboratory requires a department"
+
+    levels = [(mwb.INSTITUTE, institute or None),
+              (mwb.DEPARTMENT, department or None),
+              (mwb.LABORATORY, laboratory or None)]
+    select = """
+        SELECT institute.id, department.id, laboratory.id
+          FROM organizations institute
+     LEFT JOIN organizations department
+            ON department.parent_id = institute.id
+           AND department.name = %s AND department.type = %s
+     LEFT JOIN organizations laboratory
+            ON laboratory.parent_id = department.id
+           AND laboratory.name = %s AND laboratory.type = %s
+         WHERE institute.name = %s AND institute.type = %s
+           AND institute.parent_id IS NULL
+    """
+    execute_prepared(cursor, "find_organizations_of", select,
+                     (department, mwb.DEPARTMENT, laboratory, mwb.LABORATORY,
+                      institute, mwb.INSTITUTE))
+    row = cursor.fetchone()
+    ids: List[Optional[int]] = list(row) if row else [None, None, None]
+
+    parent_id = None
+    for level, (type, name) in enumerate(levels):
+        if not name:
+            break
+        if ids[level] is None:
+            ids[level] = insert_organization(cursor, type, name, parent_id)
+        parent_id = ids[level]
+
+    organization_ids = [org_id for org_id in ids if org_id is not None]
+    if organization_ids:
+        insert = """
+            INSERT INTO associations (organization_id, person_id)
+                 SELECT unnest(%s::INTEGER[]), %s
+            ON CONFLICT DO NOTHING
+        """
+        cursor.execute(insert, (organization_ids, person_id))
+    return ids[0], ids[1], ids[2]
+
+
+def contains_pattern(text: str) -> str:
+    """
+    Returns a LIKE pattern matching values that contain the lowercase `text`.
+    """
+    escaped = (text.lower().replace("\\", "\\\\")
+               .replace("%", "\\%").replace("_", "\\_"))
+    return f"%{escaped}%"
+
+
+def copy_rows(cursor: Cursor, table: str, columns: Tuple[str, ...],
+              rows: Iterable[Iterable]) -> None:
+    """COPY `rows` into `table`, escaping values as Postgres' text format."""
+    def escape(value) -> str:
+        if value is None:
+            return "\\N"
+        return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+                .replace("\n", "\\n").replace("\r", "\\r"))
+
+    tsv = io.StringIO()
+    for row in rows:
+        print(*(escape(value) for value in row), sep="\t", file=tsv)
+    tsv.seek(0)
+    cursor.copy_from(tsv, table, columns=columns)
+
+
+def create_staging_table(cursor: Cursor, name: str, columns: str) -> None:
+    """Create (or empty) a temporary table that is dropped on commit."""
+    create = f"""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {name} ({columns})
+            ON COMMIT DROP;
+        TRUNCATE {name};
+    """
+    cursor.execute(create)
+
+
+def delete_names(cursor: Cursor, names: Iterable[Tuple[int, str, str]]) \
+        -> List[Tuple[int, str, str]]:
+    """
+    Deletes (person_id, first_name, last_name) aliases, returning those that
+    existed.
+    """
+    names = list(names)
+    delete = """
+        DELETE FROM names n
+              USING unnest(%s::INTEGER[], %s::TEXT[], %s::TEXT[])
+                    AS d(person_id, first_name, last_name)
+              WHERE n.person_id = d.person_id
+                AND n.first_name = d.first_name
+                AND n.last_name = d.last_name
+          RETURNING n.person_id, n.first_name, n.last_name
+    """
+    cursor.execute(delete, ([pid for pid, _, _ in names],
+                            [first for _, first, _ in names],
+                            [last for _, _, last in names]))
+    return [tuple(row) for row in cursor]
+
+
+def dequeue_publication_retries(cursor: Cursor, pmids: Iterable[str]) -> None:
+    delete = "DELETE FROM pubmed_retries WHERE pmid = ANY(%s)"
+    cursor.execute(delete, (list(pmids),))
+
+
+def enqueue_publication_retries(cursor: Cursor,
+                                pmids: Iterable[str], error: str) -> None:
+    """Record publications whose download failed so they can be retried."""
+    insert = """
+        INSERT INTO pubmed_retries (pmid, error)
+             SELECT UNNEST(%s), %s
+        ON CONFLICT (pmid)
+        DO UPDATE SET attempts=pubmed_retries.attempts + 1,
+                      failed=CURRENT_TIMESTAMP,
+                      error=EXCLUDED.error
+    """
+    cursor.execute(insert, (list(pmids), error))
+
+
+def execute_prepared(cursor: Cursor, name: str, sql: str,
+                     params: Sequence = ()) -> None:
+    """
+    Runs `sql` as the prepared statement `name`.
+
+    See `PreparedStatement`.
+    """
+    statement = STATEMENTS.get(name)
+    if statement is None:
+        statement = STATEMENTS.setdefault(
+            name, PreparedStatement(f"m3c_{name}", sql))
+    assert statement.sql == sql, f"{name} was prepared with different SQL"
+    statement.execute(cursor, params)
+
+
 def find_organizations(cursor: Cursor) \
         -> Iterable[Tuple[str, str, str, str]]:
 
@@ -89,6 +350,41 @@ def find_organizations(cursor: Cursor) \
         yield (institute, department, lab, psid)
 
 
+def find_people(cursor: Cursor, first_name: str, last_name: str,
+                exclude_withheld: bool = True) -> List[int]:
+    """
+    Returns the IDs of the people with the name, ignoring case and leading or
+    trailing whitespace. Like `samename`, the whole name is compared, so
+    "Mary Ann" "Smith" is the same as "Mary" "Ann Smith".
+
+    The lookup uses the index on the lowercased full names (see
+    `m3c.migrate`) instead of comparing every name in Python.
+    """
+    first_name = first_name.strip()
+    last_name = last_name.strip()
+
+    assert first_name and last_name
+
+    query = """
+        SELECT DISTINCT person_id
+          FROM names
+         WHERE lower(trim(first_name) || ' ' || trim(last_name)) = %s
+           AND NOT (withheld AND %s)
+      ORDER BY person_id
+    """
+    execute_prepared(cursor, "find_people", query,
+                     (namekey(first_name, last_name), exclude_withheld))
+    return [row[0] for row in cursor]
+
+
+def finish_pubfetch_run(cursor: Cursor, run_id: int) -> None:
+    update = """
+        DELETE FROM pubfetch_pending WHERE run_id = %s;
+        UPDATE pubfetch_runs SET finished = CURRENT_TIMESTAMP WHERE id = %s;
+    """
+    cursor.execute(update, (run_id, run_id))
+
+
 def get_affiliations(cursor: Cursor) -> Mapping[int, Iterable[str]]:
     query = """
         SELECT p.id, o.name
@@ -146,12 +442,19 @@ def get_contact_details(cursor: Cursor, person_id: int) -> Tuple[str, str]:
           FROM people
          WHERE id=%s
     '''
-    cursor.execute(query, (person_id,))
+    execute_prepared(cursor, "get_contact_details", query, (person_id,))
     assert cursor.rowcount == 1
     email, phone = cursor.fetchone()
     return (email, phone)
 
 
+def get_names(cursor: Cursor) -> Iterable[Tuple[int, str, str, bool]]:
+    query = "SELECT person_id, first_name, last_name, withheld FROM names"
+    cursor.execute(query)
+    for row in cursor:
+        yield row
+
+
 def get_organization(cursor: Cursor, type: str, name: str,
                      parent_id: Optional[int] = None) -> int:
     assert type in [mwb.INSTITUTE, mwb.DEPARTMENT, mwb.LABORATORY]
@@ -161,13 +464,15 @@ def get_organization(cursor: Cursor, type: str, name: str,
             SELECT id FROM organizations
              WHERE name=%s AND type=%s AND parent_id IS NULL
         """
-        cursor.execute(select_org, (name, type))
+        execute_prepared(cursor, "get_root_organization", select_org,
+                         (name, type))
     else:
         select_org = """
             SELECT id FROM organizations
              WHERE name=%s AND type=%s AND parent_id=%s
         """
-        cursor.execute(select_org, (name, type, parent_id))
+        execute_prepared(cursor, "get_organization", select_org,
+                         (name, type, parent_id))
 
     assert cursor.rowcount <= 1
 
@@ -218,6 +523,36 @@ def get_person(cursor: Cursor,
         yield person_id
 
 
+def get_person_names(cursor: Cursor, person_id: int) \
+        -> List[Tuple[str, str]]:
+    query = """
+        SELECT first_name, last_name
+          FROM names
+         WHERE person_id = %s
+      ORDER BY last_name, first_name
+    """
+    cursor.execute(query, (person_id,))
+    return [(row[0], row[1]) for row in cursor]
+
+
+def get_person_publications(cursor: Cursor, person_id: int) \
+        -> Tuple[List[str], List[str]]:
+    """Returns the PMIDs included and excluded for a person."""
+    query = """
+        SELECT pmid, include
+          FROM publications
+         WHERE person_id = %s
+      ORDER BY pmid
+    """
+    cursor.execute(query, (person_id,))
+
+    include: List[str] = []
+    exclude: List[str] = []
+    for pmid, included in cursor:
+        (include if included else exclude).append(pmid)
+    return include, exclude
+
+
 def get_people(cursor: Cursor) \
         -> Mapping[int, Tuple[str, str, str, str, str, bool, str]]:
     select_names = """
@@ -242,6 +577,160 @@ def get_people(cursor: Cursor) \
     return people
 
 
+def get_people_contact_details(cursor: Cursor) \
+        -> Mapping[int, Tuple[str, str]]:
+    query = """
+        SELECT id, COALESCE(email, ''), COALESCE(phone, '')
+          FROM people
+    """
+    cursor.execute(query)
+    return {row[0]: (row[1], row[2]) for row in cursor}
+
+
+def get_pubfetch_authors(
+    cursor: Cursor,
+    base: datetime.timedelta,
+    maximum: datetime.timedelta,
+    person_ids: Optional[Iterable[int]] = None
+) -> List[Tuple[int, str, str, str, List[str], List[str], List[str],
+                List[str], Optional[datetime.datetime], int]]:
+    """
+    Returns everything pubfetch needs to search for authors' publications.
+
+    Only people that are neither withheld nor unaffiliated are returned. If
+    `person_ids` is given, those people are returned; otherwise only the people
+    due for a refresh (see `schedule.Schedule`), most overdue first.
+
+    Each author is (person ID, first name, last name, email, institutes,
+    included PMIDs, excluded PMIDs, current PMIDs, last update, unchanged).
+    Institutes and confirmed PMIDs are sorted, so that an author's Catalyst
+    request, and so its cache key, only changes when they do.
+    """
+    select = """
+        WITH institutes AS (
+            SELECT a.person_id, array_agg(DISTINCT o.name) AS names
+              FROM associations a
+              JOIN organizations o ON o.id = a.organization_id
+             WHERE o.type = 'institute'
+               AND o.withheld = FALSE
+          GROUP BY a.person_id
+        ), confirmed AS (
+            SELECT person_id,
+                   array_agg(pmid ORDER BY pmid)
+                       FILTER (WHERE include) AS included,
+                   array_agg(pmid ORDER BY pmid)
+                       FILTER (WHERE NOT include) AS excluded
+              FROM publications
+          GROUP BY person_id
+        ), authored AS (
+            SELECT person_id, array_agg(pmid) AS pmids
+              FROM pubmed_authorships
+          GROUP BY person_id
+        )
+        SELECT p.id, n.first_name, n.last_name, COALESCE(p.email, ''),
+               i.names,
+               COALESCE(c.included, '{}'), COALESCE(c.excluded, '{}'),
+               COALESCE(w.pmids, '{}'),
+               u.updated, COALESCE(u.unchanged, 0)
+          FROM people p
+          JOIN LATERAL (
+                   SELECT first_name, last_name, withheld
+                     FROM names
+                    WHERE person_id = p.id
+                 ORDER BY withheld, first_name, last_name
+                    LIMIT 1
+               ) n ON TRUE
+          JOIN institutes i ON i.person_id = p.id
+     LEFT JOIN confirmed c ON c.person_id = p.id
+     LEFT JOIN authored w ON w.person_id = p.id
+     LEFT JOIN pubmed_authorships_updates u ON u.person_id = p.id
+     LEFT JOIN LATERAL (
+                   SELECT u.updated
+                          + LEAST(%(maximum)s,
+                                  %(base)s * power(2, LEAST(u.unchanged, 32)))
+                          * INTERVAL '1 second' AS at
+               ) due ON TRUE
+         WHERE NOT (p.withheld OR n.withheld)
+    """
+    params = {
+        "base": base.total_seconds(),
+        "maximum": maximum.total_seconds(),
+    }
+    if person_ids is None:
+        select += """
+           AND (due.at IS NULL OR due.at <= CURRENT_TIMESTAMP)
+      ORDER BY due.at NULLS FIRST, p.id
+        """
+    else:
+        select += " AND p.id = ANY(%(person_ids)s)"
+        params["person_ids"] = list(person_ids)
+
+    cursor.execute(select, params)
+    return [(row[0], row[1], row[2], row[3], list(row[4]), list(row[5]),
+             list(row[6]), list(row[7]), row[8], row[9])
+            for row in cursor]
+
+
+def get_pubfetch_pending(cursor: Cursor) -> Optional[Tuple[int, List[int]]]:
+    """
+    Returns the latest unfinished pubfetch run and the people it has yet to
+    search for, in their original order.
+    """
+    select_run = """
+        SELECT id
+          FROM pubfetch_runs
+         WHERE finished IS NULL
+      ORDER BY id DESC
+         LIMIT 1
+    """
+    cursor.execute(select_run)
+    row = cursor.fetchone()
+    if not row:
+        return None
+    run_id = row[0]
+
+    select_pending = """
+        SELECT person_id
+          FROM pubfetch_pending
+         WHERE run_id = %s
+      ORDER BY position
+    """
+    cursor.execute(select_pending, (run_id,))
+    return (run_id, [row[0] for row in cursor])
+
+
+def get_publication_retries(cursor: Cursor) -> List[Tuple[str, int]]:
+    """
+    Returns the (PMID, failed attempts) of the publications whose download
+    failed, oldest failure first.
+    """
+    cursor.execute("SELECT pmid, attempts FROM pubmed_retries ORDER BY failed")
+    return [(row[0], row[1]) for row in cursor]
+
+
+def get_pubmed_authors(cursor: Cursor, pmids: Iterable[str]) \
+        -> Mapping[str, List[Tuple[str, str, List[str]]]]:
+    """
+    Returns the (forename, last name, affiliations) of each publication's
+    authors, in the order they are listed.
+
+    Publications without any authors recorded are left out.
+    """
+    select = """
+        SELECT pmid, forename, lastname, affiliations
+          FROM pubmed_authors
+         WHERE pmid = ANY(%s)
+      ORDER BY pmid, position
+    """
+    cursor.execute(select, (list(pmids),))
+
+    authors: Dict[str, List[Tuple[str, str, List[str]]]] = {}
+    for pmid, forename, lastname, affiliations in cursor:
+        authors.setdefault(pmid, []).append(
+            (forename, lastname, list(affiliations)))
+    return authors
+
+
 def get_pubmed_authorships(cursor: Cursor) -> Mapping[str, Iterable[int]]:
     select_pubs = """
         SELECT pmid, person_id
@@ -260,28 +749,32 @@ def get_pubmed_authorships(cursor: Cursor) -> Mapping[str, Iterable[int]]:
     return authorships
 
 
-def get_pubmed_authorships_updates(cursor: Cursor
-                                   ) -> Mapping[int, datetime.datetime]:
+def get_pubmed_authorships_updates(cursor: Cursor) \
+        -> Mapping[int, Tuple[datetime.datetime, int]]:
+    """Returns when each person's authorships were updated and how many
+    consecutive updates found no changes."""
     select_pubs = """
-        SELECT person_id, updated
+        SELECT person_id, updated, unchanged
           FROM pubmed_authorships_updates
     """
 
     cursor.execute(select_pubs)
 
-    return {row[0]: row[1] for row in cursor}
+    return {row[0]: (row[1], row[2]) for row in cursor}
 
 
 def get_pubmed_download_timestamps(cursor: Cursor) \
-        -> Mapping[str, datetime.datetime]:
+        -> Mapping[str, Tuple[datetime.datetime, int]]:
+    """Returns when each publication was downloaded and how many consecutive
+    downloads found no changes."""
     select_pubs = """
-        SELECT pmid, downloaded
+        SELECT pmid, downloaded, unchanged
           FROM pubmed_publications
     """
 
     cursor.execute(select_pubs)
 
-    return {row[0]: row[1] for row in cursor}
+    return {row[0]: (row[1], row[2]) for row in cursor}
 
 
 def get_pubmed_publications(cursor: Cursor,
@@ -303,6 +796,143 @@ def get_pubmed_publications(cursor: Cursor,
     return {row[0]: row[1] for row in cursor}
 
 
+def insert_organization(cursor: Cursor, type: str, name: str,
+                        parent_id: Optional[int] = None) -> int:
+    """
+    Adds an organization unless it exists, returning its ID. Unlike
+    `add_organization`, an organization that exists isn't updated.
+    """
+    if parent_id is None:
+        conflict = "(name, type) WHERE parent_id IS NULL"
+    else:
+        conflict = "(name, type, parent_id)"
+    insert = f"""
+        INSERT INTO organizations (name, type, parent_id)
+             VALUES               (%s  , %s  , %s       )
+        ON CONFLICT {conflict} DO NOTHING
+          RETURNING id
+    """
+    cursor.execute(insert, (name, type, parent_id))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    # Added by a concurrent transaction, which the conflict waited for to
+    # commit, so this statement sees its row.
+    return get_organization(cursor, type, name, parent_id)
+
+
+def insert_organizations(
+    cursor: Cursor, organizations: Iterable[Tuple[int, str, str, Optional[int]]]
+) -> None:
+    """
+    Insert (ID, name, type, parent ID) using COPY.
+
+    The IDs must have been reserved with `allocate_ids`. Parents may be
+    inserted along with their children.
+    """
+    copy_rows(cursor, "organizations", ("id", "name", "type", "parent_id"),
+              organizations)
+
+
+def insert_people(cursor: Cursor,
+                  people: Iterable[Tuple[int, str, str, str, str]]) -> None:
+    """
+    Insert (ID, first name, last name, email, phone) using COPY.
+
+    The IDs must have been reserved with `allocate_ids`.
+    """
+    people = [(pid, first_name.strip(), last_name.strip(), email, phone)
+              for pid, first_name, last_name, email, phone in people]
+    copy_rows(cursor, "people", ("id", "display_name", "email", "phone"),
+              ((pid, f"{first_name} {last_name}", email, phone)
+               for pid, first_name, last_name, email, phone in people))
+    copy_rows(cursor, "names", ("person_id", "first_name", "last_name"),
+              ((pid, first_name, last_name)
+               for pid, first_name, last_name, _, _ in people))
+
+
+def namekey(first_name: str, last_name: str) -> str:
+    """Returns a key that is equal for names `find_people` considers equal."""
+    return f"{first_name.strip()} {last_name.strip()}".lower()
+
+
+def parse_pubmed_authors(article: ET.Element) \
+        -> List[Tuple[str, str, List[str]]]:
+    """
+    Returns the (forename, last name, affiliations) of a PubMed article's
+    authors in the order listed, as stored by `replace_pubmed_authors`.
+    """
+    authors: List[Tuple[str, str, List[str]]] = []
+    for author in article.iterfind(".//Article/AuthorList/Author"):
+        forename = author.findtext("ForeName", "").strip()
+        lastname = author.findtext("LastName", "").strip()
+        affiliations = [element.text.strip()
+                        for element in author.iterfind(".//Affiliation")
+                        if element.text and element.text.strip()]
+        authors.append((forename, lastname, affiliations))
+    return authors
+
+
+def remove_pubfetch_pending(cursor: Cursor, run_id: int,
+                            person_ids: Iterable[int]) -> None:
+    delete = """
+        DELETE FROM pubfetch_pending
+              WHERE run_id = %s
+                AND person_id = ANY(%s)
+    """
+    cursor.execute(delete, (run_id, list(person_ids)))
+
+
+def replace_publications(cursor: Cursor, person_id: int,
+                         include: Iterable[str],
+                         exclude: Iterable[str]) -> None:
+    """
+    Replaces the PMIDs included and excluded for a person. A PMID in both is
+    excluded.
+    """
+    publications = {pmid: True for pmid in include}
+    publications.update((pmid, False) for pmid in exclude)
+
+    delete = "DELETE FROM publications WHERE person_id = %s"
+    cursor.execute(delete, (person_id,))
+
+    insert = """
+        INSERT INTO publications (pmid, person_id, include)
+             VALUES %s
+        ON CONFLICT (pmid, person_id)
+          DO UPDATE SET include = EXCLUDED.include
+    """
+    rows = [(pmid, person_id, included)
+            for pmid, included in publications.items()]
+    psycopg2.extras.execute_values(cursor, insert, rows)
+
+
+def replace_pubmed_authors(
+    cursor: Cursor,
+    authors: Mapping[str, Iterable[Tuple[str, str, Iterable[str]]]]
+) -> None:
+    """
+    Store the (forename, last name, affiliations) of publications' authors,
+    replacing any previously stored for the same publications.
+    """
+    if not authors:
+        return
+
+    delete = "DELETE FROM pubmed_authors WHERE pmid = ANY(%s)"
+    cursor.execute(delete, (list(authors.keys()),))
+
+    insert = """
+        INSERT INTO pubmed_authors
+               (pmid, position, forename, lastname, affiliations)
+        VALUES %s
+    """
+    rows = [(pmid, position, forename, lastname, list(affiliations))
+            for pmid, author_list in authors.items()
+            for position, (forename, lastname, affiliations)
+            in enumerate(author_list, start=1)]
+    psycopg2.extras.execute_values(cursor, insert, rows)
+
+
 def samename(name1: str, name2: str) -> bool:
     """
     Returns `True` if `name1` is the same as `name2`, ignoring case and space.
@@ -310,34 +940,206 @@ def samename(name1: str, name2: str) -> bool:
     return name1.strip().lower() == name2.strip().lower()
 
 
+def search_organizations(cursor: Cursor, text: str, limit: int,
+                         after: int = 0, type: Optional[str] = None) \
+        -> List[Tuple[int, str, str, Optional[int], bool]]:
+    """
+    Returns up to `limit` (id, name, type, parent_id, withheld) of the
+    organizations whose name contains `text`, ordered by id and starting after
+    the id `after`, so the last id of a page is the cursor of the next.
+
+    Matching uses the trigram index on `lower(name)` (see `m3c.migrate`).
+    """
+    assert type in [None, mwb.INSTITUTE, mwb.DEPARTMENT, mwb.LABORATORY]
+
+    query = """
+        SELECT id, name, type, parent_id, withheld
+          FROM organizations
+         WHERE id > %(after)s
+           AND (%(type)s::TEXT IS NULL OR type = %(type)s)
+           AND lower(name) LIKE %(pattern)s
+      ORDER BY id
+         LIMIT %(limit)s
+    """
+    cursor.execute(query, {
+        "after": after,
+        "type": type,
+        "pattern": contains_pattern(text.strip()),
+        "limit": limit,
+    })
+    return [tuple(row) for row in cursor]
+
+
+def search_people(cursor: Cursor, text: str, limit: int, after: int = 0) \
+        -> List[Tuple[int, str, str, bool]]:
+    """
+    Returns up to `limit` (id, display name, email, withheld) of the people
+    whose id is `text` or whose display name or any name contains it, ordered
+    by id and starting after the id `after`.
+
+    Matching uses the trigram indexes on the lowercase names (see
+    `m3c.migrate`), so the cost of a page doesn't grow with the table.
+    """
+    text = text.strip()
+    if not text:
+        query = """
+            SELECT id, COALESCE(display_name, ''), COALESCE(email, ''),
+                   withheld
+              FROM people
+             WHERE id > %(after)s
+          ORDER BY id
+             LIMIT %(limit)s
+        """
+    else:
+        query = """
+            SELECT id, COALESCE(display_name, ''), COALESCE(email, ''),
+                   withheld
+              FROM people
+             WHERE id > %(after)s
+               AND id IN (
+                       SELECT id
+                         FROM people
+                        WHERE lower(display_name) LIKE %(pattern)s
+                           OR id = %(id)s
+                        UNION
+                       SELECT person_id
+                         FROM names
+                        WHERE lower(first_name || ' ' || last_name)
+                              LIKE %(pattern)s
+                   )
+          ORDER BY id
+             LIMIT %(limit)s
+        """
+    cursor.execute(query, {
+        "after": after,
+        "id": int(text) if text.isdigit() and len(text) < 10 else None,
+        "pattern": contains_pattern(text),
+        "limit": limit,
+    })
+    return [tuple(row) for row in cursor]
+
+
+def set_organizations_withheld(cursor: Cursor, ids: Iterable[int],
+                               withheld: bool) -> List[int]:
+    """Withholds or releases organizations, returning the ids updated."""
+    update = """
+        UPDATE organizations
+           SET withheld = %s
+         WHERE id = ANY(%s)
+     RETURNING id
+    """
+    cursor.execute(update, (withheld, list(ids)))
+    return [row[0] for row in cursor]
+
+
+def set_people_withheld(cursor: Cursor, ids: Iterable[int],
+                        withheld: bool) -> List[int]:
+    """
+    Withholds or releases people and their names, returning the ids of the
+    people updated. Fails if a name would then clash with another person's.
+    """
+    ids = list(ids)
+    update = """
+        UPDATE people
+           SET withheld = %s
+         WHERE id = ANY(%s)
+     RETURNING id
+    """
+    cursor.execute(update, (withheld, ids))
+    updated = [row[0] for row in cursor]
+
+    update = "UPDATE names SET withheld = %s WHERE person_id = ANY(%s)"
+    cursor.execute(update, (withheld, ids))
+    return updated
+
+
+def start_pubfetch_run(cursor: Cursor, person_ids: Iterable[int]) -> int:
+    """
+    Record the people a new pubfetch run will search for.
+
+    Any unfinished run is abandoned; only the latest run can be resumed.
+    """
+    abandon = """
+        DELETE FROM pubfetch_pending;
+        UPDATE pubfetch_runs
+           SET finished = CURRENT_TIMESTAMP
+         WHERE finished IS NULL;
+    """
+    cursor.execute(abandon)
+
+    cursor.execute("INSERT INTO pubfetch_runs DEFAULT VALUES RETURNING id")
+    run_id = cursor.fetchone()[0]
+
+    tsv = io.StringIO()
+    for position, person_id in enumerate(person_ids):
+        print(run_id, position, person_id, sep="\t", file=tsv)
+    tsv.seek(0)
+    cursor.copy_from(tsv, "pubfetch_pending",
+                     columns=("run_id", "position", "person_id"))
+
+    return run_id
+
+
 def update_authorships(cursor: Cursor,
-                       authorships: Mapping[int, Iterable[str]]) -> int:
-    """Overwrite authorships and timestamp the updates."""
+                       authorships: Mapping[int, Iterable[str]],
+                       unchanged: Optional[Mapping[int, int]] = None
+                       ) -> Tuple[int, int]:
+    """
+    Replace people's authorships and timestamp the updates.
 
-    delete = """
-        DELETE FROM pubmed_authorships_updates
-              WHERE person_id = ANY(%s);
-        DELETE FROM pubmed_authorships
-              WHERE person_id = ANY(%s);
+    Only the difference between the stored and the new authorships is
+    written, so refreshing an author whose publications haven't changed
+    doesn't rewrite any rows in `pubmed_authorships`.
+
+    `unchanged` maps a person's ID to the number of consecutive updates that
+    found no changes to their authorships. People not in it are recorded as
+    having changed.
+
+    Returns the number of authorships (added, removed).
     """
+    unchanged = unchanged or {}
     person_ids = list(authorships.keys())
-    cursor.execute(delete, (person_ids, person_ids))
+
+    create_staging_table(cursor, "staging_authorships",
+                         "person_id INTEGER, pmid TEXT")
+    copy_rows(cursor, "staging_authorships", ("person_id", "pmid"),
+              ((person_id, pmid)
+               for person_id, pmids in authorships.items()
+               for pmid in pmids))
+
+    delete = """
+        DELETE FROM pubmed_authorships a
+              WHERE a.person_id = ANY(%s)
+                AND NOT EXISTS (
+                        SELECT 1
+                          FROM staging_authorships s
+                         WHERE s.person_id = a.person_id
+                           AND s.pmid = a.pmid
+                    )
+    """
+    cursor.execute(delete, (person_ids,))
+    removed = cursor.rowcount
+
+    insert = """
+        INSERT INTO pubmed_authorships (person_id, pmid)
+             SELECT DISTINCT person_id, pmid
+               FROM staging_authorships
+        ON CONFLICT DO NOTHING
+    """
+    cursor.execute(insert)
+    added = cursor.rowcount
 
     # Update timestamps for those authors who have been updated.
-    ids = io.StringIO()
-    for person_id in authorships.keys():
-        print(person_id, file=ids)
-    ids.seek(0)
-    cursor.copy_from(ids, "pubmed_authorships_updates", columns=("person_id",))
+    upsert = """
+        INSERT INTO pubmed_authorships_updates (person_id, unchanged)
+             SELECT * FROM unnest(%s::INTEGER[], %s::INTEGER[])
+        ON CONFLICT (person_id)
+        DO UPDATE SET updated=CURRENT_TIMESTAMP, unchanged=EXCLUDED.unchanged
+    """
+    cursor.execute(upsert, (person_ids, [unchanged.get(person_id, 0)
+                                         for person_id in person_ids]))
 
-    # Update publication lists for those authors who have been updated.
-    tsv = io.StringIO()
-    for person_id, pmids in authorships.items():
-        for pmid in pmids:
-            print(person_id, pmid, sep="\t", end="\n", file=tsv)
-    tsv.seek(0)
-    cursor.copy_from(tsv, "pubmed_authorships", columns=("person_id", "pmid"))
-    return cursor.rowcount
+    return added, removed
 
 
 def update_contact_details(cursor: Cursor,
@@ -348,10 +1150,29 @@ def update_contact_details(cursor: Cursor,
                phone=%s
          WHERE id=%s
     '''
-    cursor.execute(update, (email, phone, person_id))
+    execute_prepared(cursor, "update_contact_details", update,
+                     (email, phone, person_id))
     return cursor.rowcount == 1
 
 
+def update_many_contact_details(
+    cursor: Cursor, contacts: Iterable[Tuple[int, str, str]]
+) -> int:
+    """Set (person ID, email, phone) using a single statement."""
+    create_staging_table(cursor, "staging_contacts",
+                         "id INTEGER, email TEXT, phone TEXT")
+    copy_rows(cursor, "staging_contacts", ("id", "email", "phone"), contacts)
+    update = """
+        UPDATE people
+           SET email=s.email,
+               phone=s.phone
+          FROM staging_contacts s
+         WHERE people.id = s.id
+    """
+    cursor.execute(update)
+    return cursor.rowcount
+
+
 def update_overview(cursor: Cursor, person_id: int, overview: str) -> bool:
     update = '''
         UPDATE people
@@ -367,9 +1188,14 @@ def upsert_publication(cursor: Cursor, pmid: str, xml: str) -> None:
         INSERT INTO pubmed_publications (pmid, xml, downloaded)
              VALUES                     (  %s,  %s, DEFAULT)
         ON CONFLICT (pmid)
-        DO UPDATE SET xml=EXCLUDED.xml, downloaded=EXCLUDED.downloaded
+        DO UPDATE SET xml=EXCLUDED.xml, downloaded=EXCLUDED.downloaded,
+                      unchanged=CASE
+                          WHEN pubmed_publications.xml = EXCLUDED.xml
+                          THEN pubmed_publications.unchanged + 1
+                          ELSE 0
+                      END
           RETURNING pmid
     """
 
-    cursor.execute(insert, (pmid, xml))
+    execute_prepared(cursor, "upsert_publication", insert, (pmid, xml))
     assert cursor.rowcount == 1
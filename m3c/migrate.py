@@ -0,0 +1,347 @@
+"""M3C Schema Migrations
+
+Usage:
+    m3c migrate (-h | --help)
+    m3c migrate [--check] <path_to_config>
+
+Options:
+    -h --help       Show this message and exit
+    --check         Also EXPLAIN the hot queries and report any that don't use
+                    an index
+
+`mwb_supplemental.pgsql` creates the tables of the Supplemental database.
+Later changes to the schema are listed in `MIGRATIONS` and applied in order,
+each at most once. Applied versions are recorded in `schema_migrations`.
+
+Example:
+    $ m3c migrate --check config.yaml
+"""
+
+from typing import Callable, List, Optional, Tuple, Union
+
+import re
+import sys
+import xml.etree.ElementTree as ET
+
+from m3c import config
+from m3c import connections
+from m3c import db
+
+
+# SQL to run or a function to call with the cursor.
+Step = Union[str, Callable[[db.Cursor], None]]
+
+# Rows of pubmed_publications parsed per round trip while backfilling.
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_pubmed_authors(cursor: db.Cursor) -> None:
+    """Extracts the authors of the publications downloaded so far."""
+    authors = {}
+    with cursor.connection.cursor(name="backfill_pubmed_authors") as pubs:
+        pubs.itersize = BACKFILL_BATCH_SIZE
+        pubs.execute("SELECT pmid, xml FROM pubmed_publications")
+        for pmid, xml in pubs:
+            authors[pmid] = db.parse_pubmed_authors(ET.fromstring(xml))
+            if len(authors) >= BACKFILL_BATCH_SIZE:
+                db.replace_pubmed_authors(cursor, authors)
+                authors.clear()
+    db.replace_pubmed_authors(cursor, authors)
+
+
+def make_institutes_unique(cursor: db.Cursor) -> None:
+    """
+    Merges the organizations added more than once, keeping the lowest ID, and
+    then makes the names of institutes unique.
+
+    UNIQUE(name, type, parent_id) treats NULL parents as distinct, so it
+    didn't stop two admins adding the same institute at once. Merging two
+    institutes can in turn make two of their departments, and then two of
+    their laboratories, the same organization.
+    """
+    cursor.execute("""
+        CREATE TEMPORARY TABLE organization_merges AS
+             SELECT id, min(id) OVER (PARTITION BY name, type) AS keep,
+                    0 AS depth
+               FROM organizations
+              WHERE parent_id IS NULL
+    """)
+    depth = 0
+    while True:
+        cursor.execute("""
+            INSERT INTO organization_merges (id, keep, depth)
+                 SELECT o.id,
+                        min(o.id) OVER (PARTITION BY o.name, o.type, m.keep),
+                        m.depth + 1
+                   FROM organizations o
+                   JOIN organization_merges m ON m.id = o.parent_id
+                  WHERE m.depth = %s
+        """, (depth,))
+        if cursor.rowcount == 0:
+            break
+        depth += 1
+    cursor.execute("""
+        DELETE FROM organization_merges WHERE id = keep;
+
+        INSERT INTO associations (organization_id, person_id)
+             SELECT m.keep, a.person_id
+               FROM associations a
+               JOIN organization_merges m ON m.id = a.organization_id
+        ON CONFLICT DO NOTHING;
+        DELETE FROM associations a
+              USING organization_merges m
+              WHERE a.organization_id = m.id;
+    """)
+    # Bottom up, so that the duplicates of an organization are gone before
+    # it's moved to the organization its parent was merged into.
+    for level in range(depth, -1, -1):
+        cursor.execute("""
+            DELETE FROM organizations o
+                  USING organization_merges m
+                  WHERE o.id = m.id AND m.depth = %(level)s;
+            UPDATE organizations o
+               SET parent_id = m.keep
+              FROM organization_merges m
+             WHERE o.parent_id = m.id AND m.depth = %(level)s - 1;
+        """, {"level": level})
+    cursor.execute("""
+        DROP TABLE organization_merges;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS organizations_root_name_type_idx
+            ON organizations (name, type) WHERE parent_id IS NULL;
+    """)
+
+
+# (version, description, step). Append new migrations; never edit old ones.
+MIGRATIONS: List[Tuple[int, str, Step]] = [
+    (1, "Indexes for the hot lookups", """
+        CREATE INDEX IF NOT EXISTS names_normalized_idx
+            ON names (lower(trim(first_name)), lower(trim(last_name)));
+        CREATE INDEX IF NOT EXISTS names_person_id_idx
+            ON names (person_id);
+        CREATE INDEX IF NOT EXISTS organizations_name_type_withheld_idx
+            ON organizations (name, type, withheld);
+        CREATE INDEX IF NOT EXISTS associations_person_id_idx
+            ON associations (person_id);
+        CREATE INDEX IF NOT EXISTS publications_person_id_idx
+            ON publications (person_id);
+        CREATE INDEX IF NOT EXISTS pubmed_authorships_person_id_idx
+            ON pubmed_authorships (person_id);
+    """),
+    (2, "Authors of PubMed publications", """
+        CREATE TABLE IF NOT EXISTS pubmed_authors (
+            pmid         TEXT     NOT NULL,
+            position     INTEGER  NOT NULL,
+            forename     TEXT     NOT NULL DEFAULT '',
+            lastname     TEXT     NOT NULL DEFAULT '',
+            affiliations TEXT[]   NOT NULL DEFAULT '{}',
+
+            PRIMARY KEY(pmid, position)
+        );
+    """),
+    (3, "Extract the authors of downloaded publications",
+     backfill_pubmed_authors),
+    (4, "Trigram indexes for searching people and organizations", """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS people_display_name_trgm_idx
+            ON people USING gin (lower(display_name) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS names_full_name_trgm_idx
+            ON names USING gin
+               (lower(first_name || ' ' || last_name) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS organizations_name_trgm_idx
+            ON organizations USING gin (lower(name) gin_trgm_ops);
+    """),
+    (5, "Notify the Admin Forms of changes to people and organizations", """
+        CREATE OR REPLACE FUNCTION m3c_notify_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('m3c_changes', TG_TABLE_NAME);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS people_notify_change ON people;
+        CREATE TRIGGER people_notify_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON people
+            FOR EACH STATEMENT EXECUTE PROCEDURE m3c_notify_change();
+
+        DROP TRIGGER IF EXISTS organizations_notify_change ON organizations;
+        CREATE TRIGGER organizations_notify_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON organizations
+            FOR EACH STATEMENT EXECUTE PROCEDURE m3c_notify_change();
+    """),
+    (6, "Unique names of institutes", make_institutes_unique),
+    # `unchanged` counts the consecutive refreshes that found no changes, which
+    # pubfetch backs off on (see m3c/schedule.py). pubfetch_pending holds the
+    # people left to search in a run, so an interrupted run can be resumed.
+    (7, "Adaptive refreshes and resumable runs of pubfetch", """
+        ALTER TABLE pubmed_publications
+            ADD COLUMN IF NOT EXISTS unchanged INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE pubmed_authorships_updates
+            ADD COLUMN IF NOT EXISTS unchanged INTEGER NOT NULL DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS pubfetch_runs (
+            id       SERIAL                    PRIMARY KEY,
+            started  TIMESTAMP WITH TIME ZONE  NOT NULL
+                                               DEFAULT CURRENT_TIMESTAMP,
+            finished TIMESTAMP WITH TIME ZONE
+        );
+        CREATE TABLE IF NOT EXISTS pubfetch_pending (
+            run_id    INTEGER  REFERENCES pubfetch_runs(id),
+            position  INTEGER  NOT NULL,
+            person_id INTEGER  REFERENCES people(id),
+
+            UNIQUE(run_id, person_id)
+        );
+        CREATE TABLE IF NOT EXISTS pubmed_retries (
+            pmid     TEXT                      NOT NULL,
+            attempts INTEGER                   NOT NULL DEFAULT 1,
+            failed   TIMESTAMP WITH TIME ZONE  NOT NULL
+                                               DEFAULT CURRENT_TIMESTAMP,
+            error    TEXT,
+
+            UNIQUE(pmid)
+        );
+    """),
+    # People are matched by their whole name, as `db.samename` does, not by
+    # their first and last names separately.
+    (8, "Index the full names of people", """
+        CREATE INDEX IF NOT EXISTS names_full_name_idx
+            ON names (lower(trim(first_name) || ' ' || trim(last_name)));
+        DROP INDEX IF EXISTS names_normalized_idx;
+    """),
+]
+
+# (table, SQL, parameters) of queries that must be able to use an index.
+HOT_QUERIES: List[Tuple[str, str, Tuple]] = [
+    ("names", """
+        SELECT person_id FROM names
+         WHERE lower(trim(first_name) || ' ' || trim(last_name)) = %s
+     """, ("james bond",)),
+    ("names", "SELECT first_name FROM names WHERE person_id = %s", (1,)),
+    ("organizations", """
+        SELECT id FROM organizations
+         WHERE name = %s AND type = %s AND withheld = FALSE
+    """, ("University of Florida", "institute")),
+    ("associations",
+     "SELECT organization_id FROM associations WHERE person_id = %s", (1,)),
+    ("publications",
+     "SELECT pmid FROM publications WHERE person_id = %s", (1,)),
+    ("pubmed_authorships",
+     "SELECT pmid FROM pubmed_authorships WHERE person_id = %s", (1,)),
+    ("pubmed_authorships",
+     "SELECT person_id FROM pubmed_authorships WHERE pmid = %s", ("1",)),
+    ("pubmed_authors",
+     "SELECT lastname FROM pubmed_authors WHERE pmid = ANY(%s)", (["1"],)),
+    ("people",
+     "SELECT id FROM people WHERE lower(display_name) LIKE %s", ("%bond%",)),
+    ("names", """
+        SELECT person_id FROM names
+         WHERE lower(first_name || ' ' || last_name) LIKE %s
+    """, ("%james bond%",)),
+    ("organizations",
+     "SELECT id FROM organizations WHERE lower(name) LIKE %s", ("%florida%",)),
+]
+
+
+def apply_migrations(cursor: db.Cursor,
+                     migrations: List[Tuple[int, str, Step]] = MIGRATIONS
+                     ) -> List[int]:
+    """Applies the migrations newer than the schema, returning them."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version     INTEGER                   PRIMARY KEY,
+            description TEXT                      NOT NULL,
+            applied     TIMESTAMP WITH TIME ZONE  NOT NULL
+                                                  DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    current = get_version(cursor) or 0
+
+    applied: List[int] = []
+    for version, description, step in sorted(migrations,
+                                             key=lambda m: m[0]):
+        if version <= current:
+            continue
+        print(f"Applying migration {version}: {description}")
+        if callable(step):
+            step(cursor)
+        else:
+            cursor.execute(step)
+        cursor.execute("""
+            INSERT INTO schema_migrations (version, description)
+                 VALUES                   (%s     , %s         )
+        """, (version, description))
+        applied.append(version)
+
+    return applied
+
+
+def check_indexes(cursor: db.Cursor) -> List[str]:
+    """
+    Returns the hot queries that can't use an index.
+
+    Sequential scans are disabled while planning so that small tables, where
+    a sequential scan is cheaper, still show whether an index is usable.
+    """
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    slow: List[str] = []
+    for table, sql, params in HOT_QUERIES:
+        cursor.execute("EXPLAIN " + sql, params)
+        plan = "\n".join(row[0] for row in cursor)
+        if not uses_index(plan, table):
+            slow.append(" ".join(sql.split()))
+    cursor.execute("SET LOCAL enable_seqscan = on")
+    return slow
+
+
+def get_version(cursor: db.Cursor) -> Optional[int]:
+    cursor.execute("SELECT max(version) FROM schema_migrations")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def main():
+    """Applies the pending migrations to the Supplemental database."""
+    args = sys.argv[1:]
+    if not args or args[0] in ["-h", "--help"]:
+        print(__doc__)
+        sys.exit(0 if args else 2)
+
+    check = "--check" in args
+    args = [arg for arg in args if arg != "--check"]
+    if not migrate(args[0], check):
+        sys.exit(1)
+
+
+def migrate(config_path: str, check: bool = False) -> bool:
+    """Returns whether the schema is current and, if checked, indexed."""
+    cfg = config.load(config_path)
+    pool = connections.create_pool(cfg, connections.SUPPLEMENTAL, "migrate")
+
+    ok = True
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            applied = apply_migrations(cursor)
+            if not applied:
+                print("The schema is up to date.")
+            print(f"Schema version: {get_version(cursor)}")
+
+            if check:
+                for sql in check_indexes(cursor):
+                    print(f"WARNING! Query does not use an index: {sql}")
+                    ok = False
+
+    pool.close()
+    return ok
+
+
+def uses_index(plan: str, table: str) -> bool:
+    """Returns whether an EXPLAIN plan reads `table` through an index."""
+    if re.search(rf"Seq Scan on {table}\b", plan):
+        return False
+    return bool(re.search(rf"(Index (Only )?Scan using \w+|Bitmap Heap Scan) "
+                          rf"on {table}\b", plan))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,19 @@
 Metabolomics Workbench library
 """
 
+import queue
+import threading
 import typing
 
 import psycopg2
 import psycopg2.extensions
 
+from m3c import connections
+
 
 Iterable = typing.Iterable
+Iterator = typing.Iterator
+List = typing.List
 Optional = typing.Optional
 Tuple = typing.Tuple
 
@@ -21,6 +27,29 @@ LABORATORY = "laboratory"
 PROJECT = "project"
 STUDY = "study"
 
+# Rows fetched per round trip by the server-side cursors.
+DEFAULT_ITERSIZE = 2000
+
+SELECT_PROJECT_NAMES = f"""
+    SELECT p.project_id AS psid, '{PROJECT}' as pstype,
+        COALESCE(p.first_name, ''), COALESCE(p.last_name, ''),
+        COALESCE(p.institute, ''), COALESCE(p.department, ''),
+        COALESCE(p.laboratory, ''),
+        COALESCE(p.email, ''), COALESCE(p.phone, '')
+    FROM project AS p
+"""
+
+SELECT_STUDY_NAMES = f"""
+    SELECT s.study_id AS psid, '{STUDY}' as pstype,
+        COALESCE(s.first_name, ''), COALESCE(s.last_name, ''),
+        COALESCE(s.institute, ''), COALESCE(s.department, ''),
+        COALESCE(s.laboratory, ''),
+        COALESCE(s.email, ''), COALESCE(s.phone, '')
+    FROM study AS s, study_status_prod
+    WHERE s.study_id = study_status_prod.study_id
+    AND study_status_prod.status = 1
+"""
+
 
 class NameRecord:
     def __init__(self, psid: str, pstype: str, first_name: str, last_name: str,
@@ -40,11 +69,23 @@ class NameRecord:
 
 
 class Client:
+    """
+    Reads from the Metabolomics Workbench database.
+
+    Connections are borrowed from `pool`. Names are streamed through
+    server-side cursors, `itersize` rows at a time, so callers can start
+    processing records while the rest are still arriving. If `concurrent` is
+    set, projects and studies are read at the same time over two connections.
+    """
+
     def __init__(self,
-                 host: Optional[str] = "localhost",
-                 port: Optional[str] = "5432"):
-        self.host = host
-        self.port = int(port)
+                 pool: connections.Pool,
+                 itersize: int = DEFAULT_ITERSIZE,
+                 concurrent: bool = False):
+        assert itersize > 0
+        self.pool = pool
+        self.itersize = itersize
+        self.concurrent = concurrent
         self.conn: Connection = None
 
     def __del__(self):
@@ -52,36 +93,91 @@ class Client:
 
     def connect(self):
         if not self.conn:
-            self.conn = psycopg2.connect(database="mb",
-                                         host=self.host, port=self.port,
-                                         user="massbank", password="password")
+            self.conn = self.pool.getconn()
         return self.conn
 
     def disconnect(self):
         if not self.conn:
             return
-        self.conn.close()
+        self.pool.putconn(self.conn)
         self.conn = None
 
     def fetch_names(self) -> Iterable[NameRecord]:
-        select_names = f"""
-            SELECT p.project_id AS psid, '{PROJECT}' as pstype,
-                COALESCE(p.first_name, ''), COALESCE(p.last_name, ''),
-                COALESCE(p.institute, ''), COALESCE(p.department, ''),
-                COALESCE(p.laboratory, ''),
-                COALESCE(p.email, ''), COALESCE(p.phone, '')
-            FROM project AS p
-            UNION
-            SELECT s.study_id AS psid, '{STUDY}' as pstype,
-                COALESCE(s.first_name, ''), COALESCE(s.last_name, ''),
-                COALESCE(s.institute, ''), COALESCE(s.department, ''),
-                COALESCE(s.laboratory, ''),
-                COALESCE(s.email, ''), COALESCE(s.phone, '')
-            FROM study AS s, study_status_prod
-            WHERE s.study_id = study_status_prod.study_id
-            AND study_status_prod.status = 1
-        """
-        with self.connect().cursor() as cursor:
-            cursor.execute(select_names)
+        if self.concurrent:
+            rows = self._stream_concurrently([SELECT_PROJECT_NAMES,
+                                              SELECT_STUDY_NAMES])
+        else:
+            # UNION ALL avoids sorting every row on the server; duplicates
+            # are dropped below instead.
+            query = SELECT_PROJECT_NAMES + "UNION ALL" + SELECT_STUDY_NAMES
+            rows = self._stream(self.connect(), query)
+
+        seen = set()
+        for row in rows:
+            if row in seen:
+                continue
+            seen.add(row)
+            yield NameRecord(*row)
+
+    def _stream(self, conn: Connection, query: str,
+                name: str = "names") -> Iterator[Tuple]:
+        with conn.cursor(name=name) as cursor:
+            cursor.itersize = self.itersize
+            cursor.execute(query)
             for row in cursor:
-                yield NameRecord(*row)
+                yield tuple(row)
+        conn.rollback()  # End the read-only transaction holding the cursor.
+
+    def _stream_concurrently(self, queries: List[str]) -> Iterator[Tuple]:
+        """
+        Runs each query on its own connection and yields rows as they arrive.
+
+        Errors raised while reading are re-raised in the caller's thread.
+        """
+        rows: queue.Queue = queue.Queue(maxsize=self.itersize)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    rows.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(index: int, query: str):
+            try:
+                conn = self.pool.getconn()
+                try:
+                    for row in self._stream(conn, query, f"names_{index}"):
+                        if not put(row):
+                            return
+                finally:
+                    self.pool.putconn(conn)
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        threads = [threading.Thread(target=produce, args=(i, query),
+                                    daemon=True)
+                   for i, query in enumerate(queries)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            remaining = len(threads)
+            while remaining:
+                item = rows.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
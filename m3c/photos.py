@@ -0,0 +1,171 @@
+"""
+Storage and post-processing of people's photos
+
+Uploads are copied in chunks to a temporary file in the photo's directory and
+renamed into place, so readers never see a partially written photo. The
+format is taken from the file's contents rather than its name.
+
+A `Worker` then generates the thumbnail served by `/photo?size=thumb` in a
+background thread, applying the photo's EXIF orientation to the thumbnail. The
+uploaded photo itself is kept byte for byte. This requires
+Pillow (`pip install m3c[photos]`); without it, photos are kept as uploaded
+and the full photo is served as the thumbnail.
+"""
+
+from typing import BinaryIO, Optional, Tuple
+
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+from m3c import classes
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+THUMBNAIL_SIZE: Tuple[int, int] = (200, 200)
+
+SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpg",
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+def detect_type(header: bytes) -> Optional[str]:
+    """Returns the extension of a PNG or JPEG image from its first bytes."""
+    for signature, extension in SIGNATURES.items():
+        if header.startswith(signature):
+            return extension
+    return None
+
+
+def replace_atomically(path: str, write) -> None:
+    """Calls `write` with a temporary file that then replaces `path`."""
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def save(stream: BinaryIO, root: str, person_id: int, alias: str,
+         max_size: int = DEFAULT_MAX_SIZE) -> classes.Photo:
+    """
+    Stores an uploaded photo, replacing the person's current photo and
+    thumbnails. Raises `UploadError` if it isn't a PNG or JPEG image or is
+    larger than `max_size` bytes.
+    """
+    header = stream.read(16)
+    extension = detect_type(header)
+    if not extension:
+        raise UploadError("The photo must be a PNG or JPEG image")
+
+    photo = classes.Photo(root, person_id, extension, alias)
+    os.makedirs(photo.path(), exist_ok=True)
+
+    def write(f: BinaryIO) -> None:
+        f.write(header)
+        size = len(header)
+        chunk = stream.read(CHUNK_SIZE)
+        while chunk:
+            size += len(chunk)
+            if size > max_size:
+                raise UploadError(
+                    f"The photo is larger than {max_size // 1024} KiB")
+            f.write(chunk)
+            chunk = stream.read(CHUNK_SIZE)
+
+    replace_atomically(os.path.join(photo.path(), photo.filename()), write)
+
+    # Photos of the other type would be served instead, and thumbnails are
+    # of the previous photo.
+    for other in ("jpg", "png"):
+        stale = classes.Photo(root, person_id, other, alias)
+        names = [stale.thumbnail_filename()]
+        if other != photo.extension:
+            names.append(stale.filename())
+        for name in names:
+            try:
+                os.remove(os.path.join(stale.path(), name))
+            except FileNotFoundError:
+                pass
+
+    return photo
+
+
+def make_thumbnail(photo: classes.Photo) -> bool:
+    """
+    Generates the photo's thumbnail, upright if the photo's EXIF data says
+    it is rotated. Returns whether the thumbnail was generated.
+    """
+    if Image is None:
+        return False
+
+    path = os.path.join(photo.path(), photo.filename())
+    format = "PNG" if photo.extension == "png" else "JPEG"
+    with Image.open(path) as original:
+        icc_profile = original.info.get("icc_profile")
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail(THUMBNAIL_SIZE)
+        replace_atomically(os.path.join(photo.path(),
+                                        photo.thumbnail_filename()),
+                           lambda f: image.save(f, format,
+                                                icc_profile=icc_profile))
+    return True
+
+
+class Worker:
+    """
+    Background thread post-processing uploaded photos one at a time.
+
+    Examples
+    --------
+    ```
+        worker = Worker()
+        worker.submit(save(stream, root, person_id, alias))
+    ```
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[classes.Photo]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="photos",
+                                        daemon=True)
+        self._thread.start()
+
+    def join(self) -> None:
+        """Waits for the submitted photos to be processed."""
+        self._queue.join()
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def submit(self, photo: classes.Photo) -> None:
+        self._queue.put(photo)
+
+    def _run(self) -> None:
+        while True:
+            photo = self._queue.get()
+            try:
+                if photo is None:
+                    return
+                make_thumbnail(photo)
+            except Exception:
+                logging.exception("Processing photo of %s", photo.person_id)
+            finally:
+                self._queue.task_done()
@@ -2,10 +2,12 @@
 
 Usage:
     m3c prefill (-h | --help)
-    m3c prefill <path_to_config>
+    m3c prefill [--bulk] <path_to_config>
 
 Options:
     -h --help       Show this message and exit
+    --bulk          Resolve all records in memory and write the changes with
+                    a few set-based statements instead of record by record
 
 Instructions:
     See README
@@ -14,22 +16,23 @@ Example:
     $ m3c prefill config.yaml
 """
 
-from typing import List, Tuple
+from typing import (
+    Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+)
 
-import io
 import itertools
 import sys
-import xml.etree.ElementTree as ET
-
-import psycopg2
 
 from m3c import config
+from m3c import connections
 from m3c import db
 from m3c import mwb
 from m3c import tools
 
 
-get_person = db.get_person  # Facilitate testing using monkeypatching.
+get_person = db.find_people  # Facilitate testing using monkeypatching.
+
+DEFAULT_ASSOCIATION_BATCH_SIZE = 1000
 
 
 class AmbiguityError(Exception):
@@ -53,25 +56,254 @@ class AmbiguousNamesError(AmbiguityError):
         super().__init__(msg)
 
 
+class AssociationBatch:
+    """
+    Associations of people with organizations waiting to be written.
+
+    Pairs are deduplicated in memory and written with `db.associate_many` once
+    `batch_size` distinct pairs are pending, or when `flush` is called. Each
+    association is reported when its batch is written. Pairs that were already
+    written during this run are reported right away.
+    """
+
+    TEMPLATES = ["person #{} already associated with {} #{}.",
+                 "associated person #{} with {} #{}."]
+
+    def __init__(self, sup_cur: db.Cursor,
+                 batch_size: int = DEFAULT_ASSOCIATION_BATCH_SIZE):
+        assert batch_size > 0
+        self.sup_cur = sup_cur
+        self.batch_size = batch_size
+        # (person ID, organization ID) -> [(psid, organization type)]
+        self.pending: Dict[Tuple[int, int], List[Tuple[str, str]]] = {}
+        self.written: Set[Tuple[int, int]] = set()
+
+    def add(self, psid: str, person_id: int, type: str,
+            organization_id: int) -> None:
+        pair = (person_id, organization_id)
+        if pair in self.written:
+            tmpl = self.TEMPLATES[0]
+            print(psid, tmpl.format(person_id, type, organization_id))
+            return
+
+        self.pending.setdefault(pair, []).append((psid, type))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+
+        added = set(db.associate_many(self.sup_cur, self.pending))
+
+        for pair, sources in self.pending.items():
+            person_id, organization_id = pair
+            for i, (psid, type) in enumerate(sources):
+                t = i == 0 and pair in added
+                tmpl = self.TEMPLATES[int(t)]
+                print(psid, tmpl.format(person_id, type, organization_id))
+
+        self.written.update(self.pending)
+        self.pending.clear()
+
+
+class BulkPrefill:
+    """
+    Set-based alternative to processing records one at a time.
+
+    Records are resolved in memory against the names, contact details, and
+    organizations preloaded from the Supplemental database, following the
+    same rules as `add_people`, `add_organizations`, and `associate`. `apply`
+    then writes every change with a handful of statements.
+
+    People and organizations that don't exist yet are given placeholder IDs,
+    greater than any existing ID, until `apply` reserves real ones.
+    """
+
+    def __init__(self,
+                 names: Iterable[Tuple[int, str, str]],
+                 contacts: Mapping[int, Tuple[str, str]],
+                 organizations: Iterable[Tuple[int, str, str, Optional[int]]]):
+        self.names: Dict[str, List[int]] = {}
+        for person_id, first_name, last_name in names:
+            key = db.namekey(first_name, last_name)
+            self.names.setdefault(key, []).append(person_id)
+        self.contacts = dict(contacts)
+        self.organizations = OrganizationCache(organizations)
+
+        self.new_people: Dict[int, Tuple[str, str]] = {}
+        self.new_organizations: Dict[int, Tuple[str, str, Optional[int]]] = {}
+        self.updated_contacts: Set[int] = set()
+        # Ordered and deduplicated (person ID, organization ID) pairs.
+        self.associations: Dict[Tuple[int, int], None] = {}
+
+        self._next_person = max(self.contacts, default=0) + 1
+        self._next_organization = max(self.organizations.ids.values(),
+                                      default=0) + 1
+
+    @staticmethod
+    def load(sup_cur: db.Cursor) -> "BulkPrefill":
+        names = [(person_id, first_name, last_name)
+                 for person_id, first_name, last_name, _
+                 in db.get_names(sup_cur)]
+        contacts = db.get_people_contact_details(sup_cur)
+        organizations = [(org_id, name, type, parent_id)
+                         for org_id, name, type, parent_id, _
+                         in db.get_organizations(sup_cur)]
+        return BulkPrefill(names, contacts, organizations)
+
+    def add_record(self, record: mwb.NameRecord) -> None:
+        """Resolves a record's people, organizations, and associations."""
+        ppl = [self.person(record.psid, *person)
+               for person in parse_people(record)]
+        orgs = resolve_organizations(record, self.organization)
+        for person_id, *org_ids in \
+                pair_people_with_organizations(record, ppl, orgs):
+            if person_id == 0:
+                continue
+            for org_id in org_ids:
+                if org_id > 0:
+                    self.associations[(person_id, org_id)] = None
+
+    def person(self, psid: str, first_name: str, last_name: str,
+               email: str, phone: str) -> int:
+        assert first_name and last_name
+        key = db.namekey(first_name, last_name)
+        person_ids = self.names.get(key, [])
+
+        if len(person_ids) > 1:
+            error(psid, "multiple people with the same name:",
+                  f'first="{first_name}"',
+                  f'last="{last_name}"',
+                  f'ids={person_ids}')
+            return 0
+
+        if len(person_ids) == 1:
+            pid = person_ids[0]
+            if (email, phone) != self.contacts.get(pid, ("", "")):
+                self.contacts[pid] = (email, phone)
+                if pid not in self.new_people:
+                    self.updated_contacts.add(pid)
+            return pid
+
+        pid = self._next_person
+        self._next_person += 1
+        self.new_people[pid] = (first_name, last_name)
+        self.contacts[pid] = (email, phone)
+        self.names[key] = [pid]
+        return pid
+
+    def organization(self, type: str, name: str, parent: Optional[int]) -> int:
+        oid = self.organizations.get(type, name, parent)
+        if oid:
+            return oid
+
+        oid = self._next_organization
+        self._next_organization += 1
+        self.new_organizations[oid] = (type, name, parent or None)
+        self.organizations.put(type, name, parent, oid)
+        return oid
+
+    def apply(self, sup_cur: db.Cursor) -> None:
+        """Writes the new people, organizations, and associations."""
+        people = dict(zip(self.new_people,
+                          db.allocate_ids(sup_cur, "people",
+                                          len(self.new_people))))
+        orgs = dict(zip(self.new_organizations,
+                        db.allocate_ids(sup_cur, "organizations",
+                                        len(self.new_organizations))))
+
+        db.insert_people(sup_cur, (
+            (people[pid], first_name, last_name, *self.contacts[pid])
+            for pid, (first_name, last_name) in self.new_people.items()
+        ))
+        print(f"Added {len(people)} people.")
+
+        db.insert_organizations(sup_cur, (
+            (orgs[oid], name, type, orgs.get(parent, parent))
+            for oid, (type, name, parent) in self.new_organizations.items()
+        ))
+        print(f"Added {len(orgs)} organizations.")
+
+        count = db.update_many_contact_details(sup_cur, (
+            (pid, *self.contacts[pid]) for pid in self.updated_contacts
+        ))
+        print(f"Updated contact details for {count} people.")
+
+        associated = db.associate_many(sup_cur, (
+            (people.get(pid, pid), orgs.get(oid, oid))
+            for pid, oid in self.associations
+        ))
+        print(f"Associated {len(associated)} people with organizations "
+              f"({len(self.associations) - len(associated)} already were).")
+
+
+class OrganizationCache:
+    """
+    Organization IDs keyed by (type, name, parent ID).
+
+    Loaded from the Supplemental database with a single query at the start of
+    a prefill run and kept up to date as organizations are added, so resolving
+    a record's hierarchy doesn't need a round trip per organization.
+    """
+
+    def __init__(self,
+                 organizations: Iterable[Tuple[int, str, str, Optional[int]]]):
+        self.ids: Dict[Tuple[str, str, Optional[int]], int] = {}
+        for org_id, name, type, parent_id in organizations:
+            self.ids[(type, name, parent_id or None)] = org_id
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def load(sup_cur: db.Cursor) -> "OrganizationCache":
+        return OrganizationCache(
+            (org_id, name, type, parent_id)
+            for org_id, name, type, parent_id, _
+            in db.get_organizations(sup_cur))
+
+    def get(self, type: str, name: str, parent: Optional[int]) -> int:
+        """Returns the organization's ID or 0 if it doesn't exist."""
+        oid = self.ids.get((type, name, parent or None), 0)
+        if oid:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return oid
+
+    def add(self, sup_cur: db.Cursor,
+            type: str, name: str, parent: Optional[int]) -> int:
+        """Adds the organization to the database and the cache."""
+        oid = db.add_organization(sup_cur, type, name, parent)
+        self.put(type, name, parent, oid)
+        return oid
+
+    def put(self, type: str, name: str, parent: Optional[int],
+            oid: int) -> None:
+        self.ids[(type, name, parent or None)] = oid
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return (f"Organization cache: {self.hits} hits, {self.misses} misses "
+                f"({rate:.1%} hit rate).")
+
+
 def add_developers(sup_cur: db.Cursor) -> None:
     pmids = set(tools.MetabolomicsToolsWiki.pmids())
     total = len(pmids)
     if total == 0:
         return
 
-    publications = db.get_pubmed_publications(sup_cur, pmids)
+    publications = db.get_pubmed_authors(sup_cur, pmids)
     pmids = pmids.intersection(publications.keys())
-    print(f"Found {len(pmids)} of {total} tools-related publications in the "
-          "Supplemental database.")
+    print(f"Found authors of {len(pmids)} of {total} tools-related "
+          "publications in the Supplemental database.")
     if len(pmids) == 0:
         return
 
     for pmid in pmids:
-        author_list = parse_author_list(publications[pmid])
-        for author in author_list:
-            forename = author.findtext("ForeName", "").strip()
-            lastname = author.findtext("LastName", "").strip()
-
+        for forename, lastname, affiliations in publications[pmid]:
             if not forename:
                 print(f"PMID {pmid}: missing forename of author {lastname}")
                 continue
@@ -80,7 +312,7 @@ def add_developers(sup_cur: db.Cursor) -> None:
                 print(f"PMID {pmid}: missing surname of author {forename}")
                 continue
 
-            matches = list(db.get_person(sup_cur, forename, lastname))
+            matches = db.find_people(sup_cur, forename, lastname)
             if len(matches) > 1:
                 print(f"PMID {pmid}: WARNING! Found {len(matches)} people "
                       f" named {forename} {lastname}: {matches}")
@@ -97,129 +329,46 @@ def add_developers(sup_cur: db.Cursor) -> None:
                     continue
                 print(f"PMID {pmid}: added {forename} {lastname}: {pid}")
 
-            affiliation_list = author.findall(".//Affiliation")
-            for element in affiliation_list:
-                affiliation = element.text
-                if affiliation is None or affiliation.strip() == '':
-                    continue
+            for affiliation in affiliations:
                 print(f"PMID {pmid}: affiliation for {forename} {lastname}"
-                      f": {affiliation.strip()}")
+                      f": {affiliation}")
 
     return
 
 
 def add_organizations(sup_cur: db.Cursor,
-                      record: mwb.NameRecord
+                      record: mwb.NameRecord,
+                      cache: Optional[OrganizationCache] = None
                       ) -> List[Tuple[int, int, int]]:
     """
     Adds institutes, departments, and labs to the Supplemental database.
 
+    Organizations are looked up in `cache` if given, otherwise in the
+    database.
+
     Returns the IDs as a 3-tuple (institute ID, department ID, lab ID).
     """
-    if not record.institute:
-        assert not record.department
-        assert not record.laboratory
-        return []
-
-    institutes = [inst.strip() for inst in record.institute.split(';')]
-    departments = [dept.strip() for dept in record.department.split(';')]
-    laboratories = [lab.strip() for lab in record.laboratory.split(';')]
-
-    # Special case: allow department field is be completely empty.
-    if record.department.strip() == "":
-        departments = [""] * len(institutes)
-    # Special case: allow laboratory field is be completely empty.
-    if record.laboratory.strip() == "":
-        laboratories = [""] * len(institutes)
-
-    icnt = len(institutes)
-    dcnt = len(departments)
-    lcnt = len(laboratories)
-
-    if not(dcnt in [1, lcnt] and icnt in [1, dcnt]):
-        raise AmbiguousHierarchyError(record)
-
-    institute_ids = []
-    for i, institute in enumerate(institutes):
-        oid = db.get_organization(sup_cur, mwb.INSTITUTE, institute)
-        if not oid:
-            oid = db.add_organization(sup_cur, mwb.INSTITUTE, institute)
-            print(record.psid, f"added institute #{oid}: {institute}.")
+    def resolve(type: str, name: str, parent: Optional[int]) -> int:
+        if cache:
+            oid = cache.get(type, name, parent)
         else:
-            print(record.psid, f"found institute #{oid}: {institute}.")
-        assert oid
-        institute_ids.append(oid)
-
-    department_ids = []
-    for i, department in enumerate(departments):
-        if not department:
-            department_ids.append(0)
-            continue
-
-        if icnt == 1:
-            parent = institute_ids[0]
-        elif icnt > 1:
-            parent = institute_ids[i]
-        assert parent > 0
+            oid = db.get_organization(sup_cur, type, name, parent)
+        if oid:
+            print(record.psid, f"found {type} #{oid}: {name}.")
+            return oid
 
-        oid = db.get_organization(sup_cur, mwb.DEPARTMENT, department, parent)
-
-        if not oid:
-            oid = db.add_organization(sup_cur, mwb.DEPARTMENT, department,
-                                      parent)
-            print(record.psid,
-                  f"added department #{oid}: {department} (parent #{parent}).")
+        if cache:
+            oid = cache.add(sup_cur, type, name, parent)
         else:
-            print(record.psid, f"found department #{oid}: {department}.")
-
-        assert oid
-        department_ids.append(oid)
-
-    laboratory_ids = []
-    for i, laboratory in enumerate(laboratories):
-        if not laboratory:
-            laboratory_ids.append(0)
-            continue
-
-        if dcnt == 1:
-            parent = department_ids[0]
-        elif dcnt > 1:
-            parent = department_ids[i]
-        if parent == 0:
-            # If there's no Department, the Institute is the parent.
-            if icnt == 1:
-                parent = institute_ids[0]
-            elif icnt > 0:
-                parent = institute_ids[i]
-        assert parent > 0
-
-        oid = db.get_organization(sup_cur, mwb.LABORATORY, laboratory, parent)
-
-        if not oid:
-            oid = db.add_organization(sup_cur, mwb.LABORATORY, laboratory,
-                                      parent)
-            print(record.psid,
-                  f"added laboratory #{oid}: {laboratory} (parent #{parent}).")
+            oid = db.add_organization(sup_cur, type, name, parent)
+        if parent:
+            print(record.psid, f"added {type} #{oid}: {name} "
+                               f"(parent #{parent}).")
         else:
-            print(record.psid, f"found laboratory #{oid}: {laboratory}.")
-
-        assert oid
-        laboratory_ids.append(oid)
-
-    ids: List[Tuple[int, int, int]] = []
-
-    for i, laboratory_id in enumerate(laboratory_ids):
-        institute_id = institute_ids[0]
-        if icnt > 1:
-            institute_id = institute_ids[i]
-
-        department_id = department_ids[0]
-        if dcnt > 1:
-            department_id = department_ids[i]
-
-        ids.append((institute_id, department_id, laboratory_id))
+            print(record.psid, f"added {type} #{oid}: {name}.")
+        return oid
 
-    return ids
+    return resolve_organizations(record, resolve)
 
 
 def add_people(sup_cur: db.Cursor, record: mwb.NameRecord) -> List[int]:
@@ -227,31 +376,9 @@ def add_people(sup_cur: db.Cursor, record: mwb.NameRecord) -> List[int]:
     ids: List[int] = []
 
     psid = record.psid
-    last_names = [ln.strip() for ln in record.last_name.split(';')]
-    first_names = [fn.strip() for fn in record.first_name.split(';')]
-    emails = [e.strip() for e in record.email.split(';')]
-    phones = [p.strip() for p in record.phone.split(';')]
-
-    if len(last_names) != len(first_names):
-        raise AmbiguousNamesError(record)
-
-    if len(emails) > len(last_names):
-        error(psid, "too many email addresses for", record.email)
-        emails = []  # Don't try to add ANY email addresses for this record.
-    if len(phones) > len(last_names):
-        error(psid, "too many phone numbers for", record.phone)
-        phones = []  # Don't try to add ANY phone numbers for this record.
-
-    # It's acceptable to have fewer emails and phone numbers than names.
-    combined = itertools.zip_longest(last_names, first_names, emails, phones,
-                                     fillvalue="")
-
-    for last_name, first_name, email, phone in combined:
+    for first_name, last_name, email, phone in parse_people(record):
         person_ids = list(get_person(sup_cur, first_name, last_name,
                                      exclude_withheld=False))
-        if bad_email(email):
-            error(psid, f"bad email address: {record.email}")
-            email = ""
 
         if len(person_ids) > 1:
             pid = 0
@@ -282,34 +409,50 @@ def add_people(sup_cur: db.Cursor, record: mwb.NameRecord) -> List[int]:
     return ids
 
 
-def associate(sup_cur: db.Cursor, psid: str, person_id: int, institute_id: int,
-              department_id: int, laboratory_id: int):
+def associate(associations: AssociationBatch, psid: str, person_id: int,
+              institute_id: int, department_id: int, laboratory_id: int):
     if person_id == 0:
         return
 
-    templates = ["person #{} already associated with {} #{}.",
-                 "associated person #{} with {} #{}."]
-
     if institute_id > 0:
-        t = db.associate(sup_cur, person_id, institute_id)
-        tmpl = templates[int(t)]
-        print(psid, tmpl.format(person_id, "institute", institute_id))
+        associations.add(psid, person_id, "institute", institute_id)
 
     if department_id > 0:
-        t = db.associate(sup_cur, person_id, department_id)
-        tmpl = templates[int(t)]
-        print(psid, tmpl.format(person_id, "department", department_id))
+        associations.add(psid, person_id, "department", department_id)
 
     if laboratory_id > 0:
-        t = db.associate(sup_cur, person_id, laboratory_id)
-        tmpl = templates[int(t)]
-        print(psid, tmpl.format(person_id, "laboratory", laboratory_id))
+        associations.add(psid, person_id, "laboratory", laboratory_id)
 
 
 def bad_email(email: str) -> bool:
     return ' ' in email
 
 
+def bulk_process_projects_and_studies(mwb_client: mwb.Client,
+                                      sup_cur: db.Cursor,
+                                      embargoed: List[str]
+                                      ) -> None:
+    """
+    Set-based equivalent of `process_projects_and_studies`.
+
+    See `BulkPrefill`.
+    """
+    bulk = BulkPrefill.load(sup_cur)
+
+    for rec in mwb_client.fetch_names():
+        if rec.pstype == mwb.STUDY and rec.psid in embargoed:
+            continue  # Exclude embargoed studies.
+
+        try:
+            bulk.add_record(rec)
+        except AmbiguityError as e:
+            error(rec.psid, type(e).__name__, e)
+            continue
+
+    bulk.apply(sup_cur)
+    print(bulk.organizations.summary())
+
+
 def error(*values, sep=' ', end='\n', flush=False) -> None:
     """
     Prints values to `stderr` instead of `stdout`.
@@ -329,27 +472,86 @@ def main():
         print(__doc__)
         sys.exit()
 
-    prefill(sys.argv[1])
+    bulk = sys.argv[1] == "--bulk"
+    if bulk and len(sys.argv) < 3:
+        error(__doc__)
+        sys.exit(2)
+
+    prefill(sys.argv[-1], bulk)
+
+
+def pair_people_with_organizations(record: mwb.NameRecord,
+                                   people: List[int],
+                                   orgs: List[Tuple[int, int, int]]
+                                   ) -> List[Tuple[int, int, int, int]]:
+    """
+    Determines which people belong to which organizations.
+
+    Returns 4-tuples (person ID, institute ID, department ID, lab ID).
+    """
+    if len(people) == 1:
+        return [(people[0], *org) for org in orgs]
+
+    if len(orgs) == 1:
+        return [(person_id, *orgs[0]) for person_id in people]
+
+    if len(people) != len(orgs):
+        error(record.psid,
+              f"cannot determine association between {len(people)}",
+              f"person(s) and {len(orgs)} organization(s).")
+        return []
+
+    return [(person_id, *org) for person_id, org in zip(people, orgs)]
+
+
+def parse_people(record: mwb.NameRecord) -> List[Tuple[str, str, str, str]]:
+    """
+    Splits a record's people into (first name, last name, email, phone).
+
+    Contact details that cannot be attributed to someone are dropped.
+    """
+    psid = record.psid
+    last_names = [ln.strip() for ln in record.last_name.split(';')]
+    first_names = [fn.strip() for fn in record.first_name.split(';')]
+    emails = [e.strip() for e in record.email.split(';')]
+    phones = [p.strip() for p in record.phone.split(';')]
+
+    if len(last_names) != len(first_names):
+        raise AmbiguousNamesError(record)
 
+    if len(emails) > len(last_names):
+        error(psid, "too many email addresses for", record.email)
+        emails = []  # Don't try to add ANY email addresses for this record.
+    if len(phones) > len(last_names):
+        error(psid, "too many phone numbers for", record.phone)
+        phones = []  # Don't try to add ANY phone numbers for this record.
 
-def parse_author_list(xml: str) -> List[ET.Element]:
-    file = io.StringIO(xml)
-    data = ET.parse(file)
-    author_list = data.findall("//Article/AuthorList/Author")
-    return author_list
+    # It's acceptable to have fewer emails and phone numbers than names.
+    combined = itertools.zip_longest(last_names, first_names, emails, phones,
+                                     fillvalue="")
 
+    people: List[Tuple[str, str, str, str]] = []
+    for last_name, first_name, email, phone in combined:
+        if bad_email(email):
+            error(psid, f"bad email address: {record.email}")
+            email = ""
+        people.append((first_name, last_name, email, phone))
 
-def prefill(config_path: str):
+    return people
+
+
+def prefill(config_path: str, bulk: bool = False):
     cfg = config.load(config_path)
 
-    mwb_client = mwb.Client(cfg.get("mwb_host"), cfg.get("mwb_port"))
-    sup_conn: db.Connection = psycopg2.connect(
-        host=cfg.get("sup_host"),
-        dbname=cfg.get("sup_database"),
-        user=cfg.get("sup_username"),
-        password=cfg.get("sup_password"),
-        port=cfg.get("sup_port")
-    )
+    tools.MetabolomicsToolsWiki.configure(
+        cache_path=cfg.get("mtw_cache_path", ""),
+        offline=bool(cfg.get("mtw_offline", False)))
+
+    mwb_pool = connections.create_pool(cfg, connections.WORKBENCH, "prefill")
+    sup_pool = connections.create_pool(cfg, connections.SUPPLEMENTAL,
+                                       "prefill")
+    mwb_client = mwb.Client(mwb_pool,
+                            concurrent=bool(cfg.get("mwb_concurrent", False)))
 
     embargoed_path = cfg.get("embargoed", "")
     embargoed: List[str] = []
@@ -357,27 +559,41 @@ def prefill(config_path: str):
         with open(embargoed_path) as f:
             embargoed = [line.strip() for line in f if line]
 
-    with sup_conn:
+    with sup_pool.connection() as sup_conn:
         with sup_conn.cursor() as sup_cur:
-            process_projects_and_studies(mwb_client, sup_cur, embargoed)
+            if bulk:
+                bulk_process_projects_and_studies(mwb_client, sup_cur,
+                                                  embargoed)
+            else:
+                batch_size = int(cfg.get("association_batch_size",
+                                         DEFAULT_ASSOCIATION_BATCH_SIZE))
+                process_projects_and_studies(mwb_client, sup_cur, embargoed,
+                                             batch_size)
             add_developers(sup_cur)
 
-    sup_conn.close()
+    mwb_client.disconnect()
+    mwb_pool.close()
+    sup_pool.close()
 
 
 def process_projects_and_studies(mwb_client: mwb.Client,
                                  sup_cur: db.Cursor,
-                                 embargoed: List[str]
+                                 embargoed: List[str],
+                                 batch_size: int =
+                                 DEFAULT_ASSOCIATION_BATCH_SIZE
                                  ) -> None:
     """
     Process all `project` and `study` records from Metabolomics Workbench.
 
     Parse names of people and organizations and then associate the right people
-    with the right organizations.
+    with the right organizations. Associations are written `batch_size` at a
+    time.
 
     Note: embargoed studies are skipped.
     """
     records = mwb_client.fetch_names()
+    organizations = OrganizationCache.load(sup_cur)
+    associations = AssociationBatch(sup_cur, batch_size)
 
     for rec in records:
         if rec.pstype == mwb.STUDY and rec.psid in embargoed:
@@ -385,34 +601,111 @@ def process_projects_and_studies(mwb_client: mwb.Client,
 
         try:
             ppl = add_people(sup_cur, rec)
-            orgs = add_organizations(sup_cur, rec)
+            orgs = add_organizations(sup_cur, rec, organizations)
         except AmbiguityError as e:
             error(rec.psid, type(e).__name__, e)
             continue
 
-        if len(ppl) == 1:
-            person_id = ppl[0]
-            for (institute_id, dept_id, lab_id) in orgs:
-                associate(sup_cur,
-                          rec.psid, person_id, institute_id, dept_id, lab_id)
-            continue
+        for person_id, institute_id, dept_id, lab_id in \
+                pair_people_with_organizations(rec, ppl, orgs):
+            associate(associations,
+                      rec.psid, person_id, institute_id, dept_id, lab_id)
+
+    associations.flush()
+    print(organizations.summary())
 
-        if len(orgs) == 1:
-            institute_id, dept_id, lab_id = orgs[0]
-            for person_id in ppl:
-                associate(sup_cur,
-                          rec.psid, person_id, institute_id, dept_id, lab_id)
+
+def resolve_organizations(record: mwb.NameRecord,
+                          resolve: Callable[[str, str, Optional[int]], int]
+                          ) -> List[Tuple[int, int, int]]:
+    """
+    Determines the hierarchy of institutes, departments, and labs.
+
+    `resolve(type, name, parent_id)` must return the ID of the organization,
+    adding it if necessary. Returns the IDs as a 3-tuple (institute ID,
+    department ID, lab ID).
+    """
+    if not record.institute:
+        assert not record.department
+        assert not record.laboratory
+        return []
+
+    institutes = [inst.strip() for inst in record.institute.split(';')]
+    departments = [dept.strip() for dept in record.department.split(';')]
+    laboratories = [lab.strip() for lab in record.laboratory.split(';')]
+
+    # Special case: allow department field is be completely empty.
+    if record.department.strip() == "":
+        departments = [""] * len(institutes)
+    # Special case: allow laboratory field is be completely empty.
+    if record.laboratory.strip() == "":
+        laboratories = [""] * len(institutes)
+
+    icnt = len(institutes)
+    dcnt = len(departments)
+    lcnt = len(laboratories)
+
+    if not(dcnt in [1, lcnt] and icnt in [1, dcnt]):
+        raise AmbiguousHierarchyError(record)
+
+    institute_ids = []
+    for i, institute in enumerate(institutes):
+        oid = resolve(mwb.INSTITUTE, institute, None)
+        assert oid
+        institute_ids.append(oid)
+
+    department_ids = []
+    for i, department in enumerate(departments):
+        if not department:
+            department_ids.append(0)
             continue
 
-        if len(ppl) != len(orgs):
-            error(rec.psid, f"cannot determine association between {len(ppl)}",
-                  f"person(s) and {len(orgs)} organization(s).")
+        if icnt == 1:
+            parent = institute_ids[0]
+        elif icnt > 1:
+            parent = institute_ids[i]
+        assert parent > 0
+
+        oid = resolve(mwb.DEPARTMENT, department, parent)
+        assert oid
+        department_ids.append(oid)
+
+    laboratory_ids = []
+    for i, laboratory in enumerate(laboratories):
+        if not laboratory:
+            laboratory_ids.append(0)
             continue
 
-        for (person_id, org) in zip(ppl, orgs):
-            institute_id, dept_id, lab_id = org
-            associate(sup_cur,
-                      rec.psid, person_id, institute_id, dept_id, lab_id)
+        if dcnt == 1:
+            parent = department_ids[0]
+        elif dcnt > 1:
+            parent = department_ids[i]
+        if parent == 0:
+            # If there's no Department, the Institute is the parent.
+            if icnt == 1:
+                parent = institute_ids[0]
+            elif icnt > 0:
+                parent = institute_ids[i]
+        assert parent > 0
+
+        oid = resolve(mwb.LABORATORY, laboratory, parent)
+        assert oid
+        laboratory_ids.append(oid)
+
+    ids: List[Tuple[int, int, int]] = []
+
+    for i, laboratory_id in enumerate(laboratory_ids):
+        institute_id = institute_ids[0]
+        if icnt > 1:
+            institute_id = institute_ids[i]
+
+        department_id = department_ids[0]
+        if dcnt > 1:
+            department_id = department_ids[i]
+
+        ids.append((institute_id, department_id, laboratory_id))
+
+    return ids
 
 
 if __name__ == "__main__":
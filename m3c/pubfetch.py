@@ -2,7 +2,8 @@
 
 Usage:
     m3c pubfetch -h | --help
-    m3c pubfetch [--authorships] [--delay=DELAY] [--max=MAX] <config>
+    m3c pubfetch [--authorships] [--delay=DELAY] [--max=MAX] [--refresh]
+                 [--resume] <config>
 
 Options:
     -h --help    Show this help message and exit.
@@ -17,7 +18,25 @@ If `--authorships` is specified, publications will not be downloaded.
 
 `DELAY` is the number of seconds to wait between PubMed requests.
 
-`MAX` is the maximum number of authorship searches to perform.
+`MAX` is the maximum number of PubMed and Catalyst requests to make. Each
+authorship search and each batch of downloads counts as one request; searches
+answered from the cache are free. People and publications that are most
+overdue for a refresh are handled first.
+
+Rather than refreshing everything on a fixed cutoff, each person and
+publication is scheduled individually: the wait between refreshes starts at
+`refresh_interval_days` (default 15) and doubles each time a refresh finds
+nothing new, up to `refresh_max_interval_days` (default 360).
+
+Catalyst and PubMed search results are cached in `cache_path` for
+`cache_ttl_days` so that re-running after a failure is cheap. If `--refresh`
+is specified, cached results are ignored (but still updated).
+
+Progress is committed every `checkpoint_size` (default 50) people and after
+every batch of downloads; batches that fail to download are retried by the
+next runs, until they have failed `download_attempts` (default 5) times. If
+`--resume` is specified, an interrupted run continues with the people it had
+yet to search for.
 
 This is intended to be used by `metab_import.py` to generate Publication and
 Authorship triples for VIVO.
@@ -25,6 +44,7 @@ Authorship triples for VIVO.
 Copyright 2020 University of Florida
 """
 
+import concurrent.futures
 import datetime
 import getopt
 import http
@@ -39,41 +59,75 @@ from Bio import Entrez
 import psycopg2
 import psycopg2.extensions
 
+from m3c import cache
 from m3c import catalyst
 from m3c import config
 from m3c import classes
+from m3c import connections
 from m3c import db
+from m3c import schedule
 from m3c import tools
 
 psql_connection = typing.Type[psycopg2.extensions.connection]
 psql_cursor = typing.Type[psycopg2.extensions.cursor]
 
 pubmed_delay: int = 0
+pubmed_cache: typing.Optional[cache.ResponseCache] = None
+
+# Number of people whose authorships are committed together.
+DEFAULT_CHECKPOINT_SIZE = 50
 
+# Number of runs that try to download a publication before giving up on it.
+DEFAULT_DOWNLOAD_ATTEMPTS = 5
 
-def fetch_publications(cursor: psql_cursor):
+# An author's forename, last name, and affiliations.
+Author = typing.Tuple[str, str, typing.List[str]]
+
+
+def fetch_publications(cursor: psql_cursor,
+                       sched: schedule.Schedule,
+                       budget: schedule.Budget,
+                       max_attempts: int = DEFAULT_DOWNLOAD_ATTEMPTS):
     authorships = db.get_pubmed_authorships(cursor)
     tools_pmids = tools.MetabolomicsToolsWiki.pmids()
-    pmids_to_download = set(tools_pmids).union(authorships.keys())
-    downloadts = db.get_pubmed_download_timestamps(cursor)
-    skip = [pmid
-            for pmid, downloaded
-            in downloadts.items()
-            if too_recent(downloaded)]
-    pmids_to_download -= set(skip)
-
-    log(f"Skipping {len(skip)} publications downloaded recently.")
-    if pmids_to_download:
-        log(f"Downloading XML for {len(pmids_to_download)} publications.")
-
-    pmids = list(pmids_to_download)
+    wanted = set(tools_pmids).union(authorships.keys())
+    downloads = db.get_pubmed_download_timestamps(cursor)
+    history = {pmid: downloads.get(pmid, (None, 0)) for pmid in wanted}
+    due = sched.overdue(history)
+
+    log(f"Skipping {len(wanted) - len(due)} publications not yet due "
+        "for a refresh.")
+
+    # Publications whose download failed during an earlier run go first,
+    # unless it has failed `max_attempts` times.
+    failed = db.get_publication_retries(cursor)
+    retries = [pmid for pmid, attempts in failed if attempts < max_attempts]
+    abandoned = [pmid for pmid, attempts in failed
+                 if attempts >= max_attempts]
+    if retries:
+        log(f"Retrying {len(retries)} publications that failed to download.")
+    if abandoned:
+        log(f"Giving up on {len(abandoned)} publications that failed to "
+            f"download {max_attempts} times: {', '.join(abandoned)}")
+    skipped = set(pmid for pmid, _ in failed)
+    pmids = retries + [pmid for pmid in due if pmid not in skipped]
+
+    if pmids:
+        log(f"Downloading XML for {len(pmids)} publications.")
+
+    # Each batch is committed separately so that a failure loses at most one.
+    conn = cursor.connection
     BATCH_SIZE = 5000
     for i in range(0, len(pmids), BATCH_SIZE):
+        if not budget.spend():
+            log("Reached the limit of PubMed requests for this run")
+            break
+        batch = pmids[i:(i + BATCH_SIZE)]
         try:
-            batch = pmids[i:(i + BATCH_SIZE)]
             log(f"Downloading {i} through "
                 f"{min(len(pmids), i+BATCH_SIZE)-1}")
             articles = pubmed_efetch(batch)
+            authors: typing.Dict[str, typing.List[Author]] = {}
             for article in articles.getroot():
                 try:
                     if article.tag == "PubmedBookArticle":
@@ -83,26 +137,37 @@ def fetch_publications(cursor: psql_cursor):
                     assert pmid
                     xml = ET.tostring(article).decode("utf-8")
                     db.upsert_publication(cursor, pmid, xml)
+                    authors[pmid] = db.parse_pubmed_authors(article)
                 except Exception:
                     log(ET.tostring(article))
                     traceback.print_exc()
                     continue
+            db.replace_pubmed_authors(cursor, authors)
+            db.dequeue_publication_retries(cursor, batch)
+            conn.commit()
             log(f"Batch done.")
-        except Exception:
+        except Exception as e:
             traceback.print_exc()
             log(f"Error while processing PMIDs: {batch}")
+            conn.rollback()
+            db.enqueue_publication_retries(cursor, batch, repr(e))
+            conn.commit()
+            log(f"Queued {len(batch)} publications to retry next run.")
             continue
 
     return
 
 
 def get_pubmed_ids(first_name: str, last_name: str,
-                   affiliations: typing.List[str]) \
+                   affiliations: typing.List[str],
+                   budget: typing.Optional[schedule.Budget] = None) \
         -> typing.List[str]:
     """
     Get the PMIDs associated with a person with the passed affiliations.
 
-    Returns an empty array if no affiliations are passed.
+    Returns an empty array if no affiliations are passed. Searches that
+    aren't cached spend from `budget`, raising `schedule.BudgetExhausted`
+    once it runs out.
 
     Here is an example of a full query with a person with first name Arthur,
     last name Edison, and two affiliations.
@@ -122,8 +187,18 @@ def get_pubmed_ids(first_name: str, last_name: str,
     affiliation = " OR ".join(orgs)
     query = f"{first_name} {last_name}[Author - Full] AND ({affiliation})"
 
+    key = cache.ResponseCache.fingerprint("esearch", query)
+    if pubmed_cache:
+        cached = pubmed_cache.get(key)
+        if cached is not None:
+            return cached
+
+    if budget:
+        budget.charge()
     try:
         pmids = pubmed_esearch(query)
+        if pubmed_cache:
+            pubmed_cache.put(key, pmids)
         return pmids
     except urllib.error.HTTPError as err:
         if err.code != http.HTTPStatus.TOO_MANY_REQUESTS:
@@ -140,8 +215,8 @@ def log(*values):
 
 def main():
     """Adds publications and authorships to the mwb_supplemental database."""
-    help, config_path, only_update_authorships, delay, max_authorships = \
-        parse_args(sys.argv)
+    help, config_path, only_update_authorships, delay, max_requests, \
+        refresh, resume = parse_args(sys.argv)
 
     if help:
         print(__doc__)
@@ -151,14 +226,16 @@ def main():
         log(__doc__)
         sys.exit(2)
 
-    pubfetch(config_path, only_update_authorships, delay, max_authorships)
+    pubfetch(config_path, only_update_authorships, delay, max_requests,
+             refresh, resume)
 
 
-def parse_args(argv) -> typing.Tuple[bool, str, bool, int, int]:
+def parse_args(argv) -> typing.Tuple[bool, str, bool, int, int, bool, bool]:
     try:
         opts, args = getopt.getopt(argv[1:],
                                    "h",
-                                   ["help", "authorships", "delay=", "max="])
+                                   ["help", "authorships", "delay=", "max=",
+                                    "refresh", "resume"])
     except getopt.GetoptError:
         log(__doc__)
         sys.exit(2)
@@ -166,7 +243,9 @@ def parse_args(argv) -> typing.Tuple[bool, str, bool, int, int]:
     help = False
     authorships = False
     delay = 0
-    max_authorships = -1
+    max_requests = -1
+    refresh = False
+    resume = False
 
     for opt, arg in opts:
         if opt in ["-h", "--help"]:
@@ -175,12 +254,18 @@ def parse_args(argv) -> typing.Tuple[bool, str, bool, int, int]:
         if opt in ["-a", "--authorships"]:
             authorships = True
             continue
+        if opt == "--refresh":
+            refresh = True
+            continue
+        if opt == "--resume":
+            resume = True
+            continue
         try:
             if opt == "--delay":
                 delay = abs(int(arg))
                 continue
             if opt == "--max":
-                max_authorships = abs(int(arg))
+                max_requests = abs(int(arg))
                 continue
         except ValueError:
             log(f"error: invalid {opt}: {arg}")
@@ -194,37 +279,70 @@ def parse_args(argv) -> typing.Tuple[bool, str, bool, int, int]:
 
     config = args[0]
 
-    return (help, config, authorships, delay, max_authorships)
+    return (help, config, authorships, delay, max_requests, refresh, resume)
 
 
 def pubfetch(
     config_path: str,
     only_update_authorships: bool,
     delay: int,
-    max_authorships: int
+    max_requests: int,
+    refresh: bool = False,
+    resume: bool = False
 ) -> None:
     global pubmed_delay
+    global pubmed_cache
     pubmed_delay = delay
 
     cfg = config.load(config_path)
 
+    tools.MetabolomicsToolsWiki.configure(
+        cache_path=cfg.get("mtw_cache_path", ""),
+        offline=bool(cfg.get("mtw_offline", False)))
+
+    ttl = float(cfg.get("cache_ttl_days", cache.DEFAULT_TTL.days))
+    pubmed_cache = cache.ResponseCache(
+        cfg.get("cache_path", "pubfetch_cache.sqlite"),
+        ttl=datetime.timedelta(days=ttl),
+        max_entries=int(cfg.get("cache_max_entries",
+                                cache.DEFAULT_MAX_ENTRIES)),
+        refresh=refresh)
+
+    base = int(cfg.get("refresh_interval_days",
+                       schedule.BASE_INTERVAL.days))
+    maximum = int(cfg.get("refresh_max_interval_days",
+                          schedule.MAX_INTERVAL.days))
+    sched = schedule.Schedule(base=datetime.timedelta(days=base),
+                              maximum=datetime.timedelta(days=maximum))
+    budget = schedule.Budget(max_requests)
+    checkpoint_size = int(cfg.get("checkpoint_size", DEFAULT_CHECKPOINT_SIZE))
+    download_attempts = int(cfg.get("download_attempts",
+                                    DEFAULT_DOWNLOAD_ATTEMPTS))
+    client = catalyst.Client(
+        workers=int(cfg.get("catalyst_workers", 4)),
+        timeout=float(cfg.get("catalyst_timeout", 60)),
+        retries=int(cfg.get("catalyst_retries", 3)),
+        cache=pubmed_cache,
+        budget=budget)
+
     pubmed_init(email=cfg.get("pubmed_email"),
                 api_key=cfg.get("pubmed_api_token"))
 
-    sup_conn: psql_connection
-    sup_conn = psycopg2.connect(host=cfg.get("sup_host"),
-                                dbname=cfg.get("sup_database"),
-                                user=cfg.get("sup_username"),
-                                password=cfg.get("sup_password"),
-                                port=cfg.get("sup_port"))
+    sup_pool = connections.create_pool(cfg, connections.SUPPLEMENTAL,
+                                       "pubfetch")
 
-    with sup_conn:
+    with sup_pool.connection() as sup_conn:
         with sup_conn.cursor() as cursor:
-            update_authorships(cursor, max_authorships)
+            with client:
+                update_authorships(cursor, sched, budget, client,
+                                   checkpoint_size, resume)
             if not only_update_authorships:
-                fetch_publications(cursor)
+                fetch_publications(cursor, sched, budget, download_attempts)
 
-    sup_conn.close()
+    sup_pool.close()
+
+    log(f"Cache hits: {pubmed_cache.hits}; misses: {pubmed_cache.misses}")
+    pubmed_cache.close()
 
 
 def pubmed_efetch(id_list: typing.List[str]) -> ET.ElementTree:
@@ -270,71 +388,125 @@ def pubmed_init(email: typing.Optional[str], api_key: typing.Optional[str]):
     Entrez.api_key = api_key
 
 
-def too_recent(event: datetime.datetime,
-               cutoff=datetime.timedelta(days=15)) -> bool:
-    """Checks to see if event occurred more recently than cutoff."""
-    now = datetime.datetime.now(event.tzinfo)
-    return now - cutoff < event
+def update_authorships(cursor: psql_cursor,
+                       sched: schedule.Schedule,
+                       budget: schedule.Budget,
+                       client: catalyst.Client,
+                       checkpoint_size: int = DEFAULT_CHECKPOINT_SIZE,
+                       resume: bool = False):
+    """
+    Searches for the publications of every person due for a refresh.
 
+    The authors are loaded with a single query that leaves out withheld and
+    unaffiliated people and, unless resuming, those not yet due. People with
+    confirmed publications are disambiguated by Catalyst. Those
+    requests run concurrently on `client` while PubMed is searched for
+    everyone else.
 
-def update_authorships(cursor: psql_cursor, authorships_limit: int = -1):
-    people = db.get_people(cursor)
-    affiliations = db.get_affiliations(cursor)
-    known = db.get_confirmed_publications(cursor)
-    authorships_updated = db.get_pubmed_authorships_updates(cursor)
+    Results are committed every `checkpoint_size` people. If the run is
+    interrupted (or runs out of budget), `resume` continues with the people
+    it had yet to search for.
+    """
+    conn = cursor.connection
+
+    pending = db.get_pubfetch_pending(cursor) if resume else None
+    if pending:
+        run_id, due = pending
+        log(f"Resuming pubfetch run #{run_id}: {len(due)} authors remain.")
+        authors = db.get_pubfetch_authors(cursor, sched.base, sched.maximum,
+                                          due)
+    else:
+        if resume:
+            log("No unfinished pubfetch run to resume. Starting a new one.")
+        authors = db.get_pubfetch_authors(cursor, sched.base, sched.maximum)
+        due = [author[0] for author in authors]
+        log(f"{len(due)} authors are due for a refresh.")
+        run_id = db.start_pubfetch_run(cursor, due)
+    conn.commit()
+
+    people = {author[0]: author for author in authors}
+    history: typing.Dict[int, schedule.History] = {
+        author[0]: (author[8], author[9]) for author in authors
+    }
 
     authorships: typing.Dict[int, typing.List[str]] = {}
+    unchanged: typing.Dict[int, int] = {}
+    done: typing.List[int] = []
+    submitted: typing.Dict[concurrent.futures.Future, int] = {}
+    incomplete = False
+
+    def checkpoint():
+        if authorships:
+            added, removed = db.update_authorships(cursor, authorships,
+                                                   unchanged)
+            log(f"Authorships added: {added}; removed: {removed}")
+        db.remove_pubfetch_pending(cursor, run_id, done)
+        conn.commit()
+        authorships.clear()
+        unchanged.clear()
+        done.clear()
+
+    def record(person_id: int, pmids: typing.List[str]):
+        authorships[person_id] = pmids
+        changed = set(pmids) != set(people[person_id][7])
+        unchanged[person_id] = \
+            schedule.unchanged_streak(history[person_id], changed)
+        done.append(person_id)
+        log(f"{person_id}: found {len(pmids)} publications.")
+        if len(done) >= checkpoint_size:
+            checkpoint()
 
-    for person_id, info in people.items():
-        if authorships_limit == 0:
-            log("Reached the limit of authorship searches for this run")
-            break
-
-        latest_update = authorships_updated.get(person_id, None)
-        if latest_update and too_recent(latest_update):
-            log(f"{person_id}: skipping author whose publications were "
-                "downloaded recently")
-            continue
-
-        person = classes.Person(person_id=str(person_id),
-                                first_name=info[0],
-                                last_name=info[1],
-                                display_name=info[2],
-                                email=info[3],
-                                phone=info[4],
-                                withheld=info[5],
-                                overview=info[6])
-        if person.withheld:
-            log(f"{person_id}: skipping withheld author")
+    for person_id in due:
+        if person_id not in people:
+            log(f"{person_id}: skipping withheld or unaffiliated author")
+            done.append(person_id)
             continue
 
-        if person_id not in affiliations:
-            log(f"{person_id}: skipping author without affiliations")
-            continue
+        (_, first_name, last_name, email, institutes,
+         include_pmids, exclude_pmids, *_) = people[person_id]
 
-        log(f"{person_id}: "
-            f"fetching PMIDs for {person.first_name} {person.last_name}.")
+        log(f"{person_id}: fetching PMIDs for {first_name} {last_name}.")
 
-        if person_id in known:
-            pmids = catalyst.fetch_ids(person,
-                                       list(affiliations[person_id]),
-                                       include_pmids=list(known[person_id][0]),
-                                       exclude_pmids=list(known[person_id][1]))
+        if include_pmids:
+            person = classes.Person(person_id=str(person_id),
+                                    first_name=first_name,
+                                    last_name=last_name,
+                                    email=email)
+            future = client.submit(person, institutes,
+                                   include_pmids=include_pmids,
+                                   exclude_pmids=exclude_pmids)
+            submitted[future] = person_id
         else:
-            pmids = get_pubmed_ids(person.first_name, person.last_name,
-                                   list(affiliations[person_id]))
-
-        authorships[person_id] = pmids
-
-        log(f"{person_id}: found {len(pmids)} publications.")
-
-        authorships_limit -= 1
-
-    if not authorships:
-        return
-
-    count = db.update_authorships(cursor, authorships)
-    log(f"Number of authorships updated: {count}")
+            # Catalyst needs PMIDs to include; drop the excluded ones here.
+            excluded = set(exclude_pmids)
+            try:
+                pmids = get_pubmed_ids(first_name, last_name, institutes,
+                                       budget)
+            except schedule.BudgetExhausted:
+                log("Reached the limit of authorship searches for this run")
+                incomplete = True
+                break
+            record(person_id, [pmid for pmid in pmids if pmid not in excluded])
+
+    for future in concurrent.futures.as_completed(submitted):
+        person_id = submitted[future]
+        try:
+            record(person_id, future.result())
+        except schedule.BudgetExhausted:
+            log(f"{person_id}: reached the limit of authorship searches.")
+            incomplete = True
+        except Exception:
+            traceback.print_exc()
+            log(f"{person_id}: Catalyst request failed; use --resume to "
+                "retry.")
+            incomplete = True
+
+    checkpoint()
+    if incomplete:
+        log(f"Pubfetch run #{run_id} is incomplete; use --resume to continue.")
+    else:
+        db.finish_pubfetch_run(cursor, run_id)
+        conn.commit()
 
 
 if __name__ == "__main__":
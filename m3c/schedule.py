@@ -0,0 +1,118 @@
+"""
+Adaptive refresh scheduling for PubMed data
+
+Every item that pubfetch refreshes (a person's authorships or a publication's
+XML summary) records when it was last checked and how many consecutive checks
+found nothing new. The item becomes due again after an interval that doubles
+with every unchanged check, up to a maximum:
+
+    interval = min(maximum, base * 2 ** unchanged)
+
+So a brand-new article or an active author is revisited after `base`, while a
+decades-old article or a person who never publishes settles at `maximum`.
+Any change resets the item to `base`.
+"""
+
+from typing import Hashable, List, Mapping, Optional, Tuple, TypeVar
+
+import datetime
+import threading
+
+
+BASE_INTERVAL = datetime.timedelta(days=15)
+MAX_INTERVAL = datetime.timedelta(days=360)
+
+K = TypeVar("K", bound=Hashable)
+
+# When an item was last checked (`None` if never) and its unchanged streak.
+History = Tuple[Optional[datetime.datetime], int]
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class Budget:
+    """
+    Number of requests pubfetch may still make during this run.
+
+    A negative limit means the budget is unlimited. Budgets may be spent from
+    several threads.
+    """
+
+    def __init__(self, limit: int = -1):
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining == 0
+
+    def spend(self, requests: int = 1) -> bool:
+        """Spends `requests` from the budget if it can afford them."""
+        with self._lock:
+            if self.remaining < 0:
+                return True
+            if self.remaining < requests:
+                self.remaining = 0
+                return False
+            self.remaining -= requests
+            return True
+
+    def charge(self, requests: int = 1) -> None:
+        """Spends `requests`, raising `BudgetExhausted` if it can't."""
+        if not self.spend(requests):
+            raise BudgetExhausted()
+
+
+class Schedule:
+    def __init__(self,
+                 base: datetime.timedelta = BASE_INTERVAL,
+                 maximum: datetime.timedelta = MAX_INTERVAL):
+        assert base > datetime.timedelta(0)
+        assert maximum >= base
+        self.base = base
+        self.maximum = maximum
+
+    def interval(self, unchanged: int) -> datetime.timedelta:
+        """Time to wait after a check that followed `unchanged` others."""
+        # Stop doubling once past the maximum to avoid enormous multipliers.
+        interval = self.base
+        for _ in range(max(unchanged, 0)):
+            if interval >= self.maximum:
+                break
+            interval *= 2
+        return min(interval, self.maximum)
+
+    def due(self, checked: datetime.datetime,
+            unchanged: int) -> datetime.datetime:
+        return checked + self.interval(unchanged)
+
+    def overdue(self, items: Mapping[K, History],
+                now: Optional[datetime.datetime] = None) -> List[K]:
+        """
+        Returns the keys of the items that are due, most overdue first.
+
+        Items that have never been checked come before everything else.
+        """
+        due: List[Tuple[datetime.timedelta, K]] = []
+        never: List[K] = []
+        for key, (checked, unchanged) in items.items():
+            if checked is None:
+                never.append(key)
+                continue
+            current = now or datetime.datetime.now(checked.tzinfo)
+            lateness = current - self.due(checked, unchanged)
+            if lateness >= datetime.timedelta(0):
+                due.append((lateness, key))
+
+        due.sort(key=lambda pair: pair[0], reverse=True)
+        return never + [key for _, key in due]
+
+
+def unchanged_streak(history: History, changed: bool) -> int:
+    """Returns the new unchanged streak after a check of an item."""
+    checked, unchanged = history
+    if changed or checked is None:
+        return 0
+    return unchanged + 1
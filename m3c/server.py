@@ -14,34 +14,118 @@ Example:
     $ m3c serve config.yaml
 """
 
-from typing import Any, Dict, List, Optional, Tuple
+from typing import (
+    Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+)
 
 from http import HTTPStatus
+import datetime
+import gzip
 import logging
-import operator
 import os
 import sys
 import traceback
 
 from flask import (
-    Blueprint, Flask, request, flash, redirect, render_template, send_file,
-    jsonify
+    Blueprint, Flask, Response, g, request, flash, redirect, render_template,
+    send_file, jsonify
 )
+from markupsafe import Markup
 import psycopg2
 import psycopg2.errorcodes
 import werkzeug.datastructures
+import werkzeug.exceptions
+import werkzeug.http
 
+from m3c import cache
 from m3c import classes
 from m3c import config
+from m3c import connections
 from m3c import db
 from m3c import mwb
+from m3c import photos
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Globals
 app = Blueprint('metab_admin', __name__)
 
-conn: Optional[db.Connection] = None
+pool: Optional[connections.Pool] = None
 picture_path = '.'
 file_storage_alias = 'b'
+photo_max_age = 24 * 60 * 60
+max_photo_size = photos.DEFAULT_MAX_SIZE
+photo_worker: Optional[photos.Worker] = None
+
+# Read models of the forms, invalidated when their tables are written to.
+views = cache.MemoryCache()
+listener: Optional[connections.Listener] = None
+
+# Results per page of the search APIs.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+PERSON_FIELDS = ('id', 'display_name', 'email', 'withheld')
+ORGANIZATION_FIELDS = ('id', 'name', 'type', 'parent_id', 'withheld')
+
+# Compression of responses: brotli (with the compression extra) or gzip, at
+# levels fast enough to compress the largest pages well within 100 ms.
+compress_responses = True
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = ('text/html', 'text/plain', 'application/json')
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def get_conn() -> db.Connection:
+    '''
+    Returns the connection of the current request, borrowing one from the
+    pool the first time it is needed. It is returned by `release_conn`.
+    '''
+    if 'conn' not in g:
+        g.conn = pool.getconn()
+    return g.conn
+
+
+@app.teardown_app_request
+def release_conn(exception: Optional[BaseException]):
+    '''Returns the request's connection, discarding uncommitted changes.'''
+    conn = g.pop('conn', None)
+    if conn is None:
+        return
+    try:
+        if not conn.closed:
+            conn.rollback()
+    finally:
+        pool.putconn(conn)
+
+
+@app.after_app_request
+def compress(response: Response) -> Response:
+    '''Compresses text responses for clients that accept brotli or gzip.'''
+    if (not compress_responses
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.status_code != HTTPStatus.OK
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 
 @app.route('/')
@@ -49,111 +133,346 @@ def main_menu():
     return render_template('index.html')
 
 
+def search_params(args: Mapping[str, str]) -> Tuple[str, int, int]:
+    '''Returns the search text, page size and cursor of an API request.'''
+    text = args.get('q', '')
+    limit = int(args.get('limit', API_PAGE_SIZE))
+    after = int(args.get('cursor', 0))
+    if limit <= 0 or after < 0:
+        raise ValueError('limit and cursor must be positive')
+    return text, min(limit, API_MAX_PAGE_SIZE), after
+
+
+def page(rows: List[Tuple], limit: int,
+         fields: Tuple[str, ...]) -> Dict[str, Any]:
+    '''
+    Returns the JSON of one page of rows fetched with a limit of `limit + 1`.
+    The extra row only tells whether there is a next page.
+    '''
+    results = [dict(zip(fields, row)) for row in rows[:limit]]
+    cursor = results[-1]['id'] if len(rows) > limit else None
+    return {'results': results, 'next': cursor}
+
+
+def cached_organizations() -> List[Tuple[int, str, str, Optional[int], bool]]:
+    '''Returns the (id, name, type, parent_id, withheld) of every org.'''
+    def load():
+        with get_conn().cursor() as cur:
+            return sorted(db.get_organizations(cur))
+    return views.get_or_load('organizations', ['organizations'], load)
+
+
+def cached_people() -> List[Tuple[int, str, str, bool]]:
+    '''Returns the (id, display_name, email, withheld) of everyone.'''
+    def load():
+        with get_conn().cursor() as cur:
+            cur.execute('SELECT id, display_name, email, withheld FROM people ORDER BY id')
+            return cur.fetchall()
+    return views.get_or_load('people', ['people'], load)
+
+
+def fragment(template: str, tables: List[str],
+             load: Callable[[], Dict[str, Any]]) -> Markup:
+    '''
+    Returns `template` rendered with the context returned by `load`. Lists of
+    every person or organization are rendered once and cached in `views`
+    until `tables` change, so their pages only render around them.
+    '''
+    def render():
+        return Markup(render_template(template, **load()))
+    return views.get_or_load(f'fragment:{template}', tables, render)
+
+
+def on_change(table: Optional[str]):
+    '''Invalidates the views of a table another process changed.'''
+    if table is None:
+        views.clear()
+    else:
+        views.invalidate(table)
+
+
+@app.route('/api/cachestats', methods=['GET'])
+def api_cache_stats():
+    '''Returns the hit, miss and eviction counts of the views' cache.'''
+    return jsonify(views.stats())
+
+
+@app.route('/api/people', methods=['GET'])
+def api_people():
+    '''
+    Returns a page of the people whose id is `q` or whose names contain it.
+    Pass the `next` of a response as `cursor` to get the following page.
+    '''
+    try:
+        text, limit, after = search_params(request.args)
+    except ValueError:
+        return jsonify(error='bad limit or cursor'), HTTPStatus.BAD_REQUEST
+
+    with get_conn().cursor() as cur:
+        rows = db.search_people(cur, text, limit + 1, after)
+    return jsonify(page(rows, limit, PERSON_FIELDS))
+
+
+@app.route('/api/organizations', methods=['GET'])
+def api_organizations():
+    '''
+    Returns a page of the organizations whose names contain `q`, optionally
+    only those of one `type`.
+    '''
+    type = request.args.get('type') or None
+    if type not in [None, mwb.INSTITUTE, mwb.DEPARTMENT, mwb.LABORATORY]:
+        return jsonify(error='bad type'), HTTPStatus.BAD_REQUEST
+    try:
+        text, limit, after = search_params(request.args)
+    except ValueError:
+        return jsonify(error='bad limit or cursor'), HTTPStatus.BAD_REQUEST
+
+    with get_conn().cursor() as cur:
+        rows = db.search_organizations(cur, text, limit + 1, after, type)
+    return jsonify(page(rows, limit, ORGANIZATION_FIELDS))
+
+
+def apply_each(cur, items: List[Any], apply: Callable[[Any, List], Iterable],
+               missing: str) -> List[Optional[str]]:
+    '''
+    Applies a change to all the items with one `apply(cur, items)` call and
+    returns each item's error, or None if it was changed. `apply` returns the
+    items it changed; the others get the `missing` error.
+
+    If the statement fails, the items are retried one at a time, each in its
+    own savepoint, so one bad item doesn't fail the others.
+    '''
+    errors: Dict[Any, str] = {}
+    cur.execute('SAVEPOINT apply_each')
+    try:
+        changed = set(apply(cur, items))
+    except psycopg2.Error:
+        cur.execute('ROLLBACK TO SAVEPOINT apply_each')
+        changed = set()
+        for item in items:
+            cur.execute('SAVEPOINT apply_item')
+            try:
+                changed.update(apply(cur, [item]))
+                cur.execute('RELEASE SAVEPOINT apply_item')
+            except psycopg2.Error as e:
+                cur.execute('ROLLBACK TO SAVEPOINT apply_item')
+                errors[item] = e.diag.message_primary or str(e)
+    cur.execute('RELEASE SAVEPOINT apply_each')
+
+    return [errors.get(item) or (None if item in changed else missing)
+            for item in items]
+
+
+def item_result(error: Optional[str], **item) -> Dict[str, Any]:
+    item['ok'] = error is None
+    if error:
+        item['error'] = error
+    return item
+
+
+def parse_id(value: Any) -> int:
+    '''Returns a JSON id, rejecting strings, floats and booleans.'''
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError(f'bad id: {value!r}')
+    return value
+
+
+def bulk_withhold(set_withheld: Callable[[Any, List[int], bool], List[int]],
+                  table: str):
+    '''
+    Sets `withheld` of the rows with the given `ids` in one transaction,
+    returning the result of each id.
+    '''
+    data = request.get_json(silent=True) or {}
+    try:
+        ids = data['ids']
+        assert isinstance(ids, list)
+        ids = list(dict.fromkeys(parse_id(id) for id in ids))
+        withheld = data['withheld']
+        assert isinstance(withheld, bool)
+    except (AssertionError, KeyError, TypeError, ValueError):
+        return (jsonify(error='ids and withheld (true or false) required'),
+                HTTPStatus.BAD_REQUEST)
+
+    conn = get_conn()
+    with conn.cursor() as cur:
+        errors = apply_each(
+            cur, ids, lambda cur, ids: set_withheld(cur, ids, withheld),
+            'not found')
+    conn.commit()
+    views.invalidate(table)
+    return jsonify(results=[item_result(error, id=id)
+                            for id, error in zip(ids, errors)])
+
+
+@app.route('/api/withheld/people', methods=['POST'])
+def api_withheld_people():
+    '''Withholds (`withheld: true`) or releases the people with `ids`.'''
+    return bulk_withhold(db.set_people_withheld, 'people')
+
+
+@app.route('/api/withheld/organizations', methods=['POST'])
+def api_withheld_organizations():
+    '''Withholds (`withheld: true`) or releases the orgs with `ids`.'''
+    return bulk_withhold(db.set_organizations_withheld, 'organizations')
+
+
+def parse_aliases(items: Iterable[Dict[str, Any]]) -> List[Tuple[int, str, str]]:
+    aliases = []
+    for item in items:
+        alias = (parse_id(item['id']), str(item['first']).strip(),
+                 str(item['last']).strip())
+        if alias[0] <= 0 or not alias[1] or not alias[2]:
+            raise ValueError(f'bad alias: {item}')
+        aliases.append(alias)
+    return list(dict.fromkeys(aliases))
+
+
+@app.route('/api/aliases', methods=['POST'])
+def api_aliases():
+    '''
+    Adds the `add` and deletes the `delete` aliases, each a list of
+    `{"id": person_id, "first": ..., "last": ...}`, in one transaction.
+    '''
+    data = request.get_json(silent=True) or {}
+    try:
+        added = parse_aliases(data.get('add', []))
+        deleted = parse_aliases(data.get('delete', []))
+    except (KeyError, TypeError, ValueError):
+        return (jsonify(error='aliases need an id, first and last name'),
+                HTTPStatus.BAD_REQUEST)
+
+    conn = get_conn()
+    with conn.cursor() as cur:
+        delete_errors = apply_each(cur, deleted, db.delete_names, 'not found')
+        add_errors = apply_each(cur, added, db.add_names, 'name in use')
+    conn.commit()
+
+    def results(aliases, errors):
+        return [item_result(error, id=id, first=first, last=last)
+                for (id, first, last), error in zip(aliases, errors)]
+
+    return jsonify(add=results(added, add_errors),
+                   delete=results(deleted, delete_errors))
+
+
 @app.route('/photo', methods=['GET'])
 def get_photo():
-    pid: int = int(request.args.get('id')) or 0
-    if not pid:
+    '''
+    Sends a person's photo, or its thumbnail with `size=thumb` if one was
+    generated. Browsers may reuse it for `photo_max_age` seconds and then
+    revalidate it with its ETag, which only changes when the file does. The
+    full photo sent until a thumbnail is generated is always revalidated.
+    '''
+    try:
+        pid = int(request.args.get('id', '0'))
+    except ValueError:
+        pid = 0
+    if pid <= 0:
         return 'id required', 400
 
+    found = find_photo(pid, request.args.get('size') == 'thumb')
+    if not found:
+        return '', 404
+
+    filename, mimetype, stat, max_age = found
+    etag, modified = photo_validators(stat)
+    if werkzeug.http.is_resource_modified(request.environ, etag=etag,
+                                          last_modified=modified):
+        response = send_file(filename, mimetype=mimetype)
+    else:
+        response = Response(status=HTTPStatus.NOT_MODIFIED)
+
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.cache_control.public = True
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def find_photo(person_id: int, thumbnail: bool = False) \
+        -> Optional[Tuple[str, str, os.stat_result, int]]:
+    '''
+    Returns the path, MIME type, stat and max-age of a person's photo or, if
+    asked for and generated, its thumbnail. The full photo stands in for a
+    missing thumbnail with a max-age of 0 so that the thumbnail replaces it
+    once it's generated.
+    '''
     for type in ('jpg', 'png'):
-        pic = classes.Photo(picture_path, pid, type, file_storage_alias)
-        filename = os.path.join(pic.path(), pic.filename())
-        if os.path.isfile(filename):
-            return send_file(filename, mimetype=pic.mimetype)
+        pic = classes.Photo(picture_path, person_id, type, file_storage_alias)
+        names = [(pic.filename(), 0 if thumbnail else photo_max_age)]
+        if thumbnail:
+            names.insert(0, (pic.thumbnail_filename(), photo_max_age))
+        for name, max_age in names:
+            filename = os.path.join(pic.path(), name)
+            try:
+                return filename, pic.mimetype, os.stat(filename), max_age
+            except OSError:
+                continue
+    return None
+
 
-    return '', 404
+def photo_validators(stat: os.stat_result) \
+        -> Tuple[str, datetime.datetime]:
+    '''Returns the ETag and Last-Modified of a photo, which change with it.'''
+    etag = f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+    modified = datetime.datetime.fromtimestamp(int(stat.st_mtime),
+                                               datetime.timezone.utc)
+    return etag, modified
 
 
 @app.route('/uploadimage', methods=['GET', 'POST'])
 def upload_image():
     if request.method == 'POST':
-        cur = conn.cursor()
         try:
             pic: werkzeug.datastructures.FileStorage = request.files['picture']
-            extension: str = pic.filename.split('.')[-1]
-            person_id: str = request.form['person_id']
-
-            person_id = person_id.strip()
-
-            photo = classes.Photo(picture_path, person_id, extension,
-                                  file_storage_alias)
-            dirname = photo.path()
-            os.makedirs(dirname, exist_ok=True)
+            person_id = int(request.form['person_id'].strip())
 
-            path = os.path.join(dirname, photo.filename())
-            pic.save(path)
+            photo = photos.save(pic.stream, picture_path, person_id,
+                                file_storage_alias, max_photo_size)
+            photo_worker.submit(photo)
 
             flash('Completed save sucessfully')
-            return redirect(request.url)
+        except photos.UploadError as e:
+            flash(f'Error uploading file: {e}')
+        except werkzeug.exceptions.RequestEntityTooLarge:
+            flash(f'Error uploading file: it is larger than {max_photo_size // 1024} KiB')
         except Exception:
             logging.exception('upload_image')
             flash('Error uploading file')
-            return redirect(request.url)
-
-    display_names = []
-    cur = conn.cursor()
-
-    cur.execute('SELECT display_name, id from people;')
-    rows = cur.fetchall()
-    for row in rows:
-        display_names.append(row[0] + ' | ' + str(row[1]))
+        return redirect(request.url)
 
-    return render_template('uploadimage.html', dispNameList=display_names)
+    return render_template('uploadimage.html')
 
 
 def associate_and_insert_orgs(cur, institute, department, lab, person_id):
     '''
     Takes in a cursor and creates the association between the id and the
     different organization types. Creates the organization with the right
-    parents if they don't already exist.
+    parents if they don't already exist. Returns the (institute, department,
+    lab) ids.
     '''
-    inst_id = None
-    if institute:
-        cur.execute('SELECT id from organizations WHERE name = %s and type = %s LIMIT 1', (institute, mwb.INSTITUTE))
-        rows = cur.fetchall()
-        if len(rows) == 0:
-            cur.execute('INSERT INTO organizations (name, type) VALUES (%s, %s) RETURNING id', (institute, mwb.INSTITUTE))
-            inst_id = cur.fetchone()[0]
-        else:
-            inst_id = rows[0][0]
-        cur.execute('INSERT INTO associations (organization_id, person_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (inst_id, person_id))
-
-    if department:
-        if inst_id is None:
-            flash('Please specify an existing or new Institution for this department')
-            raise Exception('Department missing Institution')
-        cur.execute('SELECT id FROM organizations WHERE name = %s and type = %s and parent_id = %s LIMIT 1', (department, mwb.DEPARTMENT, inst_id))
-        rows = cur.fetchall()
-        if len(rows) == 0:
-            cur.execute('INSERT INTO organizations (name, type, parent_id) VALUES (%s, %s, %s) RETURNING id', (department, mwb.DEPARTMENT, inst_id))
-            dept_id = cur.fetchone()[0]
-        else:
-            dept_id = rows[0][0]
-        cur.execute('INSERT INTO associations (organization_id, person_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (dept_id, person_id))
-
-    if lab:
-        if dept_id is None:
-            flash('Please specify an existing or new Department for this lab')
-            raise Exception('Lab missing Department')
-        cur.execute('SELECT id FROM organizations WHERE name = %s and type = %s and parent_id = %s LIMIT 1', (lab, mwb.LABORATORY, dept_id))
-        rows = cur.fetchall()
-        if len(rows) == 0:
-            cur.execute('INSERT INTO organizations (name, type, parent_id) VALUES (%s, %s, %s) RETURNING id', (lab, mwb.LABORATORY, dept_id))
-            lab_id = cur.fetchone()[0]
-        else:
-            lab_id = rows[0][0]
-        cur.execute('INSERT INTO associations (organization_id, person_id) VALUES (%s, %s) ON CONFLICT DO NOTHING', (lab_id, person_id))
+    if department and not institute:
+        flash('Please specify an existing or new Institution for this department')
+        raise Exception('Department missing Institution')
+    if lab and not department:
+        flash('Please specify an existing or new Department for this lab')
+        raise Exception('Lab missing Department')
+
+    return db.associate_organizations(cur, int(person_id), institute, department, lab)
 
 
 @app.route('/createperson', methods=['GET', 'POST'])
 def create_person():
-    cur = conn.cursor()
+    conn = get_conn()
     institutes = {}
     departments = {}
     labs = {}
 
-    cur.execute('SELECT id, name, type from organizations')
-    for row in cur.fetchall():
+    for row in cached_organizations():
         if row[2] == mwb.INSTITUTE:
             institutes[row[1]] = row[0]
         elif row[2] == mwb.DEPARTMENT:
@@ -164,7 +483,6 @@ def create_person():
             pass
             # what do we do
 
-    cur.close()
     if request.method == 'POST':
         cur = conn.cursor()
         try:
@@ -187,6 +505,7 @@ def create_person():
             associate_and_insert_orgs(cur, institute, department, lab, person_id)
 
             conn.commit()
+            views.invalidate('people', 'organizations')
             flash('Person created successfully')
         except psycopg2.IntegrityError as e:
             conn.rollback()
@@ -208,31 +527,7 @@ def create_person():
 
 @app.route('/associateperson', methods=['GET', 'POST'])
 def associate_person():
-    display_names = []
-    cur = conn.cursor()
-
-    cur.execute('SELECT display_name, email, id from people;')
-    rows = cur.fetchall()
-    for row in rows:
-        display_names.append(str(row[0]) + ' | ' + str(row[1]) + ' | ' + str(row[2]))
-
-    institutes = {}
-    departments = {}
-    labs = {}
-
-    cur.execute('SELECT id, name, type from organizations')
-    for row in cur.fetchall():
-        if row[2] == mwb.INSTITUTE:
-            institutes[row[1]] = row[0]
-        elif row[2] == mwb.DEPARTMENT:
-            departments[row[1]] = row[0]
-        elif row[2] == mwb.LABORATORY:
-            labs[row[1]] = row[0]
-        else:
-            pass
-            # what do we do
-
-    cur.close()
+    conn = get_conn()
     if request.method == 'POST':
         cur = conn.cursor()
         try:
@@ -252,6 +547,7 @@ def associate_person():
             associate_and_insert_orgs(cur, institute, department, lab, person_id)
 
             conn.commit()
+            views.invalidate('organizations')
             flash('Association created successfully')
         except Exception as e:
             print(e)
@@ -261,18 +557,12 @@ def associate_person():
             cur.close()
         return redirect(request.url)
 
-    return render_template('associateperson.html', dispNameList=display_names, instituteList=institutes.keys(), departmentList=departments.keys(), labList=labs.keys())
+    return render_template('associateperson.html')
 
 
 @app.route('/parentorganization', methods=['GET', 'POST'])
 def parent_organization():
-    cur = conn.cursor()
-
-    organizations = []
-
-    cur.execute('SELECT id, name, type, parent_id from organizations')
-    for row in cur.fetchall():
-        organizations.append('{} | {} | {} | {}'.format(row[1], row[2], row[0], row[3]))
+    conn = get_conn()
 
     if request.method == 'POST':
         cur = conn.cursor()
@@ -285,12 +575,13 @@ def parent_organization():
                 return redirect(request.url)
 
             if parent_id == 'None':
-                cur.execute('UPDATE organizations SET parent_id = NULL WHERE id = %s', (org_id))
+                cur.execute('UPDATE organizations SET parent_id = NULL WHERE id = %s', (org_id,))
             else:
                 cur.execute('UPDATE organizations SET parent_id = %s WHERE id = %s', (parent_id, org_id))
 
             conn.commit()
             cur.close()
+            views.invalidate('organizations')
             flash('Success! Changed Parent ID.')
             return redirect(request.url)
         except Exception as e:
@@ -300,177 +591,173 @@ def parent_organization():
             flash('Error setting parent')
             return redirect(request.url)
 
-    return render_template('parentorganization.html', orgList=organizations)
+    def load():
+        return {'orgList': ['{} | {} | {} | {}'.format(row[1], row[2], row[0], row[3])
+                            for row in cached_organizations()]}
+
+    options = fragment('organization_options.html', ['organizations'], load)
+    return render_template('parentorganization.html', options=options)
 
 
 @app.route('/withheldpeople', methods=['GET', 'POST'])
 def withheld_people():
-    people = []
-
-    with conn.cursor() as cur:
-        cur.execute('SELECT id, display_name, email, withheld from people ORDER BY id;')
-        rows = cur.fetchall()
-        for row in rows:
-            people.append((row[0], row[1], row[2], row[3]))
-
     if request.method == 'POST':
+        conn = get_conn()
         try:
             form_data = request.json
+            person_id = int(form_data['id'].strip())
+            withheld = bool(form_data['checked'])
             with conn.cursor() as cur:
-                cur.execute('UPDATE people SET withheld = %s WHERE id = %s;', (form_data['checked'], form_data['id'].strip()))
-                try:
-                    cur.execute('UPDATE names SET withheld = %s where person_id = %s;', (form_data['checked'], form_data['id'].strip()))
-                except Exception:
-                    conn.reset()
-                    return 'Error updating names withholding. Have you checked if theres a conflicting alias for unique constrait?', 500
+                [error] = apply_each(
+                    cur, [person_id],
+                    lambda cur, ids: db.set_people_withheld(cur, ids, withheld),
+                    'not found')
+            if error:
+                conn.rollback()
+                return 'Error updating names withholding. Have you checked if theres a conflicting alias for unique constrait?', 500
             conn.commit()
+            views.invalidate('people')
             return 'OK'
         except Exception as e:
             print(e)
             return 'ERROR', 500
 
-    return render_template('withheldpeople.html', people=people)
+    rows = fragment('withheldpeople_rows.html', ['people'],
+                    lambda: {'people': cached_people()})
+    return render_template('withheldpeople.html', rows=rows)
 
 
 @app.route('/withheldorgs', methods=['GET', 'POST'])
 def withheld_organizations():
-    orgs = []
-
-    with conn.cursor() as cur:
-        cur.execute('SELECT id, name, type, withheld, parent_id from organizations ORDER BY id;')
-        rows = cur.fetchall()
-        for row in rows:
-            orgs.append((row[0], row[1], row[2], row[3], row[4]))
-
     if request.method == 'POST':
+        conn = get_conn()
         try:
             form_data = request.json
+            org_id = int(form_data['id'].strip())
             with conn.cursor() as cur:
-                cur.execute('UPDATE organizations SET withheld = %s WHERE id = %s;', (form_data['checked'], form_data['id'].strip()))
+                db.set_organizations_withheld(cur, [org_id],
+                                              bool(form_data['checked']))
             conn.commit()
+            views.invalidate('organizations')
             return 'OK'
         except Exception as e:
             print(e)
             return 'ERROR', 500
 
-    return render_template('withheldorgs.html', orgs=orgs)
+    def load():
+        return {'orgs': [(id, name, type, withheld, parent_id)
+                         for id, name, type, parent_id, withheld in cached_organizations()]}
+
+    rows = fragment('withheldorgs_rows.html', ['organizations'], load)
+    return render_template('withheldorgs.html', rows=rows)
 
 
 @app.route('/personalias', methods=['GET', 'POST', 'DELETE'])
 def person_alias():
-    if request.method == 'POST':
-        data = request.json
-        with conn.cursor() as cur:
-            try:
-                cur.execute('INSERT INTO names (person_id, first_name, last_name) VALUES (%s, %s, %s)', (data['id'], data['first'], data['last']))
-            except Exception:
-                conn.reset()
+    conn = get_conn()
+    if request.method in ('POST', 'DELETE'):
+        adding = request.method == 'POST'
+        try:
+            item = dict(request.json)
+            item['id'] = int(str(item['id']))  # The form sends text.
+            aliases = parse_aliases([item])
+        except (KeyError, TypeError, ValueError):
+            aliases = []
+        if aliases:
+            with conn.cursor() as cur:
+                [error] = apply_each(
+                    cur, aliases, db.add_names if adding else db.delete_names,
+                    'name in use' if adding else 'not found')
+        if not aliases or error:
+            conn.rollback()
+            if adding:
                 return 'Error inserting new name', 400
+            return 'Error deleting new name', 400
         conn.commit()
-        return 'Added new alias for person'
-
-    if request.method == 'DELETE':
-        data = request.json
-        with conn.cursor() as cur:
-            try:
-                cur.execute('DELETE FROM names WHERE person_id = %s AND first_name = %s AND last_name = %s', (data['id'], data['first'], data['last']))
-            except Exception:
-                conn.reset()
-                return 'Error deleting new name', 400
-        conn.commit()
+        if adding:
+            return 'Added new alias for person'
         return 'Delete alias for person'
 
-    display_names = []
-    alias = {}
-    with conn.cursor() as cur:
-        cur.execute('SELECT id, display_name from people;')
-        rows = cur.fetchall()
-        for row in rows:
-            display_names.append(str(row[0]) + ' | ' + str(row[1]))
+    # GET ?person_id=DDD => JSON
+    try:
+        person_id = int(request.args.get('person_id', '0'))
+    except ValueError:
+        return jsonify(error='bad id'), HTTPStatus.BAD_REQUEST
 
-        cur.execute('SELECT person_id, first_name, last_name FROM names;')
-        rows = cur.fetchall()
-        for row in rows:
-            if not alias.get(row[0]):
-                alias[row[0]] = []
-            alias[row[0]].append({
-                'first': row[1],
-                'last': row[2]
-            })
+    if person_id > 0:
+        with conn.cursor() as cur:
+            names = db.get_person_names(cur, person_id)
+        return jsonify(aliases=[{'first': first, 'last': last}
+                                for first, last in names])
 
-    return render_template('personalias.html', dispNameList=display_names, aliasData=alias)
+    return render_template('personalias.html')
 
 
 @app.route('/addpmid', methods=['GET', 'POST'])
 def add_pmid():
-    display_names = {}
-    include_pubs = {}
-    exclude_pubs = {}
-    person_id = request.args.get('person', '')
-
-    cur = conn.cursor()
-
-    cur.execute('SELECT id, display_name FROM people')
-    rows = cur.fetchall()
-    for (pid, display_name) in rows:
-        display_names[pid] = display_name
-
-    cur.execute('SELECT pmid, person_id, include FROM publications')
-    rows = cur.fetchall()
-    for (pmid, person, include) in rows:
-        if include:
-            include_pubs[person] = include_pubs.get(person, []) + [pmid]
-        else:
-            exclude_pubs[person] = exclude_pubs.get(person, []) + [pmid]
+    conn = get_conn()
 
-    if request.method == 'GET':
-        cur.close()
-        template = render_template('addpmid.html',
-                                   display_names=display_names,
-                                   include_pubs=include_pubs,
-                                   exclude_pubs=exclude_pubs,
-                                   person_id=person_id)
-        return template
+    # GET ?person_id=DDD => JSON
+    if request.method == 'GET' and 'person_id' in request.args:
+        try:
+            person_id = int(request.args['person_id'])
+        except ValueError:
+            return jsonify(error='bad id'), HTTPStatus.BAD_REQUEST
+        with conn.cursor() as cur:
+            include, exclude = db.get_person_publications(cur, person_id)
+        return jsonify(include=include, exclude=exclude)
 
+    if request.method == 'GET':
+        person_id = request.args.get('person', '')
+        display_name = ''
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, display_name
+                  FROM people
+                 WHERE id IN (SELECT person_id
+                                FROM publications
+                               WHERE include)
+              ORDER BY display_name
+            """)
+            quick_picks = cur.fetchall()
+            if person_id.isdigit():
+                cur.execute('SELECT display_name FROM people WHERE id = %s',
+                            (int(person_id),))
+                row = cur.fetchone()
+                display_name = row[0] if row else ''
+
+        return render_template('addpmid.html',
+                               quick_picks=quick_picks,
+                               person_id=person_id,
+                               display_name=display_name)
+
+    person_id = ''
     try:
         person_id = request.form['id'].strip()
         display_name = request.form['name'].strip()
-        incl_pmid_string = request.form['inclpmid'].strip()
-        incl_pmid_list = incl_pmid_string.replace(' ', '').split(',')
-        excl_pmid_string = request.form['exclpmid'].strip()
-        excl_pmid_list = excl_pmid_string.replace(' ', '').split(',')
+        incl_pmid_list = request.form['inclpmid'].replace(' ', '').split(',')
+        excl_pmid_list = request.form['exclpmid'].replace(' ', '').split(',')
 
         if person_id == '':
             flash('Please search and select someone', 'error')
             return redirect(request.url)
 
-        cur.execute('DELETE FROM publications WHERE person_id = %s',
-                    (int(person_id),))
-
-        insert = """
-            INSERT INTO publications (pmid, person_id, include)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (pmid, person_id)
-            DO UPDATE SET include=%s
-        """
-        for pmid in incl_pmid_list:
-            cur.execute(insert, (pmid, int(person_id), True, 't'))
-        for pmid in excl_pmid_list:
-            cur.execute(insert, (pmid, int(person_id), False, 'f'))
-
+        with conn.cursor() as cur:
+            db.replace_publications(cur, int(person_id),
+                                    filter(None, incl_pmid_list),
+                                    filter(None, excl_pmid_list))
         conn.commit()
         flash(f'PMIDs updated successfully for {display_name}', 'success')
     except Exception:
         traceback.print_exc()
         conn.rollback()
         flash('Error updating PMIDs', 'error')
-    finally:
-        cur.close()
     return redirect(f"{request.base_url}?person={person_id}")
 
 
 @app.route('/personoverview', methods=['GET', 'POST'])
 def person_overview():
+    conn = get_conn()
     # POST json => json
     if request.method == 'POST':
         formdata: Optional[Dict[str, Any]] = request.json
@@ -522,25 +809,7 @@ def person_overview():
             )
 
     # GET => HTML
-    with conn.cursor() as cur:
-        people = db.get_people(cur)
-
-    ppl: List[Tuple[id, str, bool]] = []
-    for person_id, data in people.items():
-        first_name, last_name, display_name, email, phone, withheld, _ = data
-        ppl.append((person_id, f"{first_name} {last_name}".strip(), withheld))
-        ppl.append((person_id, display_name, withheld))
-    ppl = sorted(ppl, key=operator.itemgetter(0, 2, 1))
-
-    names: List[Tuple[id, str]] = []
-    for person_id, name, withheld in ppl:
-        name = f"{name} (#{person_id})"
-        if withheld:
-            name = f"{name} - WITHHELD"
-        if (person_id, name) not in names:
-            names.append((person_id, name))
-
-    return render_template('personoverview.html', names=names)
+    return render_template('personoverview.html')
 
 
 def main():
@@ -556,10 +825,21 @@ def main():
     serve(sys.argv[1])
 
 
-def serve(config_path: str):
-    global conn
+def create_app(config_path: str) -> Flask:
+    '''
+    Creates the admin server. Production WSGI servers can call it directly:
+
+        gunicorn --workers 4 'm3c.server:create_app("config.yaml")'
+    '''
+    global pool
+    global views
+    global listener
     global picture_path
     global file_storage_alias
+    global photo_max_age
+    global max_photo_size
+    global photo_worker
+    global compress_responses
 
     cfg = config.load(config_path)
     if not cfg:
@@ -567,19 +847,30 @@ def serve(config_path: str):
         sys.exit(-1)
 
     try:
-        conn = psycopg2.connect(
-            host=cfg.get("sup_host"),
-            dbname=cfg.get("sup_database"),
-            user=cfg.get("sup_username"),
-            password=cfg.get("sup_password"),
-            port=cfg.get("sup_port")
-        )
+        pool = connections.create_pool(cfg, connections.SUPPLEMENTAL,
+                                       'serve')
     except Exception:
         print('Cannot connect to the database')
         sys.exit(-1)
 
+    ttl = int(cfg.get('admin_cache_ttl', cache.DEFAULT_MEMORY_TTL.seconds))
+    views = cache.MemoryCache(
+        ttl=datetime.timedelta(seconds=ttl),
+        max_entries=int(cfg.get('admin_cache_size',
+                                cache.DEFAULT_MEMORY_MAX_ENTRIES)))
+    if cfg.get('admin_cache_listen', True):
+        params = connections.connection_params(
+            cfg, connections.SUPPLEMENTAL, 'serve listener')
+        listener = connections.Listener(connections.CHANGES_CHANNEL,
+                                        on_change, **params)
+        listener.start()
+
     picture_path = cfg.get('picturepath', picture_path)
     file_storage_alias = cfg.get('file_storage_alias', file_storage_alias)
+    photo_max_age = int(cfg.get('photo_max_age', photo_max_age))
+    max_photo_size = int(cfg.get('max_photo_size', max_photo_size))
+    photo_worker = photos.Worker()
+    compress_responses = bool(cfg.get('admin_compress', compress_responses))
     secret_key = cfg.get('secret', os.getenv('SECRET_KEY', ''))
     assert secret_key, (
         "You must set a secret key for sessions in Flask\n"
@@ -591,7 +882,14 @@ def serve(config_path: str):
     server = Flask(__name__, template_folder=template_folder)
     server.register_blueprint(app, url_prefix=url_prefix)
     server.secret_key = secret_key
-    server.run()
+    # Room for the upload form's other fields.
+    server.config['MAX_CONTENT_LENGTH'] = max_photo_size + 64 * 1024
+    return server
+
+
+def serve(config_path: str):
+    server = create_app(config_path)
+    server.run(threaded=True)
 
 
 if __name__ == "__main__":
@@ -30,11 +30,13 @@ The headers should be:
  - PaperLink
 """
 
-from typing import Iterable, Mapping, Optional
+from typing import Dict, Iterable, Mapping, Optional, Tuple
 
 import csv
 import io
 import json
+import os
+import sys
 
 import requests
 
@@ -77,18 +79,113 @@ class MetabolomicsToolsWiki:
         # Download the CSV.
         csvdata = MetabolomicsToolsWiki.download()
     ```
+
+    The spreadsheet is downloaded at most once per process, even if that
+    fails. If a `cache_path` is configured, a copy is kept on disk and only
+    downloaded again when the spreadsheet has changed (according to its ETag
+    or Last-Modified headers).
+    In `offline` mode, the copy at `cache_path` is used without downloading.
     """
 
     URL = "https://docs.google.com/spreadsheets/d/1bEO9_SYznC9rrtzJdHtpjdKL-AEPYkLANBgQDpx52tI"
+    TIMEOUT = 60
+
+    cache_path: str = ""
+    offline: bool = False
+    _csv: Optional[str] = None
+    _failed: bool = False
+
+    @staticmethod
+    def configure(cache_path: str = "", offline: bool = False) -> None:
+        assert cache_path or not offline, "offline mode requires a cache_path"
+        MetabolomicsToolsWiki.cache_path = cache_path
+        MetabolomicsToolsWiki.offline = offline
+        MetabolomicsToolsWiki._csv = None
+        MetabolomicsToolsWiki._failed = False
 
     @staticmethod
     def download() -> str:
-        url = f"{MetabolomicsToolsWiki.URL}/export?exportFormat=csv"
-        req = requests.get(url)
+        mtw = MetabolomicsToolsWiki
+        if mtw._csv is None and not mtw._failed:
+            csvdata = mtw._fetch()
+            if csvdata is None:
+                # Not tried again until the next `configure`.
+                mtw._failed = True
+                return ""
+            mtw._csv = csvdata
+        return mtw._csv or ""
+
+    @staticmethod
+    def _fetch() -> Optional[str]:
+        """Returns the CSV, or None if it is unavailable."""
+        mtw = MetabolomicsToolsWiki
+        cached, validators = mtw._read_cache()
+        if mtw.offline:
+            if not os.path.isfile(mtw.cache_path):
+                raise FileNotFoundError(
+                    "No snapshot of the Metabolomics Tools Wiki at "
+                    f"{mtw.cache_path!r} to use offline")
+            return cached
+
+        headers: Dict[str, str] = {}
+        if cached and "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if cached and "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+
+        url = f"{mtw.URL}/export?exportFormat=csv"
+        try:
+            req = requests.get(url, headers=headers, timeout=mtw.TIMEOUT)
+        except requests.RequestException as e:
+            return mtw._fallback(cached, repr(e))
+
+        if req.status_code == 304:
+            return cached
         if not req.ok:
-            return ""
+            return mtw._fallback(cached, f"HTTP {req.status_code}")
+
+        validators = {name: req.headers[name]
+                      for name in ("ETag", "Last-Modified")
+                      if name in req.headers}
+        mtw._write_cache(req.text, validators)
         return req.text
 
+    @staticmethod
+    def _fallback(cached: str, error: str) -> Optional[str]:
+        if os.path.isfile(MetabolomicsToolsWiki.cache_path):
+            print("Unable to download the Metabolomics Tools Wiki, using the "
+                  f"copy on disk: {error}", file=sys.stderr)
+            return cached
+        print("ERROR! Unable to download the Metabolomics Tools Wiki: "
+              f"{error}", file=sys.stderr)
+        return None
+
+    @staticmethod
+    def _read_cache() -> Tuple[str, Dict[str, str]]:
+        path = MetabolomicsToolsWiki.cache_path
+        if not path or not os.path.isfile(path):
+            return "", {}
+        with open(path, encoding="utf-8") as f:
+            csvdata = f.read()
+        validators = {}
+        if os.path.isfile(f"{path}.headers"):
+            with open(f"{path}.headers", encoding="utf-8") as f:
+                validators = json.load(f)
+        return csvdata, validators
+
+    @staticmethod
+    def _write_cache(csvdata: str, validators: Mapping[str, str]) -> None:
+        path = MetabolomicsToolsWiki.cache_path
+        if not path:
+            return
+        # Write then rename so a crash never leaves a truncated copy behind.
+        # The CSV goes first so its validators never describe an older copy.
+        for filename, content in ((path, csvdata),
+                                  (f"{path}.headers", json.dumps(validators))):
+            with open(f"{filename}.tmp", "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(f"{filename}.tmp", filename)
+
     @staticmethod
     def json(tools: Optional[Iterable[Mapping[str, str]]] = None) -> str:
         if not tools:
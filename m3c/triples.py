@@ -33,9 +33,8 @@ import sys
 import traceback
 import yaml
 
-import psycopg2
-
 from m3c import config
+from m3c import connections
 from m3c import db
 from m3c.classes import Dataset
 from m3c.classes import Organization
@@ -45,7 +44,6 @@ from m3c.classes import Project
 from m3c.classes import Publication
 from m3c.classes import Study
 from m3c.classes import Tool
-from m3c import prefill
 from m3c import tools
 
 
@@ -343,7 +341,7 @@ def get_projects(mwb_cur: db.Cursor,
         for i in range(0, len(last_name_list)):
             last_name = last_name_list[i]
             first_name = first_name_list[i]
-            ids = list(db.get_person(sup_cur, first_name, last_name))
+            ids = db.find_people(sup_cur, first_name, last_name)
             try:
                 person_id = ids[0]
                 project.pi.append(people[person_id].person_id)
@@ -532,7 +530,7 @@ def get_studies(mwb_cur: db.Cursor,
             last_name = last_name_list[i]
             first_name = first_name_list[i]
 
-            ids = list(db.get_person(sup_cur, first_name, last_name))
+            ids = db.find_people(sup_cur, first_name, last_name)
             try:
                 person_id = ids[0]
                 study.runner.append(people[person_id].person_id)
@@ -618,14 +616,11 @@ def make_datasets(namespace, datasets, studies):
 def get_authors_pmid(sup_cur: db.Cursor, pmid: str) -> List[Dict[str, str]]:
     try:
         authors = []
-        pubs = db.get_pubmed_publications(sup_cur, pmids=[pmid])
+        pubs = db.get_pubmed_authors(sup_cur, pmids=[pmid])
         if pmid not in pubs:
             print(f'PMID {pmid}: Could not find PubMed data')
             return []
-        author_list = prefill.parse_author_list(pubs[pmid])
-        for author in author_list:
-            forename = author.findtext('ForeName', '').strip()
-            surname = author.findtext('LastName', '').strip()
+        for forename, surname, _ in pubs[pmid]:
             auth = {
                 'name': f'{forename} {surname}'.strip()
             }
@@ -742,20 +737,19 @@ def generate(config_path: str, old_path: str):
 
     cfg = config.load(config_path)
 
+    tools.MetabolomicsToolsWiki.configure(
+        cache_path=cfg.get('mtw_cache_path', ''),
+        offline=bool(cfg.get('mtw_offline', False)))
+
     if not cfg.namespace.endswith('/'):
         print(f"WARNING! Namespace doesn't end with '/': {cfg.namespace}")
 
-    mwb_conn: psycopg2.extensions.connection = psycopg2.connect(
-        host=cfg.get('mwb_host'), dbname=cfg.get('mwb_database'),
-        user=cfg.get('mwb_username'), password=cfg.get('mwb_password'),
-        port=cfg.get('mwb_port'))
-
-    sup_conn: psycopg2.extensions.connection = psycopg2.connect(
-        host=cfg.get('sup_host'), dbname=cfg.get('sup_database'),
-        user=cfg.get('sup_username'), password=cfg.get('sup_password'),
-        port=cfg.get('sup_port'))
+    mwb_pool = connections.create_pool(cfg, connections.WORKBENCH, 'generate')
+    sup_pool = connections.create_pool(cfg, connections.SUPPLEMENTAL,
+                                       'generate')
 
-    with mwb_conn, sup_conn:
+    with mwb_pool.connection() as mwb_conn, \
+            sup_pool.connection() as sup_conn:
         with mwb_conn.cursor() as mwb_cur, sup_conn.cursor() as sup_cur:
             # Organizations
             orgs = get_organizations(sup_cur)
@@ -827,8 +821,8 @@ def generate(config_path: str, old_path: str):
                 with open(sub_file, 'w') as f:
                     f.writelines(sub)
 
-    sup_conn.close()
-    mwb_conn.close()
+    sup_pool.close()
+    mwb_pool.close()
 
 
 def main():
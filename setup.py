@@ -38,5 +38,14 @@ setuptools.setup(
         "biopython==1.76",
     ],
 
+    extras_require={
+        # Thumbnails of uploaded photos
+        "photos": ["Pillow==7.1.2"],
+        # ASGI build of the Admin Forms
+        "asgi": ["starlette==0.13.8", "uvicorn==0.11.8", "aiofiles==0.5.0"],
+        # Brotli compression of the Admin Forms' responses
+        "compression": ["Brotli==1.0.9"],
+    },
+
     python_requires=">=3.6.0",
 )
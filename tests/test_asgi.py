@@ -0,0 +1,176 @@
+import asyncio
+import contextlib
+import os
+import tempfile
+import threading
+import unittest
+
+from flask import Flask
+
+from m3c import asgi
+from m3c import classes
+from m3c import server
+
+try:
+    from starlette.testclient import TestClient
+except ImportError:
+    TestClient = None
+
+
+TEMPLATES = os.path.join(os.path.dirname(server.__file__), "templates")
+
+
+class TestDatabase(unittest.TestCase):
+    def test_runs_db_functions_off_the_event_loop(self):
+        pool = MockPool()
+        database = asgi.Database(pool)
+        loop_thread = []
+
+        def get_overview(cursor, person_id):
+            return (cursor, person_id, threading.current_thread())
+
+        async def main():
+            loop_thread.append(threading.current_thread())
+            return await asyncio.gather(
+                database.run(get_overview, 1),
+                database.run(get_overview, 2),
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(main())
+        finally:
+            loop.close()
+            database.close()
+
+        self.assertListEqual([r[1] for r in results], [1, 2])
+        self.assertTrue(all(r[0] == "cursor" for r in results))
+        self.assertNotIn(loop_thread[0], [r[2] for r in results])
+        self.assertEqual(pool.transactions, 2)
+
+
+@unittest.skipUnless(asgi.Starlette and TestClient, "requires the asgi extra")
+class TestApp(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved = (server.picture_path, asgi.db.search_people,
+                      asgi.db.search_organizations)
+        server.picture_path = self.tmpdir.name
+
+        flask_app = Flask(__name__, template_folder=TEMPLATES)
+        flask_app.register_blueprint(server.app, url_prefix="/admin")
+        self.database = MockDatabase()
+        app = asgi.build_app(flask_app, self.database, "/admin")
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        (server.picture_path, asgi.db.search_people,
+         asgi.db.search_organizations) = self.saved
+        self.tmpdir.cleanup()
+
+    def test_healthz(self):
+        response = self.client.get("/admin/healthz")
+        self.assertEqual(response.json(), {"status": "ok"})
+        self.assertListEqual(self.database.executed, [])
+
+        response = self.client.get("/admin/healthz?db=1")
+        self.assertEqual(response.json(), {"status": "ok"})
+        self.assertListEqual(self.database.executed, ["SELECT 1"])
+
+    def test_search_apis(self):
+        people = [(pid, f"Person {pid}", "", False) for pid in range(1, 4)]
+        asgi.db.search_people = \
+            lambda cursor, text, limit, after: people[after:after + limit]
+        response = self.client.get("/admin/api/people?q=person&limit=2")
+        page = response.json()
+        self.assertListEqual([r["id"] for r in page["results"]], [1, 2])
+        self.assertEqual(page["next"], 2)
+        self.assertEqual(
+            self.client.get("/admin/api/people?limit=x").status_code, 400)
+
+        searches = []
+
+        def search_organizations(cursor, text, limit, after, type):
+            searches.append((text, type))
+            return [(1, "UF", "institute", None, False)]
+
+        asgi.db.search_organizations = search_organizations
+        response = self.client.get(
+            "/admin/api/organizations?q=uf&type=institute")
+        self.assertEqual(response.json()["results"][0]["name"], "UF")
+        self.assertListEqual(searches, [("uf", "institute")])
+        self.assertEqual(self.client.get(
+            "/admin/api/organizations?type=company").status_code, 400)
+
+    def test_photo_revalidation(self):
+        photo = classes.Photo(self.tmpdir.name, 7, "png",
+                              server.file_storage_alias)
+        os.makedirs(photo.path())
+        with open(os.path.join(photo.path(), photo.filename()), "wb") as f:
+            f.write(b"full")
+
+        response = self.client.get("/admin/photo?id=7")
+        self.assertEqual(response.content, b"full")
+        self.assertEqual(response.headers["content-type"], "image/png")
+        self.assertEqual(response.headers["cache-control"],
+                         f"public, max-age={server.photo_max_age}")
+        etag = response.headers["etag"]
+
+        response = self.client.get("/admin/photo?id=7&size=thumb")
+        self.assertEqual(response.content, b"full")
+        self.assertEqual(response.headers["cache-control"],
+                         "public, no-cache")
+
+        response = self.client.get("/admin/photo?id=7",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        self.assertEqual(self.client.get("/admin/photo?id=8").status_code,
+                         404)
+        self.assertEqual(self.client.get("/admin/photo").status_code, 400)
+
+    def test_other_routes_fall_through_to_flask(self):
+        response = self.client.get("/admin/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("text/html", response.headers["content-type"])
+        self.assertIn(b"/admin/withheldpeople", response.content)
+        self.assertEqual(self.client.get("/healthz").status_code, 404)
+
+
+class MockDatabase:
+    def __init__(self):
+        self.executed = []
+
+    async def run(self, function, *args):
+        return function(MockCursor(self.executed), *args)
+
+    def close(self):
+        pass
+
+
+class MockCursor:
+    def __init__(self, executed):
+        self.execute = executed.append
+
+
+class MockPool:
+    size = 2
+
+    def __init__(self):
+        self.transactions = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        self.transactions += 1
+        yield MockConnection()
+
+
+class MockConnection:
+    @contextlib.contextmanager
+    def cursor(self):
+        yield "cursor"
+
+
+if __name__ == "__main__":
+    unittest.main()
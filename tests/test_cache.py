@@ -0,0 +1,155 @@
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+from m3c import cache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fingerprint_depends_on_namespace_and_request(self):
+        key = cache.ResponseCache.fingerprint("esearch", "Bond James")
+        self.assertEqual(key,
+                         cache.ResponseCache.fingerprint("esearch",
+                                                         b"Bond James"))
+        self.assertNotEqual(key,
+                            cache.ResponseCache.fingerprint("catalyst",
+                                                            "Bond James"))
+        self.assertNotEqual(key,
+                            cache.ResponseCache.fingerprint("esearch",
+                                                            "Bond Jimmy"))
+
+    def test_persists_between_instances(self):
+        c = cache.ResponseCache(self.path)
+        c.put("key", ["1", "2"])
+        c.close()
+
+        c = cache.ResponseCache(self.path)
+        self.assertListEqual(c.get("key"), ["1", "2"])
+        self.assertIsNone(c.get("other"))
+        self.assertEqual((c.hits, c.misses), (1, 1))
+        c.close()
+
+    def test_expired_entries_miss(self):
+        c = cache.ResponseCache(self.path,
+                                ttl=datetime.timedelta(seconds=-1))
+        c.put("key", ["1"])
+        self.assertIsNone(c.get("key"))
+        c.close()
+
+    def test_refresh_ignores_cached_responses(self):
+        c = cache.ResponseCache(self.path)
+        c.put("key", ["1"])
+        c.close()
+
+        c = cache.ResponseCache(self.path, refresh=True)
+        self.assertIsNone(c.get("key"))
+        c.put("key", ["2"])
+        c.close()
+
+        c = cache.ResponseCache(self.path)
+        self.assertListEqual(c.get("key"), ["2"])
+        c.close()
+
+    def test_evicts_least_recently_used(self):
+        c = cache.ResponseCache(self.path, max_entries=2, evict_every=1)
+        c.put("a", ["1"])
+        time.sleep(0.01)
+        c.put("b", ["2"])
+        time.sleep(0.01)
+        c.get("a")
+        time.sleep(0.01)
+        c.put("c", ["3"])
+        self.assertListEqual(c.get("a"), ["1"])
+        self.assertIsNone(c.get("b"))
+        self.assertListEqual(c.get("c"), ["3"])
+        c.close()
+
+    def test_evicts_in_batches_and_on_close(self):
+        c = cache.ResponseCache(self.path, max_entries=1, evict_every=3)
+        for key in "abcd":
+            c.put(key, [key])
+            time.sleep(0.01)
+        self.assertIsNone(c.get("b"))  # Evicted by the third put.
+        self.assertListEqual(c.get("d"), ["d"])
+        c.close()
+
+        c = cache.ResponseCache(self.path)
+        self.assertIsNone(c.get("c"))
+        self.assertListEqual(c.get("d"), ["d"])
+        c.close()
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_loads_once_until_invalidated(self):
+        c = cache.MemoryCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            return ["org"]
+
+        self.assertListEqual(c.get_or_load("orgs", ["organizations"], load),
+                             ["org"])
+        c.get_or_load("orgs", ["organizations"], load)
+        self.assertEqual(len(loads), 1)
+
+        self.assertEqual(c.invalidate("people"), 0)
+        self.assertEqual(c.invalidate("people", "organizations"), 1)
+        c.get_or_load("orgs", ["organizations"], load)
+        self.assertEqual(len(loads), 2)
+        self.assertDictEqual(c.stats(), {
+            "entries": 1, "hits": 1, "misses": 2, "evictions": 0,
+            "invalidations": 1,
+        })
+
+    def test_expired_entries_miss(self):
+        c = cache.MemoryCache(ttl=datetime.timedelta(seconds=-1))
+        c.put("key", 1, ["people"])
+        self.assertIsNone(c.get("key"))
+
+    def test_evicts_least_recently_used(self):
+        c = cache.MemoryCache(max_entries=2)
+        c.put("a", 1, ["people"])
+        c.put("b", 2, ["people"])
+        c.get("a")
+        c.put("c", 3, ["people"])
+        self.assertEqual(c.get("a"), 1)
+        self.assertIsNone(c.get("b"))
+        self.assertEqual(c.stats()["evictions"], 1)
+
+    def test_invalidating_during_a_load_discards_its_value(self):
+        c = cache.MemoryCache()
+        rows = ["old"]
+
+        def load():
+            value = list(rows)
+            rows[:] = ["new"]
+            c.invalidate("people")  # A write committed mid-load.
+            return value
+
+        self.assertListEqual(c.get_or_load("people", ["people"], load),
+                             ["old"])
+        self.assertIsNone(c.get("people"))
+        self.assertListEqual(
+            c.get_or_load("people", ["people"], lambda: list(rows)), ["new"])
+        self.assertListEqual(c.get("people"), ["new"])
+
+        def load_and_clear():
+            c.clear()
+            return ["stale"]
+
+        c.get_or_load("orgs", ["organizations"], load_and_clear)
+        self.assertIsNone(c.get("orgs"))
+
+
+if __name__ == "__main__":
+    unittest.main()
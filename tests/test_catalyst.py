@@ -1,7 +1,14 @@
+import concurrent.futures
+import http.server
+import os
+import tempfile
+import threading
 import unittest
 import xml.etree.ElementTree as ET
 
+from m3c import cache
 from m3c import catalyst
+from m3c import schedule
 from m3c.classes import Person
 
 
@@ -28,6 +35,9 @@ class TestCatalyst(unittest.TestCase):
         pmids = catalyst.parse_catalyst_pmids(pmidlist)
         self.assertListEqual(pmids, [])
 
+    def test_parse_pmids_malformed(self):
+        self.assertIsNone(catalyst.parse_catalyst_pmids("<PMIDList><PMID>"))
+
     def test_build_catalyst_xml_none_affiliations(self):
         with self.assertRaises(AssertionError):
             catalyst.build_catalyst_xml(
@@ -96,3 +106,131 @@ class TestCatalyst(unittest.TestCase):
             ['11707567'],
             ['19648504'])
         self.assertEqual(xml, actual_xml)
+
+
+class TestCatalystClient(unittest.TestCase):
+    """Exercises `catalyst.Client` against a local stub of GetPMIDs."""
+
+    def setUp(self):
+        StubCatalyst.requests = []
+        StubCatalyst.failures = 0
+        StubCatalyst.malformed = 0
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                      StubCatalyst)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        host, port = self.server.server_address
+        self.client = catalyst.Client(endpoint=f"http://{host}:{port}/",
+                                      workers=4, timeout=5, retries=2,
+                                      backoff=0)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def test_fetch_ids(self):
+        person = Person('1', 'Griffin', 'Weber', 'Griffin Weber', 'e', 'p')
+        pmids = self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+        self.assertListEqual(pmids, ['1', '1001'])
+        self.assertEqual(len(StubCatalyst.requests), 1)
+
+    def test_retries_transient_errors(self):
+        StubCatalyst.failures = 2
+        person = Person('1', 'Griffin', 'Weber', 'Griffin Weber', 'e', 'p')
+        pmids = self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+        self.assertListEqual(pmids, ['1', '1001'])
+        self.assertEqual(len(StubCatalyst.requests), 3)
+
+    def test_gives_up_after_retries(self):
+        StubCatalyst.failures = 10
+        person = Person('1', 'Griffin', 'Weber', 'Griffin Weber', 'e', 'p')
+        with self.assertRaises(catalyst.CatalystError):
+            self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+        self.assertEqual(len(StubCatalyst.requests), 3)
+
+    def test_cached_responses_skip_the_network(self):
+        person = Person('1', 'Griffin', 'Weber', 'Griffin Weber', 'e', 'p')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.client.cache = cache.ResponseCache(
+                os.path.join(tmpdir, 'cache.sqlite'))
+            self.client.budget = schedule.Budget(1)
+            first = self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+            second = self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+            with self.assertRaises(schedule.BudgetExhausted):
+                self.client.fetch_ids(person, ['Harvard'], ['2'], [])
+            self.client.cache.close()
+        self.assertListEqual(first, second)
+        self.assertEqual(len(StubCatalyst.requests), 1)
+
+    def test_unparseable_responses_are_not_cached(self):
+        StubCatalyst.malformed = 1
+        person = Person('1', 'Griffin', 'Weber', 'Griffin Weber', 'e', 'p')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.client.cache = cache.ResponseCache(
+                os.path.join(tmpdir, 'cache.sqlite'))
+            with self.assertRaises(catalyst.CatalystError):
+                self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+            pmids = self.client.fetch_ids(person, ['Harvard'], ['1'], [])
+            self.client.cache.close()
+        self.assertListEqual(pmids, ['1', '1001'])
+        self.assertEqual(len(StubCatalyst.requests), 2)
+
+    def test_submit_collects_results_as_completed(self):
+        futures = {}
+        for i in range(1, 11):
+            person = Person(str(i), 'First', f'Last{i}', '', '', '')
+            future = self.client.submit(person, ['UF'], [str(i)], [])
+            futures[future] = str(i)
+
+        results = {}
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+
+        expected = {str(i): [str(i), str(i + 1000)] for i in range(1, 11)}
+        self.assertDictEqual(results, expected)
+
+
+class StubCatalyst(http.server.BaseHTTPRequestHandler):
+    """
+    Answers with the include PMIDs plus each one offset by 1000.
+
+    Responds with 503 to the first `failures` requests, and then with
+    truncated XML to the next `malformed` ones.
+    """
+
+    requests = []
+    failures = 0
+    malformed = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        payload = ET.fromstring(self.rfile.read(length))
+        with StubCatalyst.lock:
+            StubCatalyst.requests.append(payload)
+            fail = StubCatalyst.failures > 0
+            StubCatalyst.failures -= 1
+            truncate = not fail and StubCatalyst.malformed > 0
+            if truncate:
+                StubCatalyst.malformed -= 1
+
+        if fail:
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        pmids = [pmid.text for pmid in payload.find('PMIDAddList')]
+        pmids += [str(int(pmid) + 1000) for pmid in pmids]
+        body = '<PMIDList>{}</PMIDList>'.format(
+            ''.join(f'<PMID>{pmid}</PMID>' for pmid in pmids))
+        if truncate:
+            body = body[:len(body) // 2]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,94 @@
+import threading
+import unittest
+
+import psycopg2
+import psycopg2.extensions
+
+from m3c import config
+from m3c import connections
+
+
+CONFIG = {
+    "sup_host": "localhost",
+    "sup_port": "5432",
+    "sup_database": "supplemental",
+    "sup_username": "m3c",
+    "sup_password": "secret",
+    "db_statement_timeout": 30000,
+    "db_pool_sizes": {"prefill": 3},
+}
+
+
+class TestConnections(unittest.TestCase):
+    def setUp(self):
+        self.connect = psycopg2.connect
+        psycopg2.connect = MockConnection
+        MockConnection.opened = 0
+
+    def tearDown(self):
+        psycopg2.connect = self.connect
+
+    def test_connection_params(self):
+        cfg = config.Config("", "", "", "", CONFIG)
+        params = connections.connection_params(
+            cfg, connections.SUPPLEMENTAL, "pubfetch")
+        self.assertEqual(params["dbname"], "supplemental")
+        self.assertEqual(params["user"], "m3c")
+        self.assertEqual(params["keepalives"], 1)
+        self.assertEqual(params["options"], "-c statement_timeout=30000")
+        self.assertEqual(params["application_name"], "m3c pubfetch")
+
+    def test_pool_sizes(self):
+        cfg = config.Config("", "", "", "", CONFIG)
+        pool = connections.create_pool(cfg, connections.SUPPLEMENTAL,
+                                       "prefill")
+        self.assertEqual(pool.size, 3)
+        pool = connections.create_pool(cfg, connections.SUPPLEMENTAL,
+                                       "serve")
+        self.assertEqual(pool.size, connections.DEFAULT_POOL_SIZES["serve"])
+
+    def test_connections_are_reused(self):
+        pool = connections.Pool(1)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(MockConnection.opened, 1)
+        self.assertEqual(first.commits, 2)
+
+    def test_borrowing_waits_for_a_connection(self):
+        pool = connections.Pool(1)
+        conn = pool.getconn()
+        borrowed = threading.Event()
+
+        def borrow():
+            pool.putconn(pool.getconn())
+            borrowed.set()
+
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        self.assertFalse(borrowed.wait(0.1))
+        pool.putconn(conn)
+        self.assertTrue(borrowed.wait(1))
+        thread.join()
+
+
+class MockConnection:
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        MockConnection.opened += 1
+        self.closed = 0
+        self.commits = 0
+        self.info = self
+        self.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.commits += 1
+
+    def close(self):
+        self.closed = 1
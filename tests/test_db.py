@@ -1,7 +1,21 @@
+import os
 import sqlite3
+import threading
 import unittest
+import xml.etree.ElementTree as ET
+
+import psycopg2
 
 from m3c import db
+from m3c import migrate
+from m3c import mwb
+
+
+# A scratch PostgreSQL database for the tests that need one. Its tables are
+# truncated.
+TEST_DSN = os.getenv("M3C_TEST_DSN")
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                      "mwb_supplemental.pgsql")
 
 
 class TestDb(unittest.TestCase):
@@ -26,6 +40,222 @@ class TestDb(unittest.TestCase):
         expected = [7]
         self.assertListEqual(expected, actual)
 
+    def test_contains_pattern_escapes_wildcards(self):
+        self.assertEqual(db.contains_pattern("Ann"), "%ann%")
+        self.assertEqual(db.contains_pattern("100%_x"), "%100\\%\\_x%")
+
+
+class TestParseAuthors(unittest.TestCase):
+    def test_authors_in_order(self):
+        article = ET.fromstring("""
+            <PubmedArticle><MedlineCitation><Article><AuthorList>
+              <Author>
+                <LastName>Bond</LastName><ForeName> James </ForeName>
+                <AffiliationInfo>
+                  <Affiliation>University of Florida</Affiliation>
+                </AffiliationInfo>
+                <AffiliationInfo>
+                  <Affiliation> </Affiliation>
+                </AffiliationInfo>
+              </Author>
+              <Author><CollectiveName>M3C Consortium</CollectiveName></Author>
+            </AuthorList></Article></MedlineCitation></PubmedArticle>
+        """)
+        self.assertListEqual(db.parse_pubmed_authors(article), [
+            ("James", "Bond", ["University of Florida"]),
+            ("", "", []),
+        ])
+
+
+class TestPreparedStatement(unittest.TestCase):
+    def test_placeholders_are_numbered(self):
+        statement = db.PreparedStatement(
+            "m3c_test", "SELECT id FROM people WHERE email=%s AND phone=%s")
+        self.assertEqual(
+            statement.prepare,
+            "PREPARE m3c_test AS "
+            "SELECT id FROM people WHERE email=$1 AND phone=$2")
+        self.assertEqual(statement.execute_sql, "EXECUTE m3c_test (%s, %s)")
+        self.assertEqual(statement.arity, 2)
+
+    def test_other_cursors_run_sql_directly(self):
+        cursor = RecordingCursor()
+        db.execute_prepared(cursor, "test_direct",
+                            "SELECT 1 WHERE 2=%s", (2,))
+        self.assertListEqual(cursor.executed,
+                             [("SELECT 1 WHERE 2=%s", (2,))])
+
+    def test_statement_names_are_unique(self):
+        cursor = RecordingCursor()
+        db.execute_prepared(cursor, "test_unique", "SELECT 1")
+        with self.assertRaises(AssertionError):
+            db.execute_prepared(cursor, "test_unique", "SELECT 2")
+
+
+@unittest.skipUnless(TEST_DSN, "set M3C_TEST_DSN to a scratch database")
+class TestAssociateOrganizations(unittest.TestCase):
+    def setUp(self):
+        self.conn = psycopg2.connect(TEST_DSN)
+        with self.conn.cursor() as cursor:
+            with open(SCHEMA) as f:
+                cursor.execute(f.read())
+            migrations = {version: step
+                          for version, _, step in migrate.MIGRATIONS}
+            cursor.execute("TRUNCATE people, organizations CASCADE")
+            migrations[6](cursor)
+            cursor.execute("""
+                INSERT INTO people (display_name, email, phone)
+                     VALUES ('James Bond', '', '')
+                  RETURNING id
+            """)
+            self.person_id = cursor.fetchone()[0]
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def count(self, table):
+        with self.conn.cursor() as cursor:
+            cursor.execute(f"SELECT count(*) FROM {table}")
+            return cursor.fetchone()[0]
+
+    def test_existing_organizations_are_reused(self):
+        with self.conn.cursor() as cursor:
+            uf, chemistry, lab = db.associate_organizations(
+                cursor, self.person_id, "UF", "Chemistry", "Smith Lab")
+            self.assertEqual(db.associate_organizations(
+                cursor, self.person_id, "UF", "Chemistry"),
+                (uf, chemistry, None))
+            _, physics, _ = db.associate_organizations(
+                cursor, self.person_id, "UF", "Physics", "Smith Lab")
+        self.conn.commit()
+
+        self.assertEqual(len({uf, chemistry, lab, physics}), 4)
+        self.assertEqual(self.count("organizations"), 5)
+        self.assertEqual(self.count("associations"), 5)
+
+    def test_associating_again_writes_nothing(self):
+        with self.conn.cursor() as cursor:
+            db.associate_organizations(cursor, self.person_id, "UF",
+                                       "Chemistry", "Smith Lab")
+        self.conn.commit()
+
+        with self.conn.cursor() as cursor:
+            db.associate_organizations(cursor, self.person_id, "UF",
+                                       "Chemistry", "Smith Lab")
+            db.associate_organizations(cursor, self.person_id, "UF")
+            cursor.execute("SELECT pg_current_xact_id_if_assigned()")
+            self.assertIsNone(cursor.fetchone()[0])
+        self.conn.commit()
+
+    def test_concurrent_submissions_create_each_organization_once(self):
+        submissions = 8
+        ready = threading.Barrier(submissions, timeout=10)
+        results = []
+        errors = []
+
+        def submit():
+            conn = psycopg2.connect(TEST_DSN)
+            try:
+                with conn.cursor() as cursor:
+                    ready.wait()
+                    results.append(db.associate_organizations(
+                        cursor, self.person_id, "UF", "Chemistry",
+                        "Smith Lab"))
+                conn.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=submit)
+                   for _ in range(submissions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertListEqual(errors, [])
+        self.assertEqual(len(results), submissions)
+        self.assertEqual(len(set(results)), 1)
+        self.assertNotIn(None, results[0])
+        self.assertEqual(self.count("organizations"), 3)
+        self.assertEqual(self.count("associations"), 3)
+
+    def test_migration_merges_duplicate_institutes(self):
+        with self.conn.cursor() as cursor:
+            cursor.execute("DROP INDEX organizations_root_name_type_idx")
+            cursor.execute("""
+                INSERT INTO people (display_name, email, phone)
+                     VALUES ('Jane Doe', '', '')
+                  RETURNING id
+            """)
+            other_id = cursor.fetchone()[0]
+            uf = db.add_organization(cursor, mwb.INSTITUTE, "UF")
+            uf2 = db.add_organization(cursor, mwb.INSTITUTE, "UF")
+            fsu = db.add_organization(cursor, mwb.INSTITUTE, "FSU")
+            # Added to the copy first, so the copy's department is kept.
+            biology = db.add_organization(cursor, mwb.DEPARTMENT, "Biology",
+                                          uf2)
+            db.add_organization(cursor, mwb.DEPARTMENT, "Biology", uf)
+            chemistry = db.add_organization(cursor, mwb.DEPARTMENT,
+                                            "Chemistry", uf)
+            chemistry2 = db.add_organization(cursor, mwb.DEPARTMENT,
+                                             "Chemistry", uf2)
+            physics = db.add_organization(cursor, mwb.DEPARTMENT, "Physics",
+                                          uf2)
+            lab = db.add_organization(cursor, mwb.LABORATORY, "Smith Lab",
+                                      chemistry2)
+            for person_id, organization_id in [
+                    (self.person_id, uf), (self.person_id, uf2),
+                    (other_id, uf2), (other_id, chemistry2),
+                    (other_id, lab)]:
+                db.associate(cursor, person_id, organization_id)
+
+            migrate.make_institutes_unique(cursor)
+
+            cursor.execute("SELECT id, parent_id FROM organizations")
+            self.assertDictEqual(dict(cursor.fetchall()), {
+                uf: None, fsu: None, biology: uf, chemistry: uf,
+                physics: uf, lab: chemistry})
+            cursor.execute("SELECT person_id, organization_id "
+                           "FROM associations")
+            self.assertSetEqual(set(cursor.fetchall()), {
+                (self.person_id, uf), (other_id, uf), (other_id, chemistry),
+                (other_id, lab)})
+        self.conn.rollback()
+
+
+@unittest.skipUnless(TEST_DSN, "set M3C_TEST_DSN to a scratch database")
+class TestFindPeople(unittest.TestCase):
+    def setUp(self):
+        self.conn = psycopg2.connect(TEST_DSN)
+        with self.conn.cursor() as cursor:
+            with open(SCHEMA) as f:
+                cursor.execute(f.read())
+            cursor.execute("TRUNCATE people, names CASCADE")
+            self.mary = db.add_person(cursor, "Mary", "Ann Smith", "", "")
+            self.john = db.add_person(cursor, "John", "Smith", "", "")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_whole_names_are_compared(self):
+        with self.conn.cursor() as cursor:
+            self.assertListEqual(
+                db.find_people(cursor, " mary ann", "SMITH "), [self.mary])
+            self.assertListEqual(
+                db.find_people(cursor, "John", "Smith"), [self.john])
+            self.assertListEqual(db.find_people(cursor, "Mary", "Smith"), [])
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=()):
+        self.executed.append((sql, params))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,72 @@
+import typing
+import unittest
+
+from m3c import migrate
+
+
+List = typing.List
+
+
+MIGRATIONS = [
+    (1, "First", "CREATE INDEX one ON names (person_id)"),
+    (2, "Second", "CREATE INDEX two ON names (last_name)"),
+]
+
+
+class TestMigrate(unittest.TestCase):
+    def test_applies_new_migrations_in_order(self):
+        cursor = MockCursor(version=None)
+        applied = migrate.apply_migrations(cursor, list(reversed(MIGRATIONS)))
+        self.assertListEqual(applied, [1, 2])
+        self.assertListEqual(cursor.ddl, [
+            "CREATE INDEX one ON names (person_id)",
+            "CREATE INDEX two ON names (last_name)",
+        ])
+        self.assertListEqual(cursor.recorded, [(1, "First"), (2, "Second")])
+
+    def test_skips_applied_migrations(self):
+        cursor = MockCursor(version=1)
+        self.assertListEqual(migrate.apply_migrations(cursor, MIGRATIONS), [2])
+        cursor = MockCursor(version=2)
+        self.assertListEqual(migrate.apply_migrations(cursor, MIGRATIONS), [])
+
+    def test_functions_are_called_with_the_cursor(self):
+        called = []
+        cursor = MockCursor(version=2)
+        migrations = MIGRATIONS + [(3, "Third", called.append)]
+        self.assertListEqual(migrate.apply_migrations(cursor, migrations),
+                             [3])
+        self.assertListEqual(called, [cursor])
+
+    def test_uses_index(self):
+        index_scan = (
+            "Index Scan using names_normalized_idx on names"
+            "  (cost=0.15..8.17 rows=1 width=4)")
+        bitmap_scan = (
+            "Bitmap Heap Scan on pubmed_authorships  (cost=4.2..14.8)\n"
+            "  ->  Bitmap Index Scan on pubmed_authorships_person_id_idx")
+        seq_scan = "Seq Scan on names  (cost=0.00..1.01 rows=1 width=4)"
+        self.assertTrue(migrate.uses_index(index_scan, "names"))
+        self.assertTrue(migrate.uses_index(bitmap_scan, "pubmed_authorships"))
+        self.assertFalse(migrate.uses_index(seq_scan, "names"))
+        self.assertFalse(migrate.uses_index(index_scan, "organizations"))
+
+
+class MockCursor:
+    def __init__(self, version):
+        self.version = version
+        self.ddl: List[str] = []
+        self.recorded: List[tuple] = []
+
+    def execute(self, sql, params=None):
+        if sql.startswith("CREATE INDEX"):
+            self.ddl.append(sql)
+        elif "INSERT INTO schema_migrations" in sql:
+            self.recorded.append(params)
+
+    def fetchone(self):
+        return (self.version,)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import threading
+import unittest
+
+from m3c import mwb
+
+
+PROJECT = ("PR000001", mwb.PROJECT, "Ada", "Lovelace", "UF", "", "", "", "")
+STUDY = ("ST000001", mwb.STUDY, "Ada", "Lovelace", "UF", "", "", "", "")
+
+
+class TestClient(unittest.TestCase):
+    def test_fetch_names_drops_duplicates(self):
+        client = MockClient({"names": [PROJECT, STUDY, STUDY]})
+        psids = [rec.psid for rec in client.fetch_names()]
+        self.assertListEqual(psids, ["PR000001", "ST000001"])
+
+    def test_fetch_names_concurrently(self):
+        client = MockClient({
+            "names_0": [PROJECT] * 3,
+            "names_1": [STUDY, STUDY],
+        }, concurrent=True)
+        psids = sorted(rec.psid for rec in client.fetch_names())
+        self.assertListEqual(psids, ["PR000001", "ST000001"])
+        self.assertEqual(client.pool.borrowed, 2)
+        self.assertEqual(client.pool.returned, 2)
+
+    def test_fetch_names_concurrently_reraises_errors(self):
+        client = MockClient({"names_0": [PROJECT]}, concurrent=True)
+        with self.assertRaises(KeyError):
+            list(client.fetch_names())
+        self.assertEqual(client.pool.returned, 2)
+
+
+class MockClient(mwb.Client):
+    """Streams canned rows keyed by cursor name instead of querying."""
+
+    def __init__(self, results, concurrent=False):
+        super().__init__(MockPool(), itersize=1, concurrent=concurrent)
+        self.results = results
+
+    def _stream(self, conn, query, name="names"):
+        for row in self.results[name]:
+            yield row
+
+
+class MockPool:
+    def __init__(self):
+        self.borrowed = 0
+        self.returned = 0
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            self.borrowed += 1
+        return object()
+
+    def putconn(self, conn):
+        with self.lock:
+            self.returned += 1
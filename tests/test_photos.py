@@ -0,0 +1,93 @@
+import io
+import os
+import tempfile
+import unittest
+
+from m3c import classes
+from m3c import photos
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+JPEG = b"\xff\xd8\xff\xe0" + b"\0" * 100
+
+
+class TestSave(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def read(self, photo, filename):
+        with open(os.path.join(photo.path(), filename), "rb") as f:
+            return f.read()
+
+    def test_type_comes_from_the_contents(self):
+        photo = photos.save(io.BytesIO(PNG), self.root, 7, "b")
+        self.assertEqual(photo.extension, "png")
+        self.assertEqual(self.read(photo, "photo.png"), PNG)
+        self.assertListEqual(os.listdir(photo.path()), ["photo.png"])
+
+        with self.assertRaises(photos.UploadError):
+            photos.save(io.BytesIO(b"GIF89a" + b"\0" * 10), self.root, 7, "b")
+
+    def test_replaces_photos_of_the_other_type_and_thumbnails(self):
+        png = photos.save(io.BytesIO(PNG), self.root, 7, "b")
+        thumbnail = os.path.join(png.path(), png.thumbnail_filename())
+        with open(thumbnail, "wb") as f:
+            f.write(b"old thumbnail")
+
+        jpg = photos.save(io.BytesIO(JPEG), self.root, 7, "b")
+        self.assertListEqual(os.listdir(jpg.path()), ["photo.jpg"])
+
+    def test_too_large_uploads_leave_the_current_photo(self):
+        photo = photos.save(io.BytesIO(PNG), self.root, 7, "b")
+        with self.assertRaises(photos.UploadError):
+            photos.save(io.BytesIO(PNG + b"\0" * photos.CHUNK_SIZE),
+                        self.root, 7, "b", max_size=len(PNG) + 10)
+        self.assertListEqual(os.listdir(photo.path()), ["photo.png"])
+        self.assertEqual(self.read(photo, "photo.png"), PNG)
+
+    def test_worker_processes_in_the_background(self):
+        processed = []
+        make_thumbnail = photos.make_thumbnail
+        photos.make_thumbnail = processed.append
+        try:
+            worker = photos.Worker()
+            photo = classes.Photo(self.root, 7, "png", "b")
+            worker.submit(photo)
+            worker.join()
+            worker.stop()
+        finally:
+            photos.make_thumbnail = make_thumbnail
+        self.assertListEqual(processed, [photo])
+
+
+@unittest.skipUnless(Image, "requires Pillow")
+class TestMakeThumbnail(unittest.TestCase):
+    def test_rotates_the_thumbnail_and_keeps_the_photo(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise.
+        upload = io.BytesIO()
+        Image.new("RGB", (400, 200), "red").save(upload, "JPEG",
+                                                 exif=exif.tobytes())
+
+        with tempfile.TemporaryDirectory() as root:
+            photo = photos.save(io.BytesIO(upload.getvalue()), root, 7, "b")
+            self.assertTrue(photos.make_thumbnail(photo))
+
+            with open(os.path.join(photo.path(), photo.filename()), "rb") as f:
+                self.assertEqual(f.read(), upload.getvalue())
+            thumbnail = os.path.join(photo.path(), photo.thumbnail_filename())
+            with Image.open(thumbnail) as image:
+                self.assertEqual(image.size, (100, 200))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -120,6 +120,46 @@ class TestPrefill(unittest.TestCase):
         with self.assertRaises(prefill.AmbiguityError):
             prefill.add_organizations(cursor, rec)
 
+    def test_organization_cache(self):
+        cache = prefill.OrganizationCache([
+            (100, "University of Florida", mwb.INSTITUTE, None),
+        ])
+        cursor = MockDatabaseConnection().cursor()
+        rec = make_record(institute="University of Florida",
+                          department="Chemistry", laboratory="")
+
+        first = prefill.add_organizations(cursor, rec, cache)
+        self.assertListEqual(organizations, ["Chemistry"])
+        self.assertListEqual(first, [(100, 1, 0)])
+
+        second = prefill.add_organizations(cursor, rec, cache)
+        self.assertListEqual(organizations, ["Chemistry"])
+        self.assertListEqual(second, first)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+
+    def test_association_batch(self):
+        written = []
+
+        def associate_many(cursor, pairs):
+            written.append(list(pairs))
+            return [pair for pair in written[-1] if pair != (1, 10)]
+
+        old, prefill.db.associate_many = prefill.db.associate_many, \
+            associate_many
+        try:
+            batch = prefill.AssociationBatch(None, batch_size=2)
+            prefill.associate(batch, "PR1", 1, 10, 20, 0)
+            prefill.associate(batch, "PR2", 1, 10, 0, 30)
+            prefill.associate(batch, "PR3", 0, 10, 20, 30)
+            batch.flush()
+            batch.flush()
+        finally:
+            prefill.db.associate_many = old
+
+        self.assertListEqual(written, [[(1, 10), (1, 20)], [(1, 30)]])
+        self.assertDictEqual(batch.pending, {})
+
     def test_multiname_single_person(self):
         rec = make_record(last_name="Bond", first_name="James")
         cursor = MockDatabaseConnection().cursor()
@@ -192,5 +232,145 @@ def make_record(psid="PR123", pstype=mwb.PROJECT, first_name="", last_name="",
                           department, laboratory, email, phone)
 
 
+class TestBulkPrefill(unittest.TestCase):
+    """The bulk engine must reach the same result as the per-record path."""
+
+    def setUp(self):
+        self.memory = MemoryDatabase()
+        self.patched = {name: getattr(prefill.db, name)
+                        for name in MemoryDatabase.PATCHES}
+        self.get_person = prefill.get_person
+        for name in MemoryDatabase.PATCHES:
+            setattr(prefill.db, name, getattr(self.memory, name))
+        prefill.get_person = self.memory.get_person
+
+    def tearDown(self):
+        for name, func in self.patched.items():
+            setattr(prefill.db, name, func)
+        prefill.get_person = self.get_person
+
+    def test_matches_per_record_processing(self):
+        bulk = prefill.BulkPrefill(
+            [(pid, first, last) for pid, first, last in self.memory.names],
+            dict(self.memory.contacts),
+            [(oid, name, type, parent)
+             for oid, (type, name, parent) in self.memory.orgs.items()])
+        for rec in FIXTURES:
+            try:
+                bulk.add_record(rec)
+            except prefill.AmbiguityError:
+                continue
+
+        initial_associations = set(self.memory.associations)
+        prefill.process_projects_and_studies(MockWorkbench(), None, [],
+                                             batch_size=2)
+
+        added_people = {pid: (first, last)
+                        for pid, first, last in self.memory.names
+                        if pid in self.memory.added_people}
+        self.assertDictEqual(bulk.new_people, added_people)
+        self.assertDictEqual(bulk.contacts, self.memory.contacts)
+        self.assertSetEqual(bulk.updated_contacts, {1})
+
+        added_orgs = {oid: org for oid, org in self.memory.orgs.items()
+                      if oid in self.memory.added_orgs}
+        self.assertDictEqual(bulk.new_organizations, added_orgs)
+
+        self.assertSetEqual(set(bulk.associations) | initial_associations,
+                            self.memory.associations)
+        self.assertIn((4, 1), self.memory.associations)
+
+
+FIXTURES = [
+    make_record("PR1", first_name="James", last_name="Bond",
+                institute="UF", department="Chemistry", laboratory="Smith",
+                email="007@mi6.gov.uk"),
+    # Existing person, different phone and case.
+    make_record("PR2", first_name="ada", last_name="LOVELACE",
+                institute="UF", department="Chemistry", phone="555-1234"),
+    # Ambiguous: two people share this name.
+    make_record("PR3", first_name="John", last_name="Smith",
+                institute="FSU"),
+    make_record("ST4", pstype=mwb.STUDY,
+                first_name="James;Jane", last_name="Bond;Doe",
+                institute="UF;FSU", department="Physics;Biology",
+                laboratory="Curie;", email="bond@example.com"),
+    # Ambiguous hierarchy: the person is still added.
+    make_record("ST5", pstype=mwb.STUDY, first_name="Grace",
+                last_name="Hopper", institute="UF;FSU",
+                department="Biology", laboratory="Bobby"),
+    make_record("PR6", first_name="Grace", last_name="Hopper",
+                institute="Navy", laboratory="Computing"),
+    # The same as "Mary" "Ann Smith": names are matched as a whole.
+    make_record("PR7", first_name="Mary Ann", last_name="Smith",
+                institute="UF"),
+]
+
+
+class MemoryDatabase:
+    """In-memory stand-in for the functions `prefill` uses from `db`."""
+
+    PATCHES = ["get_contact_details", "update_contact_details", "add_person",
+               "get_organization", "get_organizations", "add_organization",
+               "associate_many"]
+
+    def __init__(self):
+        self.names = [(1, "Ada", "Lovelace"), (2, "John", "Smith"),
+                      (3, "John", "Smith "), (4, "Mary", "Ann Smith")]
+        self.contacts = {1: ("ada@example.com", ""), 2: ("", ""),
+                         3: ("", ""), 4: ("", "")}
+        self.orgs = {1: (mwb.INSTITUTE, "UF", None),
+                     2: (mwb.DEPARTMENT, "Chemistry", 1)}
+        self.associations = {(1, 1)}
+        self.added_people: List[int] = []
+        self.added_orgs: List[int] = []
+
+    def get_person(self, cursor, first_name, last_name,
+                   exclude_withheld=True):
+        key = prefill.db.namekey(first_name, last_name)
+        return [pid for pid, first, last in self.names
+                if prefill.db.namekey(first, last) == key]
+
+    def get_contact_details(self, cursor, person_id):
+        return self.contacts[person_id]
+
+    def update_contact_details(self, cursor, person_id, email, phone):
+        self.contacts[person_id] = (email, phone)
+        return True
+
+    def add_person(self, cursor, first_name, last_name, email, phone):
+        pid = max(self.contacts) + 1
+        self.names.append((pid, first_name, last_name))
+        self.contacts[pid] = (email, phone)
+        self.added_people.append(pid)
+        return pid
+
+    def get_organization(self, cursor, type, name, parent_id=None):
+        for oid, org in self.orgs.items():
+            if org == (type, name, parent_id or None):
+                return oid
+        return 0
+
+    def get_organizations(self, cursor):
+        return [(oid, name, type, parent_id, False)
+                for oid, (type, name, parent_id) in self.orgs.items()]
+
+    def add_organization(self, cursor, type, name, parent_id=None):
+        oid = max(self.orgs) + 1
+        self.orgs[oid] = (type, name, parent_id)
+        self.added_orgs.append(oid)
+        return oid
+
+    def associate_many(self, cursor, pairs):
+        added = [pair for pair in pairs if pair not in self.associations]
+        self.associations.update(added)
+        return added
+
+
+class MockWorkbench:
+    def fetch_names(self):
+        return iter(FIXTURES)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,301 @@
+import concurrent.futures
+import datetime
+import http.server
+import threading
+import typing
+import unittest
+import xml.etree.ElementTree as ET
+
+from m3c import catalyst
+from m3c import pubfetch
+from m3c import schedule
+
+
+Dict = typing.Dict
+List = typing.List
+
+
+class TestUpdateAuthorships(unittest.TestCase):
+    def setUp(self):
+        self.patched = {name: getattr(pubfetch.db, name) for name in PATCHES}
+        for name in PATCHES:
+            setattr(pubfetch.db, name, getattr(database, name))
+        self.get_pubmed_ids = pubfetch.get_pubmed_ids
+        pubfetch.get_pubmed_ids = get_pubmed_ids
+        database.reset()
+
+    def tearDown(self):
+        for name, func in self.patched.items():
+            setattr(pubfetch.db, name, func)
+        pubfetch.get_pubmed_ids = self.get_pubmed_ids
+
+    def run_pubfetch(self, limit=-1, resume=False, client=None):
+        pubfetch.update_authorships(MockCursor(), schedule.Schedule(),
+                                    schedule.Budget(limit),
+                                    client or MockClient(),
+                                    checkpoint_size=2, resume=resume)
+
+    def test_commits_in_chunks(self):
+        self.run_pubfetch()
+        self.assertListEqual(database.commits, [
+            [],  # The run itself.
+            [1, 2],
+            [3, 4],
+            [5],
+            [],  # Finishing the run.
+        ])
+        self.assertEqual(set(database.authorships), {1, 2, 3, 4, 5})
+        self.assertListEqual(database.pending, [])
+        self.assertTrue(database.finished)
+
+    def test_catalyst_results_are_recorded(self):
+        database.confirmed[2] = (["100"], [])
+        self.run_pubfetch()
+        self.assertListEqual(database.authorships[2], ["100", "200"])
+        self.assertListEqual(database.authorships[1], ["1"])
+
+    def test_excluded_pmids_without_included_ones_skip_catalyst(self):
+        database.confirmed[3] = ([], ["3"])
+        self.run_pubfetch()
+        self.assertIn(3, searched)
+        self.assertListEqual(database.authorships[3], [])
+        self.assertTrue(database.finished)
+
+    def test_failed_catalyst_requests_keep_the_authorships(self):
+        database.confirmed[2] = (["100"], [])
+        database.authorships[2] = ["100", "7"]
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                                 FailingCatalyst)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        host, port = server.server_address
+        client = catalyst.Client(endpoint=f"http://{host}:{port}/",
+                                 timeout=5, retries=1, backoff=0)
+        try:
+            self.run_pubfetch(client=client)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertListEqual(database.authorships[2], ["100", "7"])
+        self.assertListEqual(database.pending, [2])
+        self.assertFalse(database.finished)
+
+    def test_resume_continues_where_the_last_run_stopped(self):
+        self.run_pubfetch(limit=3)
+        self.assertEqual(set(database.authorships), {1, 2, 3})
+        self.assertListEqual(database.pending, [4, 5])
+        self.assertFalse(database.finished)
+
+        searched.clear()
+        self.run_pubfetch(resume=True)
+        self.assertListEqual(searched, [4, 5])
+        self.assertListEqual(database.pending, [])
+        self.assertTrue(database.finished)
+
+    def test_cached_searches_are_free(self):
+        cached.update({1, 2, 3})
+        self.run_pubfetch(limit=1)
+        self.assertEqual(set(database.authorships), {1, 2, 3, 4})
+        self.assertListEqual(database.pending, [5])
+
+    def test_resume_skips_authors_withheld_since(self):
+        self.run_pubfetch(limit=3)
+        database.people[5] = ("First5", "Last5", "", "", "", True, "")
+
+        searched.clear()
+        self.run_pubfetch(resume=True)
+        self.assertListEqual(searched, [4])
+        self.assertListEqual(database.pending, [])
+
+
+class TestFetchPublications(unittest.TestCase):
+    def setUp(self):
+        self.patched = {name: getattr(pubfetch.db, name)
+                        for name in DOWNLOAD_PATCHES}
+        for name in DOWNLOAD_PATCHES:
+            setattr(pubfetch.db, name, getattr(downloads, name))
+        self.pubmed_efetch = pubfetch.pubmed_efetch
+        pubfetch.pubmed_efetch = downloads.pubmed_efetch
+        self.pmids = pubfetch.tools.MetabolomicsToolsWiki.pmids
+        pubfetch.tools.MetabolomicsToolsWiki.pmids = lambda: []
+        downloads.reset()
+
+    def tearDown(self):
+        for name, func in self.patched.items():
+            setattr(pubfetch.db, name, func)
+        pubfetch.pubmed_efetch = self.pubmed_efetch
+        pubfetch.tools.MetabolomicsToolsWiki.pmids = self.pmids
+
+    def run_pubfetch(self):
+        pubfetch.fetch_publications(MockCursor(), schedule.Schedule(),
+                                    schedule.Budget(-1), max_attempts=3)
+
+    def test_gives_up_after_max_attempts(self):
+        for _ in range(5):
+            self.run_pubfetch()
+        self.assertListEqual(downloads.fetched, [["1", "2"]] * 3)
+        self.assertDictEqual(downloads.retries, {"1": 3, "2": 3})
+
+    def test_successful_retries_are_dequeued(self):
+        self.run_pubfetch()
+        downloads.failing = False
+        self.run_pubfetch()
+        self.run_pubfetch()
+        self.assertListEqual(downloads.fetched, [["1", "2"]] * 2)
+        self.assertDictEqual(downloads.retries, {})
+
+
+class MockDownloads:
+    """Publications "1" and "2" are due; downloading fails if `failing`."""
+
+    def reset(self):
+        self.failing = True
+        self.fetched: List[List[str]] = []
+        self.retries: Dict[str, int] = {}
+        self.downloaded: Dict[str, tuple] = {}
+
+    def get_pubmed_authorships(self, cursor):
+        return {"1": [1], "2": [2]}
+
+    def get_pubmed_download_timestamps(self, cursor):
+        return self.downloaded
+
+    def get_publication_retries(self, cursor):
+        return list(self.retries.items())
+
+    def enqueue_publication_retries(self, cursor, pmids, error):
+        for pmid in pmids:
+            self.retries[pmid] = self.retries.get(pmid, 0) + 1
+
+    def dequeue_publication_retries(self, cursor, pmids):
+        for pmid in pmids:
+            self.retries.pop(pmid, None)
+
+    def replace_pubmed_authors(self, cursor, authors):
+        pass
+
+    def pubmed_efetch(self, pmids):
+        self.fetched.append(sorted(pmids))
+        if self.failing:
+            raise OSError("PubMed is down")
+        # Downloaded, so not due again for a while.
+        now = datetime.datetime.now()
+        self.downloaded.update((pmid, (now, 0)) for pmid in pmids)
+        return ET.ElementTree(ET.Element("PubmedArticleSet"))
+
+
+downloads = MockDownloads()
+
+DOWNLOAD_PATCHES = [
+    "get_pubmed_authorships", "get_pubmed_download_timestamps",
+    "get_publication_retries", "enqueue_publication_retries",
+    "dequeue_publication_retries", "replace_pubmed_authors",
+]
+
+PATCHES = [
+    "get_pubfetch_authors", "get_pubfetch_pending", "start_pubfetch_run",
+    "remove_pubfetch_pending", "finish_pubfetch_run", "update_authorships",
+]
+
+searched: List[int] = []
+# People whose searches are answered from the response cache.
+cached: typing.Set[int] = set()
+
+
+class MockDatabase:
+    def reset(self):
+        self.people = {i: (f"First{i}", f"Last{i}", "", "", "", False, "")
+                       for i in range(1, 6)}
+        self.confirmed: Dict[int, tuple] = {}
+        self.authorships: Dict[int, List[str]] = {}
+        self.pending: List[int] = []
+        self.finished = True
+        self.commits: List[List[int]] = []
+        self.uncommitted: List[int] = []
+        searched.clear()
+        cached.clear()
+
+    def commit(self):
+        self.commits.append(self.uncommitted)
+        self.uncommitted = []
+
+    def get_pubfetch_authors(self, cursor, base, maximum, person_ids=None):
+        if person_ids is None:
+            person_ids = list(self.people)
+        authors = []
+        for i in person_ids:
+            if i not in self.people or self.people[i][5]:
+                continue
+            include, exclude = self.confirmed.get(i, ([], []))
+            authors.append((i, self.people[i][0], self.people[i][1], "",
+                            ["UF"], include, exclude, [], None, 0))
+        return authors
+
+    def get_pubfetch_pending(self, cursor):
+        if self.finished:
+            return None
+        return (1, list(self.pending))
+
+    def start_pubfetch_run(self, cursor, person_ids):
+        self.pending = list(person_ids)
+        self.finished = False
+        return 1
+
+    def remove_pubfetch_pending(self, cursor, run_id, person_ids):
+        self.pending = [i for i in self.pending if i not in person_ids]
+
+    def finish_pubfetch_run(self, cursor, run_id):
+        self.pending = []
+        self.finished = True
+
+    def update_authorships(self, cursor, authorships, unchanged=None):
+        self.authorships.update(authorships)
+        self.uncommitted.extend(authorships)
+        return sum(len(pmids) for pmids in authorships.values()), 0
+
+
+database = MockDatabase()
+
+
+def get_pubmed_ids(first_name, last_name, affiliations, budget=None):
+    person_id = int(last_name[len("Last"):])
+    if budget and person_id not in cached:
+        budget.charge()
+    searched.append(person_id)
+    return [str(person_id)]
+
+
+class MockClient:
+    def submit(self, person, affiliations, include_pmids, exclude_pmids):
+        future = concurrent.futures.Future()
+        future.set_result(include_pmids + [str(int(include_pmids[0]) + 100)])
+        return future
+
+
+class FailingCatalyst(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(500)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockConnection:
+    def commit(self):
+        database.commit()
+
+    def rollback(self):
+        database.uncommitted = []
+
+
+class MockCursor:
+    connection = MockConnection()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import datetime
+import unittest
+
+from m3c import schedule
+
+
+DAY = datetime.timedelta(days=1)
+NOW = datetime.datetime(2020, 5, 1, tzinfo=datetime.timezone.utc)
+
+
+class TestSchedule(unittest.TestCase):
+    def setUp(self):
+        self.sched = schedule.Schedule(base=10 * DAY, maximum=100 * DAY)
+
+    def test_interval_doubles_when_unchanged(self):
+        self.assertEqual(self.sched.interval(0), 10 * DAY)
+        self.assertEqual(self.sched.interval(1), 20 * DAY)
+        self.assertEqual(self.sched.interval(3), 80 * DAY)
+
+    def test_interval_is_capped(self):
+        self.assertEqual(self.sched.interval(4), 100 * DAY)
+        self.assertEqual(self.sched.interval(1000), 100 * DAY)
+
+    def test_overdue_skips_items_not_yet_due(self):
+        items = {
+            "fresh": (NOW - 5 * DAY, 0),
+            "stable": (NOW - 30 * DAY, 2),
+            "stale": (NOW - 30 * DAY, 0),
+        }
+        self.assertListEqual(self.sched.overdue(items, NOW), ["stale"])
+
+    def test_overdue_orders_most_overdue_first(self):
+        items = {
+            "a": (NOW - 11 * DAY, 0),
+            "b": (NOW - 50 * DAY, 0),
+            "c": (NOW - 25 * DAY, 0),
+            "d": (None, 0),
+        }
+        self.assertListEqual(self.sched.overdue(items, NOW),
+                             ["d", "b", "c", "a"])
+
+    def test_unchanged_streak(self):
+        self.assertEqual(schedule.unchanged_streak((None, 0), False), 0)
+        self.assertEqual(schedule.unchanged_streak((NOW, 2), False), 3)
+        self.assertEqual(schedule.unchanged_streak((NOW, 2), True), 0)
+
+
+class TestBudget(unittest.TestCase):
+    def test_unlimited(self):
+        budget = schedule.Budget()
+        for _ in range(1000):
+            self.assertTrue(budget.spend())
+        self.assertFalse(budget.exhausted)
+
+    def test_limited(self):
+        budget = schedule.Budget(2)
+        self.assertTrue(budget.spend())
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+        self.assertTrue(budget.exhausted)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,437 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from flask import Flask
+import psycopg2
+
+from m3c import cache
+from m3c import classes
+from m3c import server
+
+
+TEMPLATES = os.path.join(os.path.dirname(server.__file__), "templates")
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.pool = MockPool()
+        self.saved = (server.pool, server.db.get_overview,
+                      server.db.update_overview, server.db.search_people,
+                      server.db.get_person_publications,
+                      server.db.replace_publications,
+                      server.db.get_organizations, server.views,
+                      server.db.set_people_withheld, server.db.add_names,
+                      server.db.delete_names,
+                      server.db.associate_organizations)
+        server.pool = self.pool
+        server.views = cache.MemoryCache()
+        app = Flask(__name__, template_folder=TEMPLATES)
+        app.register_blueprint(server.app)
+        self.app = app
+
+    def tearDown(self):
+        (server.pool, server.db.get_overview,
+         server.db.update_overview, server.db.search_people,
+         server.db.get_person_publications,
+         server.db.replace_publications,
+         server.db.get_organizations, server.views,
+         server.db.set_people_withheld, server.db.add_names,
+         server.db.delete_names,
+         server.db.associate_organizations) = self.saved
+
+    def test_connection_is_returned_after_each_request(self):
+        server.db.get_overview = lambda cur, person_id: f"#{person_id}"
+        client = self.app.test_client()
+        for person_id in (1, 2):
+            response = client.get(f"/personoverview?person_id={person_id}")
+            self.assertEqual(response.get_json(),
+                             {"overview": f"#{person_id}"})
+        self.assertEqual(self.pool.borrowed, 2)
+        self.assertEqual(self.pool.returned, 2)
+        self.assertEqual(self.pool.rollbacks, 2)
+
+    def test_connection_is_returned_when_the_request_fails(self):
+        def fail(cur, person_id, overview):
+            raise RuntimeError("boom")
+
+        server.db.update_overview = fail
+        response = self.app.test_client().post(
+            "/personoverview", json={"id": 1, "overview": "text"})
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.pool.borrowed, 1)
+        self.assertEqual(self.pool.returned, 1)
+
+    def test_concurrent_requests_use_their_own_connections(self):
+        both = threading.Barrier(2, timeout=5)
+        used = []
+
+        def get_overview(cur, person_id):
+            used.append(cur.connection)
+            both.wait()
+            return ""
+
+        server.db.get_overview = get_overview
+
+        def get():
+            self.app.test_client().get("/personoverview?person_id=1")
+
+        threads = [threading.Thread(target=get) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertFalse(both.broken)
+        self.assertEqual(len(used), 2)
+        self.assertIsNot(used[0], used[1])
+        self.assertEqual(self.pool.returned, 2)
+
+    def test_api_people_pages_with_a_cursor(self):
+        people = [(pid, f"Person {pid}", "", False) for pid in range(1, 6)]
+        searches = []
+
+        def search_people(cur, text, limit, after):
+            searches.append((text, limit, after))
+            return [row for row in people if row[0] > after][:limit]
+
+        server.db.search_people = search_people
+        client = self.app.test_client()
+
+        first = client.get("/api/people?q=person&limit=2").get_json()
+        self.assertListEqual([r["id"] for r in first["results"]], [1, 2])
+        self.assertEqual(first["next"], 2)
+
+        last = client.get(f"/api/people?limit=4&cursor={first['next']}")
+        last = last.get_json()
+        self.assertListEqual([r["id"] for r in last["results"]], [3, 4, 5])
+        self.assertIsNone(last["next"])
+        self.assertListEqual(searches, [("person", 3, 0), ("", 5, 2)])
+
+    def test_api_rejects_bad_parameters(self):
+        client = self.app.test_client()
+        for query in ("limit=x", "limit=0", "cursor=-1"):
+            response = client.get(f"/api/people?{query}")
+            self.assertEqual(response.status_code, 400)
+        response = client.get("/api/organizations?type=company")
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_pmid_loads_one_person(self):
+        server.db.get_person_publications = \
+            lambda cur, person_id: (["1", "2"], [str(person_id)])
+        response = self.app.test_client().get("/addpmid?person_id=7")
+        self.assertEqual(response.get_json(),
+                         {"include": ["1", "2"], "exclude": ["7"]})
+
+    def test_add_pmid_replaces_publications(self):
+        replaced = []
+
+        def replace_publications(cur, person_id, include, exclude):
+            replaced.append((person_id, list(include), list(exclude)))
+
+        server.db.replace_publications = replace_publications
+        self.app.secret_key = "test"
+        response = self.app.test_client().post("/addpmid", data={
+            "id": "7", "name": "Ann", "inclpmid": "1, 2,3", "exclpmid": "",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.location.endswith("/addpmid?person=7"))
+        self.assertListEqual(replaced, [(7, ["1", "2", "3"], [])])
+
+    def test_organizations_are_cached_until_written(self):
+        loads = []
+
+        def get_organizations(cur):
+            loads.append(1)
+            return [(2, "Chemistry", "department", 1, False),
+                    (1, "UF", "institute", None, False)]
+
+        server.db.get_organizations = get_organizations
+        client = self.app.test_client()
+        for _ in range(2):
+            response = client.get("/withheldorgs")
+            self.assertIn(b"Chemistry", response.data)
+        self.assertEqual(len(loads), 1)
+
+        response = client.post("/withheldorgs",
+                               json={"checked": True, "id": "2"})
+        self.assertEqual(response.data, b"OK")
+        client.get("/parentorganization")
+        self.assertEqual(len(loads), 2)
+
+        server.on_change("people")
+        client.get("/withheldorgs")
+        self.assertEqual(len(loads), 2)
+        server.on_change(None)
+        client.get("/withheldorgs")
+        self.assertEqual(len(loads), 3)
+
+        # The pages' rendered rows are cached along with the lists.
+        stats = client.get("/api/cachestats").get_json()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 7))
+
+    def test_people_rows_are_rendered_once_per_version(self):
+        saved = server.cached_people
+        server.cached_people = lambda: people
+        people = [(1, "Ann Lee", "ann@ufl.edu", False)]
+        client = self.app.test_client()
+        try:
+            self.assertIn(b"Ann Lee", client.get("/withheldpeople").data)
+            people = [(2, "Bo <Ng>", "", True)]
+            self.assertIn(b"Ann Lee", client.get("/withheldpeople").data)
+            server.on_change("people")
+            page = client.get("/withheldpeople").data
+        finally:
+            server.cached_people = saved
+        self.assertNotIn(b"Ann Lee", page)
+        self.assertIn(b"Bo &lt;Ng&gt;", page)
+        self.assertIn(b'id="check-2" checked', page)
+
+    def test_responses_are_compressed_when_accepted(self):
+        server.db.get_overview = lambda cur, person_id: "text " * 1000
+        client = self.app.test_client()
+        url = "/personoverview?person_id=1"
+
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(json.loads(gzip.decompress(response.data)),
+                         {"overview": "text " * 1000})
+
+        response = client.get(url)
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.get_json(), {"overview": "text " * 1000})
+
+        server.db.get_overview = lambda cur, person_id: "short"
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_bulk_withholding_reports_each_person(self):
+        calls = []
+
+        def set_people_withheld(cur, ids, withheld):
+            calls.append(list(ids))
+            if 3 in ids:
+                raise psycopg2.IntegrityError("names clash")
+            return [id for id in ids if id != 2]
+
+        server.db.set_people_withheld = set_people_withheld
+        response = self.app.test_client().post(
+            "/api/withheld/people", json={"ids": [1, 2, 3, 1],
+                                          "withheld": True})
+        self.assertListEqual(response.get_json()["results"], [
+            {"id": 1, "ok": True},
+            {"id": 2, "ok": False, "error": "not found"},
+            {"id": 3, "ok": False, "error": "names clash"},
+        ])
+        # One statement for all, then one per person to find the clash.
+        self.assertListEqual(calls, [[1, 2, 3], [1], [2], [3]])
+
+        for data in ({"ids": [1], "withheld": "yes"},
+                     {"ids": "123", "withheld": True},
+                     {"ids": [True], "withheld": True},
+                     {"ids": ["1"], "withheld": True}):
+            response = self.app.test_client().post("/api/withheld/people",
+                                                   json=data)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(calls), 4)
+
+    def test_bulk_aliases(self):
+        server.db.add_names = lambda cur, names: names[:1]
+        server.db.delete_names = lambda cur, names: names
+        response = self.app.test_client().post("/api/aliases", json={
+            "add": [{"id": 1, "first": " Ann ", "last": "Lee"},
+                    {"id": 2, "first": "Bo", "last": "Ng"}],
+            "delete": [{"id": 1, "first": "Anne", "last": "Lee"}],
+        })
+        self.assertEqual(response.get_json(), {
+            "add": [
+                {"id": 1, "first": "Ann", "last": "Lee", "ok": True},
+                {"id": 2, "first": "Bo", "last": "Ng", "ok": False,
+                 "error": "name in use"},
+            ],
+            "delete": [
+                {"id": 1, "first": "Anne", "last": "Lee", "ok": True},
+            ],
+        })
+
+        for alias in ({"id": 1, "first": ""},
+                      {"id": True, "first": "Ann", "last": "Lee"},
+                      {"id": "1", "first": "Ann", "last": "Lee"}):
+            response = self.app.test_client().post("/api/aliases",
+                                                   json={"add": [alias]})
+            self.assertEqual(response.status_code, 400)
+
+    def test_single_alias_routes_wrap_the_bulk_operations(self):
+        server.db.add_names = lambda cur, names: []
+        response = self.app.test_client().post(
+            "/personalias", json={"id": "1", "first": "Ann", "last": "Lee"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.pool.rollbacks, 2)
+
+    def test_associate_person_upserts_the_organizations_at_once(self):
+        calls = []
+
+        def associate_organizations(cur, person_id, *organizations):
+            calls.append((person_id,) + organizations)
+            return 1, 2, None
+
+        server.db.associate_organizations = associate_organizations
+        self.app.secret_key = "test"
+        client = self.app.test_client()
+        form = {"id": "7", "institute": "UF", "department": " Chemistry ",
+                "lab": ""}
+        response = client.post("/associateperson", data=form)
+        self.assertEqual(response.status_code, 302)
+        self.assertListEqual(calls, [(7, "UF", "Chemistry", "")])
+
+        form.update(institute="", lab="Smith Lab")
+        client.post("/associateperson", data=form)
+        self.assertEqual(len(calls), 1)
+        with client.session_transaction() as session:
+            self.assertIn("Institution", str(session["_flashes"]))
+
+
+class TestPhotos(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.saved = server.picture_path
+        server.picture_path = self.tmpdir.name
+        app = Flask(__name__)
+        app.register_blueprint(server.app)
+        app.secret_key = "test"
+        self.client = app.test_client()
+
+        photo = classes.Photo(self.tmpdir.name, 7, "png",
+                              server.file_storage_alias)
+        os.makedirs(photo.path())
+        self.photo = photo
+
+    def tearDown(self):
+        server.picture_path = self.saved
+        self.tmpdir.cleanup()
+
+    def write(self, filename, data):
+        with open(os.path.join(self.photo.path(), filename), "wb") as f:
+            f.write(data)
+
+    def test_revalidation_skips_the_transfer(self):
+        self.write(self.photo.filename(), b"full")
+        response = self.client.get("/photo?id=7")
+        self.assertEqual(response.data, b"full")
+        self.assertEqual(response.mimetype, "image/png")
+        self.assertIn("max-age", response.headers["Cache-Control"])
+        etag = response.headers["ETag"]
+        response.close()
+
+        response = self.client.get("/photo?id=7",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        self.write(self.photo.filename(), b"new photo")
+        response = self.client.get("/photo?id=7",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.data, b"new photo")
+        response.close()
+
+    def test_thumbnails(self):
+        self.write(self.photo.filename(), b"full")
+        response = self.client.get("/photo?id=7&size=thumb")
+        self.assertEqual(response.data, b"full")
+        self.assertTrue(response.cache_control.no_cache)
+        self.assertIsNone(response.cache_control.max_age)
+        response.close()
+
+        self.write(self.photo.thumbnail_filename(), b"thumb")
+        response = self.client.get("/photo?id=7&size=thumb")
+        self.assertEqual(response.data, b"thumb")
+        self.assertEqual(response.cache_control.max_age, server.photo_max_age)
+        response.close()
+
+    def test_upload_stores_and_queues_the_photo(self):
+        submitted = []
+        saved = server.photo_worker
+        server.photo_worker = MockWorker(submitted)
+        try:
+            response = self.client.post("/uploadimage", data={
+                "person_id": " 7 ",
+                "picture": (io.BytesIO(b"\x89PNG\r\n\x1a\nimage"), "a.jpg"),
+            })
+        finally:
+            server.photo_worker = saved
+        self.assertEqual(response.status_code, 302)
+        self.assertListEqual([p.person_id for p in submitted], [7])
+        with open(os.path.join(self.photo.path(), "photo.png"), "rb") as f:
+            self.assertEqual(f.read(), b"\x89PNG\r\n\x1a\nimage")
+
+    def test_missing_photos(self):
+        self.assertEqual(self.client.get("/photo?id=8").status_code, 404)
+        self.assertEqual(self.client.get("/photo").status_code, 400)
+
+
+class MockWorker:
+    def __init__(self, submitted):
+        self.submit = submitted.append
+
+
+class MockPool:
+    def __init__(self):
+        self.borrowed = 0
+        self.returned = 0
+        self.rollbacks = 0
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            self.borrowed += 1
+        return MockConnection(self)
+
+    def putconn(self, conn):
+        with self.lock:
+            self.returned += 1
+
+
+class MockConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = 0
+
+    def cursor(self):
+        return MockCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        with self.pool.lock:
+            self.pool.rollbacks += 1
+
+
+class MockCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        pass
+
+    def __iter__(self):
+        return iter([])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+if __name__ == "__main__":
+    unittest.main()
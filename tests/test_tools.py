@@ -0,0 +1,101 @@
+import os
+import tempfile
+import typing
+import unittest
+
+from m3c import tools
+
+
+MTW = tools.MetabolomicsToolsWiki
+
+CSV = "Software,PMID\nXCMS,16448051\nMZmine,\n"
+
+
+class TestMetabolomicsToolsWiki(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "mtw.csv")
+        self.get = tools.requests.get
+        tools.requests.get = get
+        requests.clear()
+        MTW.configure()
+
+    def tearDown(self):
+        tools.requests.get = self.get
+        MTW.configure()
+        self.tmpdir.cleanup()
+
+    def test_downloads_once_per_process(self):
+        self.assertListEqual(list(MTW.pmids()), ["16448051"])
+        self.assertEqual(len(list(MTW.tools())), 2)
+        MTW.json()
+        self.assertEqual(len(requests), 1)
+
+    def test_unchanged_sheet_is_read_from_disk(self):
+        MTW.configure(cache_path=self.path)
+        MTW.download()
+        self.assertTrue(os.path.isfile(self.path))
+
+        MTW.configure(cache_path=self.path)
+        self.assertEqual(MTW.download(), CSV)
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1].get("If-None-Match"), '"v1"')
+
+    def test_offline_mode_uses_snapshot(self):
+        with open(self.path, "w") as f:
+            f.write(CSV)
+        MTW.configure(cache_path=self.path, offline=True)
+        self.assertListEqual(list(MTW.pmids()), ["16448051"])
+        self.assertEqual(len(requests), 0)
+
+    def test_falls_back_to_disk_copy_on_failure(self):
+        MTW.configure(cache_path=self.path)
+        MTW.download()
+
+        MTW.configure(cache_path=self.path)
+        tools.requests.get = fail
+        self.assertEqual(MTW.download(), CSV)
+
+    def test_offline_mode_requires_a_snapshot(self):
+        MTW.configure(cache_path=self.path, offline=True)
+        with self.assertRaises(FileNotFoundError):
+            MTW.download()
+
+    def test_failed_download_is_not_repeated(self):
+        tools.requests.get = fail
+        self.assertListEqual(list(MTW.pmids()), [])
+        self.assertListEqual(list(MTW.tools()), [])
+        self.assertEqual(MTW.download(), "")
+        self.assertEqual(len(requests), 1)
+
+        MTW.configure()
+        tools.requests.get = get
+        self.assertEqual(MTW.download(), CSV)
+        self.assertEqual(len(requests), 2)
+
+
+requests: typing.List[typing.Mapping[str, str]] = []
+
+
+class MockResponse:
+    def __init__(self, status_code, text="", headers={}):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = text
+        self.headers = headers
+
+
+def get(url, headers={}, timeout=None):
+    requests.append(headers)
+    if headers.get("If-None-Match") == '"v1"':
+        return MockResponse(304)
+    return MockResponse(200, CSV, {"ETag": '"v1"'})
+
+
+def fail(url, headers={}, timeout=None):
+    requests.append(headers)
+    raise tools.requests.ConnectionError("offline")
+
+
+if __name__ == "__main__":
+    unittest.main()